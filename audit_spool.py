@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AuditSpool:
+    """
+    Local append-only spool of audit and feedback records.
+
+    Records are appended to a SQLite database in WAL mode, which takes tens
+    of microseconds and does not depend on Snowflake. A loader reads them back
+    in id order with `pending()` and deletes them with `ack()` only after they
+    were written to the warehouse, so a record survives a failed load or a
+    restart and is loaded at least once. Records the warehouse keeps rejecting
+    are moved to a `dead_letter` table with `dead_letter()`, so they stop
+    blocking the records behind them; `dead_letters()` lists them and
+    `requeue()` puts them back in their original place in the spool.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "kind TEXT NOT NULL, "
+            "record TEXT NOT NULL, "
+            "created REAL NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "first_failed REAL)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(spool)")}
+        if "first_failed" not in columns:
+            # Spools written before failures were timed
+            self._conn.execute("ALTER TABLE spool ADD COLUMN first_failed REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spool_kind ON spool (kind, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            "id INTEGER PRIMARY KEY, "
+            "kind TEXT NOT NULL, "
+            "record TEXT NOT NULL, "
+            "created REAL NOT NULL, "
+            "attempts INTEGER NOT NULL, "
+            "failed REAL NOT NULL, "
+            "error TEXT)"
+        )
+
+    def append(self, kind: str, record: dict) -> int:
+        payload = json.dumps(record, default=str)
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO spool (kind, record, created) VALUES (?, ?, ?)",
+                (kind, payload, time.time()),
+            ).lastrowid
+
+    def pending(self, kind: str, limit: int) -> list:
+        """
+        Oldest `limit` records of `kind` as `(id, record, attempts, first_failed)` tuples;
+        `first_failed` is the time of the first failed load, None before any.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, record, attempts, first_failed FROM spool WHERE kind = ? ORDER BY id LIMIT ?",
+                (kind, limit),
+            ).fetchall()
+        return [(spool_id, json.loads(record), attempts, first_failed) for spool_id, record, attempts, first_failed in rows]
+
+    def ack(self, ids: list):
+        if not ids:
+            return
+        with self._lock:
+            self._conn.executemany("DELETE FROM spool WHERE id = ?", [(spool_id,) for spool_id in ids])
+
+    def retry(self, ids: list):
+        """Count a failed load of the records; they stay in the spool"""
+        if not ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE spool SET attempts = attempts + 1, first_failed = COALESCE(first_failed, ?) WHERE id = ?",
+                [(now, spool_id) for spool_id in ids],
+            )
+
+    def dead_letter(self, ids: list, error: str = None):
+        """Move the records out of the spool into the dead letters"""
+        if not ids:
+            return
+        params = [(time.time(), error, spool_id) for spool_id in ids]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO dead_letter (id, kind, record, created, attempts, failed, error) "
+                    "SELECT id, kind, record, created, attempts, ?, ? FROM spool WHERE id = ?",
+                    params,
+                )
+                self._conn.executemany("DELETE FROM spool WHERE id = ?", [(spool_id,) for spool_id in ids])
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def dead_letters(self, kind: str = None, limit: int = 100) -> list:
+        """Oldest `limit` dead letters, of `kind` or of every kind"""
+        query = "SELECT id, kind, record, created, attempts, failed, error FROM dead_letter"
+        params = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id LIMIT ?", params + (limit,)).fetchall()
+        return [
+            {"id": spool_id, "kind": row_kind, "record": json.loads(record), "created": created,
+             "attempts": attempts, "failed": failed, "error": error}
+            for spool_id, row_kind, record, created, attempts, failed, error in rows
+        ]
+
+    def requeue(self, kind: str = None, ids: list = None) -> list:
+        """
+        Move dead letters, of `kind` and/or with the given ids, back into the spool under
+        their original id, with their attempts reset; returns them as `(id, kind, record)`.
+        """
+        where, params = [], []
+        if kind is not None:
+            where.append("kind = ?")
+            params.append(kind)
+        if ids is not None:
+            if not ids:
+                return []
+            where.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        condition = (" WHERE " + " AND ".join(where)) if where else ""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                rows = self._conn.execute(f"SELECT id, kind, record FROM dead_letter{condition}", params).fetchall()
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO spool (id, kind, record, created, attempts) "
+                    f"SELECT id, kind, record, created, 0 FROM dead_letter{condition}",
+                    params,
+                )
+                self._conn.execute(f"DELETE FROM dead_letter{condition}", params)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return [(spool_id, row_kind, json.loads(record)) for spool_id, row_kind, record in rows]
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*), MIN(created), MAX(attempts) FROM spool GROUP BY kind"
+            ).fetchall()
+            dead = dict(self._conn.execute("SELECT kind, COUNT(*) FROM dead_letter GROUP BY kind").fetchall())
+        now = time.time()
+        counts = {
+            kind: {"pending": count, "oldest_seconds": now - oldest, "max_attempts": attempts, "dead_letters": dead.get(kind, 0)}
+            for kind, count, oldest, attempts in rows
+        }
+        for kind, count in dead.items():
+            counts.setdefault(kind, {"pending": 0, "oldest_seconds": 0.0, "max_attempts": 0, "dead_letters": count})
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
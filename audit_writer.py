@@ -0,0 +1,301 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from metrics import Histogram, PHASE_BUCKETS, render_histogram
+from sf_executor import sf_executor
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    """
+    Background loader of the audit spool, a single writer task.
+
+    `submit(record, kind)` appends the record to the local spool and returns;
+    it never waits on Snowflake and may be called from the event loop or from
+    a worker thread. The writer loads spooled records every `flush_interval`
+    seconds, or as soon as `batch_size` are pending, with one
+    `writers[kind](records)` call per batch (of up to `batch_sizes[kind]`,
+    default `batch_size`) on the Snowflake executor, kinds
+    in the order of `writers` (audit rows before the feedback that updates
+    them). Records are removed from the spool only once written, so a failed
+    load is retried and records left by a previous run are loaded at start.
+    After a failed load the kind is retried with exponential backoff, from
+    `flush_interval` up to `max_backoff` seconds.
+
+    Writers must write a batch all or nothing. Once the oldest record of a
+    batch rejected with one of `reject_errors` has failed `max_attempts`
+    times over at least `dead_letter_after` seconds, the batch is split in
+    halves to find the records that fail on their own. Such a record is only
+    moved to the spool's dead letters when other records of the batch were
+    written meanwhile, so an outage that rejects every row never dead-letters
+    anything; `on_dead_letter[kind](records, error)` is then called.
+    `requeue_dead_letters()` loads them again. `stop()` loads what is
+    pending. Without a running writer records are written synchronously.
+    """
+
+    def __init__(self, spool, writers: dict, batch_size: int = 100, flush_interval: float = 2.0,
+                 executor_key: str = "audit", batch_sizes: dict = None, max_attempts: int = 10,
+                 dead_letter_after: float = 600.0, max_backoff: float = 300.0,
+                 reject_errors: tuple = (Exception,), on_dead_letter: dict = None):
+        self.spool = spool
+        self.writers = writers
+        self.max_attempts = max_attempts
+        self.dead_letter_after = dead_letter_after
+        self.max_backoff = max_backoff
+        self.reject_errors = reject_errors
+        self.on_dead_letter = on_dead_letter or {}
+        self._backoff = {kind: (0, 0.0) for kind in writers}
+        self.batch_size = batch_size
+        self.batch_sizes = {kind: (batch_sizes or {}).get(kind, batch_size) for kind in writers}
+        self.flush_interval = flush_interval
+        self.executor_key = executor_key
+        self._loop = None
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self._unflushed = 0
+        self._lock = threading.Lock()
+        self._flush_seconds = Histogram(PHASE_BUCKETS)
+        self._stats = {kind: {"submitted": 0, "written": 0, "failed": 0, "dead_lettered": 0} for kind in writers}
+        self._batches = 0
+
+    def _count(self, kind, name, value: int = 1):
+        with self._lock:
+            self._stats[kind][name] += value
+
+    def _write(self, kind, records: list):
+        """Run the writer of `kind`; the error it raised, None once written"""
+        started = time.monotonic()
+        try:
+            self.writers[kind](records)
+        except Exception as e:
+            self._count(kind, "failed", len(records))
+            logger.error(f"Error writing {len(records)} {kind} records: {e}")
+            return e
+        else:
+            self._count(kind, "written", len(records))
+            return None
+        finally:
+            with self._lock:
+                self._batches += 1
+                self._flush_seconds.observe(time.monotonic() - started)
+
+    def submit(self, record: dict, kind: str = "audit"):
+        """Spool one record for the writer of `kind`"""
+        self._count(kind, "submitted")
+        if self._task is None or self._task.done():
+            self._write(kind, [record])
+            return
+        self.spool.append(kind, record)
+        with self._lock:
+            self._unflushed += 1
+            wake = self._unflushed >= self.batch_size
+        if wake:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def wake(self):
+        """Load the spool now instead of at the next interval"""
+        if self._task is not None and not self._task.done():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def _load_pending(self) -> bool:
+        """
+        Load one batch; True when it was full and more may be waiting. A kind
+        is only loaded once the kinds before it are drained, so feedback never
+        overtakes the audit rows it updates.
+        """
+        for kind in self.writers:
+            failures, retry_at = self._backoff[kind]
+            if time.monotonic() < retry_at:
+                return False
+            pending = self.spool.pending(kind, self.batch_sizes[kind])
+            if not pending:
+                continue
+            ids = [spool_id for spool_id, _, _, _ in pending]
+            error = self._write(kind, [record for _, record, _, _ in pending])
+            if error is None:
+                self.spool.ack(ids)
+                self._backoff[kind] = (0, 0.0)
+                if len(pending) == self.batch_sizes[kind]:
+                    return True
+                continue
+            self.spool.retry(ids)
+            now = time.time()
+            pending = [
+                (spool_id, record, attempts + 1, first_failed or now)
+                for spool_id, record, attempts, first_failed in pending
+            ]
+            delay = min(self.flush_interval * 2 ** failures, self.max_backoff)
+            self._backoff[kind] = (failures + 1, time.monotonic() + delay)
+            # The oldest record has been in every failed try of this batch
+            if not isinstance(error, self.reject_errors) or not self._exhausted(pending[0], now) or len(pending) < 2:
+                return False
+            suspects = []
+            if not self._isolate(kind, pending, suspects):
+                return False
+            for suspect, suspect_error in suspects:
+                if self._exhausted(suspect, now):
+                    self._dead_letter(kind, suspect, suspect_error)
+            self._backoff[kind] = (0, 0.0)
+            return True
+        return False
+
+    def _exhausted(self, pending_record, now: float) -> bool:
+        _, _, attempts, first_failed = pending_record
+        return attempts >= self.max_attempts and now - first_failed >= self.dead_letter_after
+
+    def _try_part(self, kind, part: list, suspects: list):
+        """Write `part`, splitting it further once rejected; True when any of it was written, None to give up"""
+        error = self._write(kind, [record for _, record, _, _ in part])
+        if error is None:
+            self.spool.ack([spool_id for spool_id, _, _, _ in part])
+            return True
+        if not isinstance(error, self.reject_errors):
+            return None
+        if len(part) == 1:
+            suspects.append((part[0], error))
+            return False
+        return self._isolate(kind, part, suspects)
+
+    def _isolate(self, kind, pending: list, suspects: list):
+        """
+        Write a rejected batch in halves, collecting the records rejected on their own
+        in `suspects`. True when any of it was written; when the first half wrote
+        nothing the second is only tried whole, so an outage costs a few writes.
+        """
+        middle = len(pending) // 2
+        first = self._try_part(kind, pending[:middle], suspects)
+        if first is None:
+            return None
+        if first:
+            return self._try_part(kind, pending[middle:], suspects) is not None
+        error = self._write(kind, [record for _, record, _, _ in pending[middle:]])
+        if error is not None:
+            return False
+        self.spool.ack([spool_id for spool_id, _, _, _ in pending[middle:]])
+        return True
+
+    def _dead_letter(self, kind, pending_record, error):
+        spool_id, record, attempts, _ = pending_record
+        self.spool.dead_letter([spool_id], str(error))
+        self._count(kind, "dead_lettered")
+        logger.error(
+            f"Moved {kind} record {spool_id} to the dead letters after {attempts} failed loads: {error}; "
+            f"record: {json.dumps(record, default=str)[:2000]}"
+        )
+        if kind in self.on_dead_letter:
+            try:
+                self.on_dead_letter[kind]([record], str(error))
+            except Exception as e:
+                logger.error(f"Error handling the dead {kind} record {spool_id}: {e}")
+
+    def dead_letters(self, kind: str = None, limit: int = 100) -> list:
+        return self.spool.dead_letters(kind, limit)
+
+    def requeue_dead_letters(self, kind: str = None, ids: list = None) -> list:
+        """Put dead letters back in the spool, retried from now on; returns them as `(id, kind, record)`"""
+        requeued = self.spool.requeue(kind, ids)
+        if requeued:
+            for requeued_kind in {row_kind for _, row_kind, _ in requeued}:
+                if requeued_kind in self._backoff:
+                    self._backoff[requeued_kind] = (0, 0.0)
+            logger.info(f"Requeued {len(requeued)} dead audit record(s)")
+            self.wake()
+        return requeued
+
+    async def _flush(self):
+        with self._lock:
+            self._unflushed = 0
+        while await sf_executor.run(self.executor_key, self._load_pending):
+            pass
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self._flush()
+            except Exception as e:
+                logger.error(f"Error loading the audit spool: {e}")
+        try:
+            await self._flush()
+        except Exception as e:
+            logger.error(f"Error loading the audit spool on shutdown: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._loop = asyncio.get_running_loop()
+            self._wake = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Audit writer started, spool {self.spool.path}: {self.spool.counts()}")
+
+    async def stop(self):
+        """Load the pending records and stop the writer task; records that cannot be written stay spooled"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        try:
+            await self._task
+        except Exception as e:
+            logger.error(f"Audit writer stopped with an error: {e}")
+        self._task = None
+        logger.info(f"Audit writer stopped, left in spool: {self.spool.counts()}")
+
+    def stats(self) -> dict:
+        spooled = self.spool.counts()
+        with self._lock:
+            return {
+                "kinds": {
+                    kind: dict(stats, **spooled.get(kind, {"pending": 0, "oldest_seconds": 0.0, "max_attempts": 0, "dead_letters": 0}))
+                    for kind, stats in self._stats.items()
+                },
+                "batches": self._batches,
+                "flush_seconds_avg": self._flush_seconds.sum / self._flush_seconds.count if self._flush_seconds.count else 0.0,
+                "flush_seconds_p95": self._flush_seconds.quantile(0.95),
+                "batch_sizes": self.batch_sizes,
+                "flush_interval": self.flush_interval,
+                "max_attempts": self.max_attempts,
+                "dead_letter_after": self.dead_letter_after,
+                "backoff": {
+                    kind: {"failures": failures, "retry_in": max(retry_at - time.monotonic(), 0.0)}
+                    for kind, (failures, retry_at) in self._backoff.items()
+                },
+                "spool": self.spool.path,
+            }
+
+    def render(self) -> str:
+        """Spool depth, record counts and flush latency in the Prometheus text format"""
+        stats = self.stats()
+        lines = [
+            "# HELP audit_queue_depth Records waiting in the audit spool",
+            "# TYPE audit_queue_depth gauge",
+        ]
+        for kind, kind_stats in stats["kinds"].items():
+            lines.append(f'audit_queue_depth{{kind="{kind}"}} {kind_stats["pending"]}')
+        lines.append("# HELP audit_oldest_pending_seconds Age of the oldest spooled record")
+        lines.append("# TYPE audit_oldest_pending_seconds gauge")
+        for kind, kind_stats in stats["kinds"].items():
+            lines.append(f'audit_oldest_pending_seconds{{kind="{kind}"}} {kind_stats["oldest_seconds"]}')
+        lines.append("# HELP audit_dead_letters Records moved out of the spool after max_attempts failed loads")
+        lines.append("# TYPE audit_dead_letters gauge")
+        for kind, kind_stats in stats["kinds"].items():
+            lines.append(f'audit_dead_letters{{kind="{kind}"}} {kind_stats["dead_letters"]}')
+        lines.append("# HELP audit_rows_total Audit records by outcome")
+        lines.append("# TYPE audit_rows_total counter")
+        for kind, kind_stats in stats["kinds"].items():
+            for outcome in ("submitted", "written", "failed", "dead_lettered"):
+                lines.append(f'audit_rows_total{{kind="{kind}",outcome="{outcome}"}} {kind_stats[outcome]}')
+        lines.append("# HELP audit_flush_seconds Duration of one audit batch load")
+        lines.append("# TYPE audit_flush_seconds histogram")
+        with self._lock:
+            render_histogram(lines, "audit_flush_seconds", self._flush_seconds)
+        return "\n".join(lines) + "\n"
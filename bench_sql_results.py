@@ -0,0 +1,160 @@
+"""
+Compare the JSON array path of /txt2sql/run_sql_query with the NDJSON, Arrow
+IPC and Parquet responses.
+
+Usage:
+    python bench_sql_results.py [rows] [batch_rows]
+
+A fake cursor returns a synthetic result (numbers, text, timestamps, dates
+and NULLs) in Arrow-sized pandas batches, the way `fetch_pandas_batches()`
+does (and as Arrow tables for `fetch_arrow_batches()`). For each format
+the script reports the time to the first byte, the total time, the payload
+size and the peak Python memory, then how long a client takes to load the
+payload into pandas, and checks JSON and NDJSON produce the same records.
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from sql_results import (
+    iter_arrow_stream,
+    iter_ndjson_batches,
+    iter_parquet,
+    normalize_frame,
+    stream_batches,
+    stream_ndjson,
+)
+
+
+def synthetic_batch(start: int, rows: int) -> pd.DataFrame:
+    ids = np.arange(start, start + rows)
+    amount = ids * 1.25
+    amount[ids % 17 == 0] = np.nan
+    return pd.DataFrame({
+        "MEMBER_ID": ids,
+        "CLAIM_AMT": amount,
+        "PLAN_NM": np.where(ids % 3 == 0, "PPO", "HMO"),
+        "DIAG_CD": [f"E{i % 1000:03d}.{i % 10}" for i in ids],
+        "SERVICE_DTM": pd.Timestamp("2024-01-01") + pd.to_timedelta(ids % 86400, unit="s"),
+        "ADMIT_DT": [date(2024, 1, 1) + timedelta(days=int(i % 365)) for i in ids],
+    })
+
+
+class FakeCursor:
+    def __init__(self, rows: int, batch_rows: int):
+        self.rows = rows
+        self.batch_rows = batch_rows
+
+    def execute(self, sql):
+        pass
+
+    def fetch_pandas_batches(self):
+        for start in range(0, self.rows, self.batch_rows):
+            yield synthetic_batch(start, min(self.batch_rows, self.rows - start))
+
+    def fetch_arrow_batches(self):
+        for df in self.fetch_pandas_batches():
+            yield pa.Table.from_pandas(df, preserve_index=False)
+
+    def fetch_pandas_all(self):
+        return pd.concat(list(self.fetch_pandas_batches()), ignore_index=True)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows: int, batch_rows: int):
+        self.rows = rows
+        self.batch_rows = batch_rows
+
+    def cursor(self):
+        return FakeCursor(self.rows, self.batch_rows)
+
+
+def json_array(sf_conn) -> tuple:
+    """What execute_sql_records + JSONResponse do"""
+    started = time.perf_counter()
+    cs = sf_conn.cursor()
+    cs.execute("select")
+    records = normalize_frame(cs.fetch_pandas_all()).to_dict(orient="records")
+    body = json.dumps(records, ensure_ascii=False, allow_nan=False, default=str).encode("utf-8")
+    elapsed = time.perf_counter() - started
+    return elapsed, elapsed, len(body), body
+
+
+async def streamed(stream) -> tuple:
+    """A client that keeps only the current chunk"""
+    started = time.perf_counter()
+    first = None
+    size = 0
+    async for chunk in stream:
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    return first, time.perf_counter() - started, size, None
+
+
+CLIENT_LOADERS = {
+    "json array": lambda body: pd.DataFrame(json.loads(body)),
+    "ndjson": lambda body: pd.read_json(io.BytesIO(body), lines=True),
+    "arrow": lambda body: pa.ipc.open_stream(body).read_all().to_pandas(),
+    "parquet": lambda body: pq.read_table(io.BytesIO(body)).to_pandas(),
+}
+
+
+def client_load(label, body):
+    started = time.perf_counter()
+    df = CLIENT_LOADERS[label](body)
+    print(f"  {label:<11} client load into pandas {(time.perf_counter() - started) * 1000:9.1f} ms  ({len(df)} rows)")
+
+
+def measure(label, func):
+    tracemalloc.start()
+    first, total, size, body = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<11} first byte {first * 1000:9.1f} ms  total {total * 1000:9.1f} ms  "
+          f"{size / 1e6:8.1f} MB  peak memory {peak / 1e6:8.1f} MB")
+    return body
+
+
+def check_same_records(sf_conn):
+    _, _, _, body = json_array(sf_conn)
+    expected = json.loads(body)
+    streamed = []
+    for chunk in iter_ndjson_batches(sf_conn, "select"):
+        streamed += [json.loads(line) for line in chunk.splitlines()]
+    same = len(expected) == len(streamed) and all(
+        {k: str(v) for k, v in a.items()} == {k: str(v) for k, v in b.items()}
+        for a, b in zip(expected, streamed)
+    )
+    print(f"  same records: {same}")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    batch_rows = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+    sf_conn = FakeConnection(rows, batch_rows)
+    print(f"{rows} rows, batches of {batch_rows}")
+    measure("json array", lambda: json_array(sf_conn))
+    measure("ndjson", lambda: asyncio.run(streamed(
+        stream_ndjson(iter_ndjson_batches(sf_conn, "select"), asyncio.to_thread))))
+    measure("arrow", lambda: asyncio.run(streamed(
+        stream_batches(iter_arrow_stream(sf_conn, "select"), asyncio.to_thread))))
+    measure("parquet", lambda: asyncio.run(streamed(
+        stream_batches(iter_parquet(sf_conn, "select"), asyncio.to_thread))))
+    client_load("json array", json_array(sf_conn)[3])
+    client_load("ndjson", b"".join(iter_ndjson_batches(sf_conn, "select")))
+    client_load("arrow", b"".join(iter_arrow_stream(sf_conn, "select")))
+    client_load("parquet", b"".join(iter_parquet(sf_conn, "select")))
+    check_same_records(FakeConnection(min(rows, 20_000), min(batch_rows, 5_000)))
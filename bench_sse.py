@@ -0,0 +1,117 @@
+"""
+Compare the SSE parser in sse.py with the old `split(b'\\n\\n')` handling.
+
+Usage:
+    python bench_sse.py [recorded_stream.txt ...]
+
+Each file is a raw Cortex response body as received on the wire. Without
+files a synthetic inference:complete stream is used. Every stream is cut
+into random network-sized chunks; the script reports how many events each
+approach recovers and how long it takes, with the JSON decoding of every
+event and for the event framing alone.
+"""
+import json
+import random
+import sys
+import time
+
+from sse import SSEParser
+
+
+def synthetic_stream(events: int = 2000) -> bytes:
+    parts = []
+    for i in range(events):
+        chunk = {
+            "id": "d3b6f2a4-0000-0000-0000-000000000000",
+            "model": "llama3.1-70b",
+            "choices": [{"delta": {"type": "text", "content": f"token {i} ", "text": f"token {i} "}}],
+            "usage": {},
+        }
+        parts.append(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+    parts.append(b"data: [DONE]\n\n")
+    return b"".join(parts)
+
+
+def split_chunks(body: bytes, seed: int = 7, low: int = 64, high: int = 4096) -> list:
+    rnd = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        size = rnd.randint(low, high)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def legacy(chunks: list) -> int:
+    recovered = 0
+    for result_chunk in chunks:
+        for elem in result_chunk.split(b'\n\n'):
+            if b'content' in elem:
+                try:
+                    chunk_dict = json.loads(elem.replace(b'data: ', b''))
+                    chunk_dict['choices'][0]['delta']['text']
+                    recovered += 1
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
+                    continue
+    return recovered
+
+
+def incremental(chunks: list) -> int:
+    recovered = 0
+    parser = SSEParser()
+    for result_chunk in chunks:
+        for event in parser.feed(result_chunk):
+            if event.data == "[DONE]":
+                continue
+            chunk_dict = json.loads(event.data)
+            chunk_dict['choices'][0]['delta']['text']
+            recovered += 1
+    for event in parser.close():
+        if event.data != "[DONE]":
+            recovered += 1
+    return recovered
+
+
+def legacy_framing(chunks: list) -> int:
+    recovered = 0
+    for result_chunk in chunks:
+        for elem in result_chunk.split(b'\n\n'):
+            if b'content' in elem:
+                elem.replace(b'data: ', b'').decode("utf-8", "replace")
+                recovered += 1
+    return recovered
+
+
+def incremental_framing(chunks: list) -> int:
+    parser = SSEParser()
+    recovered = 0
+    for result_chunk in chunks:
+        recovered += sum(event.data != "[DONE]" for event in parser.feed(result_chunk))
+    return recovered + sum(event.data != "[DONE]" for event in parser.close())
+
+
+def bench(name: str, body: bytes, repeat: int = 20):
+    chunks = split_chunks(body)
+    expected = body.count(b"\n\ndata: ") + 1 - body.count(b"[DONE]")
+    print(f"{name}: {len(body)} bytes, {len(chunks)} chunks, {expected} events")
+    for label, func in (
+        ("split(b'\\n\\n')", legacy),
+        ("SSEParser", incremental),
+        ("split, framing", legacy_framing),
+        ("SSEParser, framing", incremental_framing),
+    ):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            recovered = func(chunks)
+        elapsed = (time.perf_counter() - started) / repeat
+        print(f"  {label:<20} {recovered:>6} events  {elapsed * 1000:8.2f} ms  {len(body) / elapsed / 1e6:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                bench(path, f.read())
+    else:
+        bench("synthetic", synthetic_stream())
@@ -0,0 +1,103 @@
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class CortexHttpClients:
+    """
+    Application scoped httpx clients, one pooled client per upstream.
+
+    Every upstream (Cortex complete, analyst, agent, ...) gets its own
+    connection pool, limits and timeout, so TLS connections are kept alive
+    and reused across requests instead of being opened per request.
+    Request and new-connection counts are collected through the httpx
+    `trace` extension and returned by `stats()`.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 30.0, http2: bool = False):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        if http2 and not HTTP2_AVAILABLE:
+            logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self._upstreams = {}
+        self._clients = {}
+        self._stats = {}
+
+    def register(self, name: str, timeout: float = 60.0, verify: bool = False, **client_kwargs):
+        """Declare an upstream; its client is created on first use"""
+        self._upstreams[name] = dict(timeout=timeout, verify=verify, **client_kwargs)
+
+    def _upstream_stats(self, name) -> dict:
+        return self._stats.setdefault(name, {"requests": 0, "new_connections": 0, "reused_connections": 0})
+
+    def _hooks(self, name):
+        stats = self._upstream_stats(name)
+
+        async def trace(event_name, info):
+            if event_name == "connection.connect_tcp.complete":
+                stats["new_connections"] += 1
+
+        async def on_request(request):
+            stats["requests"] += 1
+            request.extensions["trace"] = trace
+
+        return {"request": [on_request]}
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            settings = dict(self._upstreams.get(name, {"timeout": 60.0, "verify": False}))
+            timeout = settings.pop("timeout")
+            client = httpx.AsyncClient(
+                timeout=httpx.Timeout(timeout, connect=min(timeout, 10.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                    keepalive_expiry=self.keepalive_expiry,
+                ),
+                http2=self.http2,
+                event_hooks=self._hooks(name),
+                **settings,
+            )
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing HTTP client for {name}: {e}")
+        logger.info("Cortex HTTP clients closed")
+
+    def stats(self) -> dict:
+        upstreams = {}
+        for name, stats in self._stats.items():
+            stats["reused_connections"] = max(stats["requests"] - stats["new_connections"], 0)
+            upstreams[name] = dict(stats, open=name in self._clients)
+        return {"http2": self.http2, "upstreams": upstreams}
+
+
+cortex_http = CortexHttpClients(
+    max_connections=int(os.getenv("GENAI_HTTP_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("GENAI_HTTP_MAX_KEEPALIVE", "20")),
+    keepalive_expiry=float(os.getenv("GENAI_HTTP_KEEPALIVE_EXPIRY", "30")),
+    http2=os.getenv("GENAI_HTTP2", "false").lower() in ("1", "true", "yes"),
+)
+cortex_http.register("complete", timeout=float(os.getenv("GENAI_HTTP_COMPLETE_TIMEOUT", "60")))
+cortex_http.register("txt2sql", timeout=float(os.getenv("GENAI_HTTP_TXT2SQL_TIMEOUT", "90")))
+cortex_http.register("agent", timeout=float(os.getenv("GENAI_HTTP_AGENT_TIMEOUT", "150")))
@@ -0,0 +1,635 @@
+from functools import lru_cache
+from fastapi import (
+    APIRouter,
+    Depends,
+    Query,
+    HTTPException,
+    status
+    
+)
+from typing import Annotated
+from typing import List
+
+from config import GenAiEnvSettings
+from logging import Logger
+import logging 
+
+from ReduceReuseRecycleGENAI import load_log_config, get_timestamp
+from ReduceReuseRecycleGENAI.api import get_api_key
+from ReduceReuseRecycleGENAI.snowflake import snowflake_conn,get_sf_database_name
+from functools import partial
+from models import (
+    GenAiCortexAudit,
+     CompleteQryModel,
+     SearchModel,
+     AnalystModel
+)
+import snowflake.connector
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from sf_catalog import semantic_model_catalog, search_service_catalog, show_search_services
+from sf_token import sf_token_manager
+from sf_pool import SnowflakeConnectionPool
+from audit_writer import AuditWriter
+from audit_spool import AuditSpool
+from feedback_status import FeedbackStatusTracker
+import pandas as pd
+
+#Session connection cache limits
+SF_MAX_CONNS_PER_APP = int(os.getenv("GENAI_SF_MAX_CONNS_PER_APP", "4"))
+SF_MAX_SESSIONS = int(os.getenv("GENAI_SF_MAX_SESSIONS", "1000"))
+SF_SESSION_TTL = float(os.getenv("GENAI_SF_SESSION_TTL", "1800"))
+SF_CONN_IDLE_TTL = float(os.getenv("GENAI_SF_CONN_IDLE_TTL", "900"))
+
+
+#Get the required configuration loaded
+@lru_cache
+def get_config() -> GenAiEnvSettings:
+    return GenAiEnvSettings()
+
+def get_logger() -> Logger: 
+    return logging.getLogger(__name__)
+
+def get_load_timestamp() -> Logger: 
+    utc_string, est_string, est2_string = get_timestamp()
+    #est_string = "2025-03-11"
+    return est_string
+
+def get_db_name() -> Logger: 
+    return get_sf_database_name()
+
+class ValidApiKey: 
+    def __init__(self):
+        self.config = get_config()
+        self.logger = get_logger() 
+        self.func_apikey = partial(
+           get_api_key,
+               self.logger,
+               self.config.env,
+               self.config.region_name,
+           )
+    
+    def __call__(
+            self,
+            api_key: str,
+            aplctn_cd: str,
+            app_id: str
+        ) -> bool:
+        try:
+            extracted_api_key = self.func_apikey(aplctn_cd, app_id)
+            return extracted_api_key['api_key'] == api_key
+        except Exception as e:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                detail = str(e))
+class SessionConnectionCache:
+    """
+    Bounded cache of Snowflake connections shared by chat sessions.
+
+    Connections are pooled per (aplctn_cd, sf_prefix) and capped at
+    `max_conns_per_app`; each session is pinned to the least loaded pooled
+    connection. Sessions idle for `session_ttl` seconds, or pushed out once
+    more than `max_sessions` are tracked, are unbound (LRU), and connections
+    with no sessions left that sit idle for `idle_ttl` seconds are closed.
+    """
+
+    class _Entry:
+        __slots__ = ("conn", "sessions", "last_used", "validated_at")
+
+        def __init__(self, conn):
+            self.conn = conn
+            self.sessions = 0
+            self.last_used = time.monotonic()
+            self.validated_at = self.last_used
+
+    def __init__(self, max_conns_per_app=4, max_sessions=1000, session_ttl=1800, idle_ttl=900, validate_after=60):
+        self.max_conns_per_app = max_conns_per_app
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.idle_ttl = idle_ttl
+        self.validate_after = validate_after
+        self._lock = threading.RLock()
+        self._connect_locks = {}
+        self._sessions = OrderedDict()
+        self._pools = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _unbind(self, key):
+        entry, _ = self._sessions.pop(key)
+        entry.sessions -= 1
+
+    def _drop(self, pool_key, entry):
+        """Detach `entry` from its pool and sessions; call with the lock held and close it after releasing"""
+        pool = self._pools.get(pool_key, [])
+        if entry in pool:
+            pool.remove(entry)
+        for key in [k for k, (e, _) in self._sessions.items() if e is entry]:
+            self._unbind(key)
+        return entry
+
+    @staticmethod
+    def _close(entries):
+        """Close dropped connections; a network round-trip each, so never under the lock"""
+        for entry in entries:
+            try:
+                entry.conn.close()
+            except Exception as e:
+                logging.getLogger(__name__).warning(f"Error closing Snowflake connection: {e}")
+
+    def evict_expired(self):
+        """Unbind idle sessions and close pooled connections nobody is using"""
+        now = time.monotonic()
+        dropped = []
+        with self._lock:
+            for key in [k for k, (_, seen) in self._sessions.items() if now - seen > self.session_ttl]:
+                self._unbind(key)
+                self.evictions += 1
+            for pool_key, pool in list(self._pools.items()):
+                for entry in list(pool):
+                    if entry.conn.is_closed() or (entry.sessions == 0 and now - entry.last_used > self.idle_ttl):
+                        dropped.append(self._drop(pool_key, entry))
+                        self.evictions += 1
+                if not pool:
+                    del self._pools[pool_key]
+        self._close(dropped)
+
+    def _is_usable(self, entry):
+        if entry.conn.is_closed():
+            return False
+        if time.monotonic() - entry.validated_at < self.validate_after:
+            return True
+        if entry.conn.is_valid():
+            entry.validated_at = time.monotonic()
+            return True
+        return False
+
+    def get(self, aplctn_cd, sf_prefix, session_id, connect):
+        pool_key = (aplctn_cd, sf_prefix)
+        key = (aplctn_cd, sf_prefix, session_id)
+        self.evict_expired()
+        with self._lock:
+            bound = self._sessions.get(key)
+        if bound is not None:
+            entry = bound[0]
+            if self._is_usable(entry):
+                with self._lock:
+                    if key in self._sessions:
+                        self._sessions[key] = (entry, time.monotonic())
+                        self._sessions.move_to_end(key)
+                    entry.last_used = time.monotonic()
+                    self.hits += 1
+                return entry.conn
+            with self._lock:
+                self._drop(pool_key, entry)
+            self._close([entry])
+
+        with self._lock:
+            self.misses += 1
+            connect_lock = self._connect_locks.setdefault(pool_key, threading.Lock())
+        with connect_lock:
+            with self._lock:
+                pool = self._pools.setdefault(pool_key, [])
+                entry = min(pool, key=lambda e: e.sessions) if len(pool) >= self.max_conns_per_app else None
+            if entry is None:
+                entry = self._Entry(connect())
+                with self._lock:
+                    self._pools.setdefault(pool_key, []).append(entry)
+
+        with self._lock:
+            if key in self._sessions:
+                self._unbind(key)
+            entry.sessions += 1
+            entry.last_used = time.monotonic()
+            self._sessions[key] = (entry, entry.last_used)
+            while len(self._sessions) > self.max_sessions:
+                self._unbind(next(iter(self._sessions)))
+                self.evictions += 1
+        return entry.conn
+
+    def close_all(self):
+        dropped = []
+        with self._lock:
+            for pool_key, pool in list(self._pools.items()):
+                for entry in list(pool):
+                    dropped.append(self._drop(pool_key, entry))
+            self._pools.clear()
+        self._close(dropped)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "sessions": len(self._sessions),
+                "connections": {
+                    f"{aplctn_cd}/{sf_prefix}": len(pool) for (aplctn_cd, sf_prefix), pool in self._pools.items()
+                },
+            }
+
+
+class SnowFlakeConnector: 
+    conn = None
+    conn_key=None
+    sf_conn_cache = SessionConnectionCache(
+        max_conns_per_app=SF_MAX_CONNS_PER_APP,
+        max_sessions=SF_MAX_SESSIONS,
+        session_ttl=SF_SESSION_TTL,
+        idle_ttl=SF_CONN_IDLE_TTL,
+    )
+    def __init__(self,aplctn_cd,sf_prefix):
+        self.config = get_config()
+        self.logger = get_logger()
+        self.aplctn_cd = aplctn_cd
+        self.sf_prefix = sf_prefix
+
+        self.conn =  snowflake_conn(
+           self.logger, 
+           aplctn_cd=aplctn_cd,
+           env=self.config.env,
+           region_name=self.config.region_name, 
+           warehouse_size_suffix=self.config.pltfrm_lvl_warehouse_size_suffix,
+           prefix = self.sf_prefix
+        )
+
+    @classmethod
+    def get_conn(cls,aplctn_cd,sf_prefix,session_id):
+        def connect():
+            print(f"Snowflake Connection established successfully for application")
+            conn = cls(aplctn_cd,sf_prefix).conn
+            sf_token_manager.track(conn)
+            return conn
+        return cls.sf_conn_cache.get(aplctn_cd,sf_prefix,session_id,connect)
+
+    @classmethod
+    def stats(cls):
+        return cls.sf_conn_cache.stats()
+
+
+def connect_audit():
+    config = get_config()
+    return SnowFlakeConnector(config.pltfrm_aplctn_cd, config.pltfrm_lvl_prefix).conn
+
+# The audit writer's own connection, kept out of SessionConnectionCache so flushes never wait behind user queries
+audit_sf_pool = SnowflakeConnectionPool(
+    connect_audit,
+    size=1,
+    timeout=float(os.getenv("GENAI_AUDIT_CONN_TIMEOUT", "30")),
+)
+
+AUDIT_BATCH_SIZE = int(os.getenv("GENAI_AUDIT_BATCH_SIZE", "100"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("GENAI_AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_SPOOL_PATH = os.getenv("GENAI_AUDIT_SPOOL_PATH", os.path.join(tempfile.gettempdir(), "genai_audit_spool.db"))
+AUDIT_ROLLUP_SESSION_ID = "audit_rollup"
+# Failed loads, and seconds since the first one, before a rejected record may be moved to the spool's dead letters
+AUDIT_MAX_ATTEMPTS = int(os.getenv("GENAI_AUDIT_MAX_ATTEMPTS", "10"))
+AUDIT_DEAD_LETTER_AFTER = float(os.getenv("GENAI_AUDIT_DEAD_LETTER_AFTER", "600"))
+# Longest wait between retries of a failing audit or feedback load
+AUDIT_MAX_BACKOFF = float(os.getenv("GENAI_AUDIT_MAX_BACKOFF", "300"))
+# Errors of Snowflake rejecting the rows themselves, as opposed to losing the connection
+AUDIT_REJECT_ERRORS = (
+    snowflake.connector.errors.ProgrammingError,
+    snowflake.connector.errors.DataError,
+    snowflake.connector.errors.IntegrityError,
+)
+FEEDBACK_BATCH_SIZE = int(os.getenv("GENAI_FEEDBACK_BATCH_SIZE", "1000"))
+
+feedback_status = FeedbackStatusTracker(ttl=float(os.getenv("GENAI_FEEDBACK_STATUS_TTL", "3600")))
+
+
+def insert_audit_rows(rows: list):
+    """
+    Insert audit rows with bind parameters, one multi-row INSERT per distinct column set,
+    all in one transaction so a failed batch can be retried without duplicating rows.
+    """
+    config = get_config()
+    by_columns = {}
+    for row in rows:
+        by_columns.setdefault(tuple(row), []).append(tuple(row.values()))
+
+    with audit_sf_pool.connection() as sf_conn:
+        plt_cs = sf_conn.cursor()
+        try:
+            plt_cs.execute("BEGIN")
+            for columns, values in by_columns.items():
+                insert_sql = "INSERT INTO {db_name}.{schema}.{table} ({fields}) VALUES ({binds})".format(
+                    db_name = config.pltfrm_lvl_sf_db_nm,
+                    schema= config.pltfrm_lvl_sf_schma_nm,
+                    table=config.job_audit_tbl,
+                    fields=",".join(columns),
+                    binds=",".join(["%s"] * len(columns)),
+                )
+                plt_cs.executemany(insert_sql, values)
+            plt_cs.execute("COMMIT")
+        except Exception:
+            try:
+                plt_cs.execute("ROLLBACK")
+            except Exception as e:
+                get_logger().warning(f"Error rolling back the audit insert: {e}")
+            raise
+        finally:
+            plt_cs.close()
+
+
+def merge_feedback_updates(updates: list) -> dict:
+    """
+    Fold the feedback updates of one flush into one update per feedback id; later values win, None keeps the earlier one.
+    """
+    merged = {}
+    for update in updates:
+        current = merged.setdefault(update["feedbk_id"], dict(update))
+        for field in ("feedbk_actn_txt", "feedbk_cmnt_txt"):
+            if update[field] is not None:
+                current[field] = update[field]
+        current["feedbk_updt_dtm"] = update["feedbk_updt_dtm"]
+    return merged
+
+
+def apply_feedback_updates(updates: list):
+    """
+    Apply the spooled feedback to the audit table with one MERGE and report the outcome per feedback id.
+    """
+    config = get_config()
+    merged = merge_feedback_updates(updates)
+    table = f"{config.pltfrm_lvl_sf_db_nm}.{config.pltfrm_lvl_sf_schma_nm}.{config.job_audit_tbl}"
+    merge_query = f"""
+        MERGE INTO {table} t
+        USING (
+            SELECT column1 AS feedbk_id, column2 AS feedbk_actn_txt, column3 AS feedbk_cmnt_txt, column4 AS feedbk_updt_dtm
+            FROM VALUES {",".join(["(%s, %s, %s, %s)"] * len(merged))}
+        ) s
+        ON t.feedbk_id = s.feedbk_id
+        WHEN MATCHED THEN UPDATE SET
+            feedbk_actn_txt = COALESCE(s.feedbk_actn_txt, t.feedbk_actn_txt),
+            feedbk_cmnt_txt = COALESCE(s.feedbk_cmnt_txt, t.feedbk_cmnt_txt),
+            feedbk_updt_dtm = s.feedbk_updt_dtm
+    """
+    binds = []
+    for update in merged.values():
+        binds += [update["feedbk_id"], update["feedbk_actn_txt"], update["feedbk_cmnt_txt"], update["feedbk_updt_dtm"]]
+
+    try:
+        with audit_sf_pool.connection() as plt_sf_conn:
+            cs_plt = plt_sf_conn.cursor()
+            try:
+                cs_plt.execute(merge_query, binds)
+                updated = (cs_plt.fetchone() or [0])[0]
+                found = set(merged)
+                if updated < len(merged):
+                    # Only look up which ids matched when some did not
+                    cs_plt.execute(
+                        f"SELECT DISTINCT feedbk_id FROM {table} WHERE feedbk_id IN ({','.join(['%s'] * len(merged))})",
+                        list(merged),
+                    )
+                    found = {row[0] for row in cs_plt.fetchall()}
+            finally:
+                cs_plt.close()
+    except Exception as e:
+        for fdbck_id in merged:
+            feedback_status.set(fdbck_id, "retrying", str(e))
+        raise
+    for fdbck_id in merged:
+        feedback_status.set(fdbck_id, "applied" if fdbck_id in found else "not_found")
+    get_logger().info(f"Feedback merged: {len(updates)} updates, {len(merged)} ids, {updated} rows")
+
+
+def fail_feedback_updates(updates: list, error: str):
+    """Mark feedback moved to the audit dead letters as failed, so waiting callers get a final status"""
+    for update in updates:
+        feedback_status.set(update["feedbk_id"], "failed", error)
+
+
+audit_writer = AuditWriter(
+    AuditSpool(AUDIT_SPOOL_PATH),
+    {"audit": insert_audit_rows, "feedback": apply_feedback_updates},
+    batch_size=AUDIT_BATCH_SIZE,
+    flush_interval=AUDIT_FLUSH_SECONDS,
+    batch_sizes={"feedback": FEEDBACK_BATCH_SIZE},
+    max_attempts=AUDIT_MAX_ATTEMPTS,
+    dead_letter_after=AUDIT_DEAD_LETTER_AFTER,
+    max_backoff=AUDIT_MAX_BACKOFF,
+    reject_errors=AUDIT_REJECT_ERRORS,
+    on_dead_letter={"feedback": fail_feedback_updates},
+)
+
+
+def requeue_audit_dead_letters(kind: str = None, ids: list = None) -> int:
+    """Load dead audit and feedback records again; requeued feedback is queued again"""
+    requeued = audit_writer.requeue_dead_letters(kind, ids)
+    for _, row_kind, record in requeued:
+        if row_kind == "feedback":
+            feedback_status.set(record["feedbk_id"], "queued")
+    return len(requeued)
+
+
+def log_response(audit_rec:GenAiCortexAudit,query_id: list,response_text: list,fdbck_id: list,session_id: str,extra_columns: dict = None):
+    """
+    Spool the audit row of a Cortex call for the audit writer; `extra_columns` adds optional audit columns, e.g. the stream status.
+    """
+    row = audit_rec.model_dump()
+    row.update(
+        qry_id=query_id[0] or "",
+        rspns_txt="".join(response_text),
+        feedbk_id=fdbck_id[0],
+    )
+    row.update(extra_columns or {})
+    audit_writer.submit(row, "audit")
+    return "query queued successfully"
+
+
+#Audit columns of the request accounting (see RequestTimer.accounting) and their types
+AUDIT_ACCOUNTING_COLUMNS = {
+    "client_app": ("clnt_aplctn_cd", "VARCHAR"),
+    "route": ("rqst_rte_txt", "VARCHAR"),
+    "prompt_tokens": ("prmpt_tkn_cnt", "NUMBER"),
+    "completion_tokens": ("cmpltn_tkn_cnt", "NUMBER"),
+    "token_source": ("tkn_src_cd", "VARCHAR"),
+    "ttft_ms": ("ttft_ms", "NUMBER(12,1)"),
+    "duration_ms": ("rspns_drtn_ms", "NUMBER(12,1)"),
+    "stream_bytes": ("strm_byte_cnt", "NUMBER"),
+    "upstream_status": ("upstrm_stts_cd", "NUMBER"),
+}
+
+
+AUDIT_ACCOUNTING = os.getenv("GENAI_AUDIT_ACCOUNTING", "true").lower() in ("1", "true", "yes")
+_audit_accounting_ready = threading.Event()
+
+
+def audit_columns_ready() -> bool:
+    """Whether `add_audit_accounting_columns` has added the accounting and extra columns"""
+    return _audit_accounting_ready.is_set()
+
+
+def audit_accounting_columns(accounting: dict) -> dict:
+    """
+    Audit column values of a request's accounting, for `log_response(..., extra_columns)`;
+    empty until `add_audit_accounting_columns` made sure the columns exist.
+    """
+    if not _audit_accounting_ready.is_set():
+        return {}
+    return {
+        column: accounting[key]
+        for key, (column, _) in AUDIT_ACCOUNTING_COLUMNS.items()
+        if key in accounting
+    }
+
+
+def add_audit_accounting_columns(extra_columns: dict = None):
+    """
+    Add the accounting columns, and `extra_columns` name to type, to the audit table when missing.
+    """
+    config = get_config()
+    columns = dict(AUDIT_ACCOUNTING_COLUMNS.values())
+    columns.update(extra_columns or {})
+    with audit_sf_pool.connection() as sf_conn:
+        cs = sf_conn.cursor()
+        try:
+            for column, column_type in columns.items():
+                cs.execute(
+                    f"ALTER TABLE {config.pltfrm_lvl_sf_db_nm}.{config.pltfrm_lvl_sf_schma_nm}.{config.job_audit_tbl} "
+                    f"ADD COLUMN IF NOT EXISTS {column} {column_type}"
+                )
+        finally:
+            cs.close()
+    _audit_accounting_ready.set()
+
+
+def audit_rollup(days: int = 7) -> list:
+    """
+    p50/p95 time to first token and duration, token totals and upstream errors of the last `days` days,
+    per client application, model and route.
+    """
+    config = get_config()
+    sf_conn = SnowFlakeConnector.get_conn(
+        config.pltfrm_aplctn_cd,
+        config.pltfrm_lvl_prefix,
+        session_id=AUDIT_ROLLUP_SESSION_ID
+    )
+    col = {key: column for key, (column, _) in AUDIT_ACCOUNTING_COLUMNS.items()}
+    rollup_sql = f"""
+        SELECT
+            {col["client_app"]} AS client_app,
+            mdl_id AS model,
+            COALESCE({col["route"]}, srvc_type) AS route,
+            COUNT(*) AS requests,
+            APPROX_PERCENTILE({col["ttft_ms"]}, 0.5) AS ttft_p50_ms,
+            APPROX_PERCENTILE({col["ttft_ms"]}, 0.95) AS ttft_p95_ms,
+            APPROX_PERCENTILE({col["duration_ms"]}, 0.5) AS duration_p50_ms,
+            APPROX_PERCENTILE({col["duration_ms"]}, 0.95) AS duration_p95_ms,
+            SUM({col["prompt_tokens"]}) AS prompt_tokens,
+            SUM({col["completion_tokens"]}) AS completion_tokens,
+            APPROX_PERCENTILE({col["completion_tokens"]}, 0.95) AS completion_tokens_p95,
+            SUM({col["stream_bytes"]}) AS stream_bytes,
+            COUNT_IF({col["upstream_status"]} >= 400) AS upstream_errors
+        FROM {config.pltfrm_lvl_sf_db_nm}.{config.pltfrm_lvl_sf_schma_nm}.{config.job_audit_tbl}
+        WHERE TRY_TO_TIMESTAMP(edl_load_dtm) >= DATEADD(day, -%s, CURRENT_TIMESTAMP())
+        GROUP BY 1, 2, 3
+        ORDER BY requests DESC
+    """
+    cs = sf_conn.cursor()
+    try:
+        cs.execute(rollup_sql, (int(days),))
+        names = [column[0].lower() for column in cs.description]
+        return [dict(zip(names, row)) for row in cs.fetchall()]
+    finally:
+        cs.close()
+
+def update_log_response(fdbck_id, feedbk_actn_txt=None, feedbk_cmnt_txt=None, session_id=None):
+    """
+    Spool feedback action text, feedback comment text, or both for the audit row of `fdbck_id`;
+    the audit writer merges it after the audit rows spooled before it. Its progress is kept in `feedback_status`.
+    """
+    feedback_status.set(fdbck_id, "queued")
+    audit_writer.submit({
+        "feedbk_id": fdbck_id,
+        "feedbk_actn_txt": feedbk_actn_txt,
+        "feedbk_cmnt_txt": feedbk_cmnt_txt,
+        "feedbk_updt_dtm": get_load_timestamp(),
+    }, "feedback")
+    return "Feedback queued for the audit table"
+
+
+# Session the Cortex Search catalog is loaded and refreshed on, shared by all callers
+SEARCH_CATALOG_SESSION_ID = "search_catalog"
+
+def search_catalog_key(search_input: SearchModel):
+    return (
+        search_input.aplctn_cd,
+        search_input.app_lvl_prefix,
+        search_input.database_nm.upper(),
+        search_input.schema_nm.upper(),
+    )
+
+def get_cortex_search_catalog(search_input: SearchModel
+    ):
+    """Cortex Search services of the schema and their list version, served from search_service_catalog"""
+    aplctn_cd = search_input.aplctn_cd
+    app_lvl_prefix = search_input.app_lvl_prefix
+    database_nm = search_input.database_nm
+    schema_nm = search_input.schema_nm
+
+    def load_search_services():
+        # The background refresh re-runs this loader, so it must not hold on to a user's session
+        sf_conn = SnowFlakeConnector.get_conn(
+        aplctn_cd,
+        app_lvl_prefix,
+        SEARCH_CATALOG_SESSION_ID)
+        return show_search_services(sf_conn, database_nm, schema_nm)
+
+    return search_service_catalog.get(search_catalog_key(search_input), load_search_services)
+
+def get_cortex_search_details(search_input: SearchModel
+    ):
+    search_names, _ = get_cortex_search_catalog(search_input)
+    return search_names
+
+def get_cortex_analyst_details(analyst_input: AnalystModel
+    ):
+    sf_conn = SnowFlakeConnector.get_conn(
+    analyst_input.aplctn_cd,
+    analyst_input.app_lvl_prefix,
+    analyst_input.session_id)
+    return semantic_model_catalog.file_names(
+        sf_conn,
+        analyst_input.aplctn_cd,
+        analyst_input.app_lvl_prefix,
+        analyst_input.database_nm,
+        analyst_input.schema_nm,
+    )
+
+
+def get_load_vector_data(query):
+    sf_conn = SnowFlakeConnector.get_conn(
+                query.aplctn_cd,
+                query.app_lvl_prefix,
+                query.session_id,
+        )
+    app_cs = sf_conn.cursor()
+    raw_text = json.loads(query.raw_data)
+    df_raw = pd.DataFrame(raw_text)
+    print(df_raw)
+    # Build insert query
+    insert_query = f"insert into {query.database_nm}.{query.schema_nm}.{query.tbl_nm} "
+    row_values = []
+    # Process each row
+    for i, row in df_raw.iterrows():
+        raw_data = str(row['raw_data']).replace("'", "\\'")
+        row_value = (
+            f"SELECT '{raw_data}', "
+            f"snowflake.cortex.{query.vector_embed_type}('{query.vector_embed_model}', '{raw_data}')"
+        )
+        row_values.append(row_value)
+
+        # Combine queries
+        select_query = " UNION ALL ".join(row_values)
+        final_query = f"{insert_query} {select_query}"
+
+    print(final_query)
+    
+    cur_res = app_cs.execute(final_query)
+    return f"Successfully loaded vector data into Snowflake table {query.tbl_nm}"
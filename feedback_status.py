@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ("applied", "not_found", "failed")
+
+
+class FeedbackStatusTracker:
+    """
+    Status of the feedback updates waiting for the next MERGE, per feedback id.
+
+    An id is `queued` when spooled, then `applied` or `not_found` once a
+    MERGE ran; a failed MERGE leaves it `retrying` until a later one
+    succeeds, or `failed` once the update was moved to the dead letters. `wait()` lets a caller await the outcome. At most `max_ids`
+    statuses are kept, each for `ttl` seconds.
+    """
+
+    def __init__(self, ttl: float = 3600, max_ids: int = 100000):
+        self.ttl = ttl
+        self.max_ids = max_ids
+        self._lock = threading.Lock()
+        self._statuses = OrderedDict()
+        self._waiters = {}
+
+    def _evict(self, now):
+        while self._statuses:
+            entry = next(iter(self._statuses.values()))
+            if len(self._statuses) <= self.max_ids and now - entry["updated"] < self.ttl:
+                break
+            self._statuses.popitem(last=False)
+
+    def set(self, fdbck_id, status: str, detail: str = None):
+        """Record a status; may be called from any thread"""
+        now = time.time()
+        with self._lock:
+            self._statuses.pop(fdbck_id, None)
+            self._statuses[fdbck_id] = {"status": status, "detail": detail, "updated": now}
+            self._evict(now)
+            waiters = self._waiters.pop(fdbck_id, []) if status in FINAL_STATUSES else []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_set_result, future, status)
+
+    def get(self, fdbck_id) -> dict:
+        with self._lock:
+            entry = self._statuses.get(fdbck_id)
+            return dict(entry) if entry else {"status": "unknown", "detail": None, "updated": None}
+
+    async def wait(self, fdbck_id, timeout: float) -> str:
+        """Final status of `fdbck_id`, or its current status after `timeout` seconds"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._statuses.get(fdbck_id)
+            if entry and entry["status"] in FINAL_STATUSES:
+                return entry["status"]
+            future = loop.create_future()
+            self._waiters.setdefault(fdbck_id, []).append((loop, future))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                waiters = self._waiters.get(fdbck_id, [])
+                if (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                if not waiters:
+                    self._waiters.pop(fdbck_id, None)
+            return self.get(fdbck_id)["status"]
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for entry in self._statuses.values():
+                counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+            return {"tracked": len(self._statuses), "waiting": sum(len(w) for w in self._waiters.values()), "statuses": counts}
+
+
+def _set_result(future, status):
+    if not future.done():
+        future.set_result(status)
@@ -1,3 +1,5 @@
+import asyncio
+import atexit
 from contextlib import asynccontextmanager
 from collections.abc import AsyncIterator
 from dataclasses import dataclass
@@ -23,93 +25,118 @@ from mcp.server.fastmcp import Context, FastMCP
 from mcp.server.fastmcp.prompts import Prompt
 import mcp.types as types
 from functools import partial
+from sf_pool import SnowflakeConnectionPool
+from sf_executor import sf_executor
+from sf_token import sf_token_manager
+from sf_catalog import search_service_catalog, show_search_services
+from sf_model_cache import semantic_model_files
+from sse import aiter_cortex_events
+from cortex_http import cortex_http
 
 
-# Create a named server
-mcp = FastMCP("DataFlyWheel App")
+# Snowflake connection pool settings
+SF_POOL_SIZE = int(os.getenv("SF_POOL_SIZE", "4"))
+SF_POOL_MIN_SIZE = int(os.getenv("SF_POOL_MIN_SIZE", "1"))
+SF_POOL_TIMEOUT = float(os.getenv("SF_POOL_TIMEOUT", "30"))
+SF_APLCTN_CD = "aedl"
 
 @dataclass
 class AppContext:
-    conn : SnowflakeConnection
-    db: str 
+    pool: SnowflakeConnectionPool
+    db: str
     schema: str
-    host: str  
-
-
-#@asynccontextmanager
-#async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-#    """Manage application lifecycle with type-safe context"""
-#    # Initialize on startup
-#    HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
-#    conn = snowflake.connector.connect(
-#        user="AN666554AD",
-#        password="Hyder@1234567890",
-#        account="JIB90126.privatelink",
-#        host=HOST,
-#        port=443,
-#        warehouse="DOC_AI_WH",
-#        role="DOC_AI_BUSINESS_USER"
-#    )
-#    try:
-#        yield AppContext(conn=conn,db="DOC_AI_DB",schema="HEDIS_SCHEMA",host=HOST)
-#    finally:
-#        # Cleanup on shutdown
-#        conn.close()
+    host: str
+
+
+SF_HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
+
+# One pool per process; FastMCP enters the lifespan for every client session
+SF_POOL = SnowflakeConnectionPool(
+    partial(
+        snowflake.connector.connect,
+        user="AN611824AD",
+        password="",
+        account="JIB90126.privatelink",
+        host=SF_HOST,
+        port=443,
+        warehouse="DOC_AI_WH",
+        role="DOC_AI_BUSINESS_USER",
+        authenticator='externalbrowser',
+    ),
+    size=SF_POOL_SIZE,
+    timeout=SF_POOL_TIMEOUT,
+)
+atexit.register(SF_POOL.close)
+
+
+@asynccontextmanager
+async def app_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
+    """Manage application lifecycle with type-safe context"""
+    # Make sure the shared pool is warm before the session starts calling tools
+    await asyncio.to_thread(SF_POOL.warm, SF_POOL_MIN_SIZE)
+    sf_token_manager.start()
+    search_service_catalog.start()
+    yield AppContext(pool=SF_POOL,db="DOC_AI_DB",schema="HEDIS_SCHEMA",host=SF_HOST)
 
 
 # Pass lifespan to server
-#mcp = FastMCP("DataFlyWheel App", lifespan=app_lifespan)
+mcp = FastMCP("DataFlyWheel App", lifespan=app_lifespan)
 
 #Stag name may need to be determined; requires code change 
 #Resources; Have access to resources required for the server; Cortex Search; Cortex stage schematic config; stage area should be fully qualified name 
 @mcp.resource(uri="schematiclayer://cortex_analyst/schematic_models/{stagename}/list",name="hedis_schematic_models",description="Hedis Schematic models")
 async def get_schematic_model(stagename: str):
     """Cortex analyst scematic layer model, model is in yaml format"""
-    #ctx = mcp.get_context()
-
-    HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
-    conn = snowflake.connector.connect(
-       user="AN611824AD",
-       password="",
-       account="JIB90126.privatelink",
-       host=HOST,
-       port=443,
-       warehouse="DOC_AI_WH",
-       role="DOC_AI_BUSINESS_USER",
-       authenticator='externalbrowser',
-    )
+    ctx = mcp.get_context()
+
+    app_ctx = ctx.request_context.lifespan_context
+    db = app_ctx.db
+    schema = app_ctx.schema
+
+    def list_stage(conn):
+        cursor = conn.cursor()
+        return cursor.execute("LIST @{db}.{schema}.{stagename}".format(db=db, schema=schema, stagename=stagename)).fetchall()
 
-    #conn = ctx.request_context.lifespan_context.conn 
-    db = 'DOC_AI_DB'
-    schema = 'HEDIS_SCHEMA'
-    cursor = conn.cursor()
-    snfw_model_list = cursor.execute("LIST @{db}.{schema}.{stagename}".format(db=db,schema=schema,stagename=stagename)) 
+    snfw_model_list = await sf_executor.run(SF_APLCTN_CD, app_ctx.pool.call, list_stage)
 
-    return [stg_nm[0].split("/")[-1] for stg_nm in  snfw_model_list if stg_nm[0].endswith('yaml')] 
+    return [stg_nm[0].split("/")[-1] for stg_nm in snfw_model_list if stg_nm[0].endswith('yaml')]
+
+@mcp.resource(uri="schematiclayer://cortex_analyst/schematic_models/{stagename}/models", name="hedis_schematic_model_contents", description="Parsed Hedis Schematic models with their tables, dimensions and measures")
+async def get_schematic_model_contents(stagename: str):
+    """Parsed cortex analyst semantic models of a stage, downloaded only when their checksum changes"""
+    ctx = mcp.get_context()
+
+    app_ctx = ctx.request_context.lifespan_context
+
+    return await sf_executor.run(
+        SF_APLCTN_CD,
+        app_ctx.pool.call,
+        semantic_model_files.stage_models,
+        app_ctx.db,
+        app_ctx.schema,
+        stagename,
+    )
     
 @mcp.resource("search://cortex_search/search_obj/list")
 async def get_search_service():
     """Cortex search service"""
+    ctx = mcp.get_context()
+
+    app_ctx = ctx.request_context.lifespan_context
+    db = app_ctx.db
+    schema = app_ctx.schema
+
+    # Served from memory; the catalog refreshes the list in the background
+    cached = search_service_catalog.cached((db, schema))
+    if cached is None:
+        cached = await sf_executor.run(
+            SF_APLCTN_CD,
+            search_service_catalog.get,
+            (db, schema),
+            partial(app_ctx.pool.call, show_search_services, db, schema),
+        )
+    result, _ = cached
 
-    HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
-    conn = snowflake.connector.connect(
-       user="AN611824AD",
-       password="",
-       account="JIB90126.privatelink",
-       host=HOST,
-       port=443,
-       warehouse="DOC_AI_WH",
-       role="DOC_AI_BUSINESS_USER",
-       authenticator='externalbrowser',
-    )
-
-    #conn = ctx.request_context.lifespan_context.conn 
-    db = 'DOC_AI_DB'
-    schema = 'HEDIS_SCHEMA'
-    cursor = conn.cursor()
-    snfw_search_objs = cursor.execute("SHOW CORTEX SEARCH SERVICES IN SCHEMA {db}.{schema}".format(db=db,schema=schema)) 
-    result = [search_obj[1] for search_obj in  snfw_search_objs.fetchall()] 
-    print(result)
     return result
      
 @mcp.resource("genaiplatform://{aplctn_cd}/frequent_questions/{user_context}")
@@ -242,31 +269,21 @@ async def add_frequent_questions(ctx: Context,uri: str,prompts: list) -> list:
 async def dfw_text2sql(prompt:str,ctx: Context) -> dict:
     """Tool to convert natural language text to snowflake sql for hedis system, text should be passed as 'prompt' input perameter"""
 
-    HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
-    conn = snowflake.connector.connect(
-       user="AN611824AD",
-       password="",
-       account="JIB90126.privatelink",
-       host=HOST,
-       port=443,
-       warehouse="DOC_AI_WH",
-       role="DOC_AI_BUSINESS_USER",
-       authenticator='externalbrowser',
-    )
-
-    #conn = ctx.request_context.lifespan_context.conn 
-    db = 'DOC_AI_DB'
-    schema = 'HEDIS_SCHEMA'    
-    host = HOST
-    stage_name= "hedis_stage_full"
-    file_name= "hedis_semantic_model_complete.yaml"
+    app_ctx = ctx.request_context.lifespan_context
+    db = app_ctx.db
+    schema = app_ctx.schema
+    host = app_ctx.host
+    stage_name = "hedis_stage_full"
+    file_name = "hedis_semantic_model_complete.yaml"
     request_body = {
-        "messages":[{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
         "semantic_model_file": f"@{db}.{schema}.{stage_name}/{file_name}",
     }
 
-    token = conn.rest.token
-    resp = requests.post(
+    token = await sf_executor.run(SF_APLCTN_CD, app_ctx.pool.call, sf_token_manager.get_token)
+    resp = await sf_executor.run(
+        SF_APLCTN_CD,
+        requests.post,
         url=f"https://{host}/api/v2/cortex/analyst/message",
         json=request_body,
         headers={
@@ -297,32 +314,23 @@ async def dfw_text2sql(prompt:str,ctx: Context) -> dict:
 async def dfw_search(ctx: Context,query: str):
     """Tool to provide search againest HEDIS business documents for the year 2024, search string should be provided as 'query' perameter"""
 
-    HOST = "carelon-eda-preprod.privatelink.snowflakecomputing.com"
-    conn = snowflake.connector.connect(
-       user="AN611824AD",
-       password="",
-       account="JIB90126.privatelink",
-       host=HOST,
-       port=443,
-       warehouse="DOC_AI_WH",
-       role="DOC_AI_BUSINESS_USER",
-       authenticator='externalbrowser',
-    )
-
-    #conn = ctx.request_context.lifespan_context.conn 
-    db = 'DOC_AI_DB'
-    schema = 'HEDIS_SCHEMA'    
+    app_ctx = ctx.request_context.lifespan_context
+    db = app_ctx.db
+    schema = app_ctx.schema
     search_service = 'CS_HEDIS_FULL_2024'
     columns = ['chunk']
     limit = 2
 
-    root = Root(conn) 
-    search_service = root.databases[db].schemas[schema].cortex_search_services[search_service]
-    response = search_service.search(
-        query=query,
-        columns=columns,
-        limit = limit 
-    )
+    def search(conn):
+        root = Root(conn)
+        service = root.databases[db].schemas[schema].cortex_search_services[search_service]
+        return service.search(
+            query=query,
+            columns=columns,
+            limit=limit
+        )
+
+    response = await sf_executor.run(SF_APLCTN_CD, app_ctx.pool.call, search)
     return response.to_json()
 
 @mcp.tool(
@@ -387,7 +395,9 @@ async def question_suggestions(ctx: Context,aplctn_cd: str, app_lvl_prefix: str,
         return ctx.read_resource(f"genaiplatform://{aplctn_cd}/frequent_questions/{context}")
     
     try: 
-        sf_conn = SnowFlakeConnector.get_conn(
+        sf_conn = await sf_executor.run(
+            aplctn_cd,
+            SnowFlakeConnector.get_conn,
             aplctn_cd,
             app_lvl_prefix,
             session_id,
@@ -397,7 +407,7 @@ async def question_suggestions(ctx: Context,aplctn_cd: str, app_lvl_prefix: str,
             status_code=status.HTTP_403_FORBIDDEN,
             detail="User not authorized to resources"
         )
-    clnt = httpx.AsyncClient(verify=False)
+    clnt = cortex_http.get("complete")
             
     request_body = {
         "model": "llama3.1-70b-elevance",
@@ -416,7 +426,7 @@ async def question_suggestions(ctx: Context,aplctn_cd: str, app_lvl_prefix: str,
     }
 
     headers = {
-        "Authorization": f'Snowflake Token="{sf_conn.rest.token}"',
+        "Authorization": await sf_token_manager.async_auth_header(sf_conn, aplctn_cd),
         "Content-Type": "application/json",
         "Accept": "application/json",
         "method":"cortex",
@@ -440,17 +450,13 @@ async def question_suggestions(ctx: Context,aplctn_cd: str, app_lvl_prefix: str,
                 detail=error_message.decode("utf-8")
             )
         # Stream the response content
-        async for result_chunk in response.aiter_bytes():
-            for elem in result_chunk.split(b'\n\n'):
-                if b'content' in elem:  # Check for data presence
-                    
-                    chunk_dict = json.loads(elem.replace(b'data: ', b''))
-                    print(chunk_dict)
-                    full_response = chunk_dict['choices'][0]['delta']['text']
-                    full_response = full_response 
-                    response_text.append(full_response)
-                       
-    return json.loads(response_text)
+        async for event in aiter_cortex_events(response):
+            chunk_dict = json.loads(event.data)
+            full_response = (chunk_dict.get('choices') or [{}])[0].get('delta', {}).get('text')
+            if full_response is not None:  # Check for data presence
+                response_text.append(full_response)
+
+    return json.loads("".join(response_text))
     
 @mcp.prompt(
         name="hedis-prompt",
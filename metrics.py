@@ -0,0 +1,281 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the last bucket is +Inf
+PHASE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+THROUGHPUT_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Models that get their own metric series; any other model name from a request is counted as "other"
+METRIC_MODELS = tuple(
+    model.strip()
+    for model in os.getenv(
+        "GENAI_METRIC_MODELS",
+        "llama3.1-8b,llama3.1-70b,llama3.1-70b-elevance,llama3.1-405b,llama3.2-1b,llama3.2-3b,llama3.3-70b,"
+        "mistral-7b,mistral-large2,mixtral-8x7b,snowflake-arctic,snowflake-llama-3.3-70b,"
+        "claude-3-5-sonnet,deepseek-r1,reka-flash,reka-core,jamba-1.5-mini,jamba-1.5-large,gemma-7b",
+    ).split(",")
+    if model.strip()
+)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels.items())
+
+
+def render_histogram(lines: list, name: str, hist: Histogram, **labels):
+    """Append `hist` to `lines` in the Prometheus text format"""
+    label_text = _labels(**labels)
+    prefix = label_text + "," if label_text else ""
+    cumulative = 0
+    for bound, count in zip(hist.buckets, hist.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {hist.count}')
+    label_text = f"{{{label_text}}}" if label_text else ""
+    lines.append(f"{name}_sum{label_text} {hist.sum}")
+    lines.append(f"{name}_count{label_text} {hist.count}")
+
+
+class CortexMetrics:
+    """
+    Per route and model histograms of request phase durations and output
+    throughput, plus request counts by outcome. Rendered in the Prometheus
+    text format by `render()`. The model comes from the request body, so only
+    `models` (and no model) are labelled by name; everything else is "other".
+    """
+
+    def __init__(self, models=METRIC_MODELS):
+        self.models = frozenset(models) | {""}
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._throughput = {}
+        self._requests = {}
+        self._output_chars = {}
+
+    def model_label(self, model) -> str:
+        return model if model in self.models else "other"
+
+    def observe_phase(self, route, model, phase, seconds: float):
+        model = self.model_label(model)
+        with self._lock:
+            key = (route, model, phase)
+            if key not in self._phases:
+                self._phases[key] = Histogram(PHASE_BUCKETS)
+            self._phases[key].observe(seconds)
+
+    def observe_request(self, route, model, status, output_chars: int = 0, chars_per_second: float = None):
+        model = self.model_label(model)
+        with self._lock:
+            key = (route, model, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._output_chars[(route, model)] = self._output_chars.get((route, model), 0) + output_chars
+            if chars_per_second is not None:
+                if (route, model) not in self._throughput:
+                    self._throughput[(route, model)] = Histogram(THROUGHPUT_BUCKETS)
+                self._throughput[(route, model)].observe(chars_per_second)
+
+    def summary(self) -> dict:
+        """p50/p95 per route, model and phase, for JSON consumers"""
+        with self._lock:
+            return {
+                f"{route}/{model}/{phase}": {
+                    "count": hist.count,
+                    "avg": hist.sum / hist.count if hist.count else 0.0,
+                    "p50": hist.quantile(0.5),
+                    "p95": hist.quantile(0.95),
+                }
+                for (route, model, phase), hist in self._phases.items()
+            }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append("# HELP cortex_phase_seconds Duration of a request phase, cumulative from request start for first_byte/first_token/last_token")
+            lines.append("# TYPE cortex_phase_seconds histogram")
+            for (route, model, phase), hist in sorted(self._phases.items()):
+                render_histogram(lines, "cortex_phase_seconds", hist, route=route, model=model, phase=phase)
+            lines.append("# HELP cortex_output_chars_per_second Streamed output characters per second between first and last token")
+            lines.append("# TYPE cortex_output_chars_per_second histogram")
+            for (route, model), hist in sorted(self._throughput.items()):
+                render_histogram(lines, "cortex_output_chars_per_second", hist, route=route, model=model)
+            lines.append("# HELP cortex_requests_total Cortex requests by outcome")
+            lines.append("# TYPE cortex_requests_total counter")
+            for (route, model, status), count in sorted(self._requests.items()):
+                lines.append(f"cortex_requests_total{{{_labels(route=route, model=model, status=status)}}} {count}")
+            lines.append("# HELP cortex_output_chars_total Streamed output characters")
+            lines.append("# TYPE cortex_output_chars_total counter")
+            for (route, model), count in sorted(self._output_chars.items()):
+                lines.append(f"cortex_output_chars_total{{{_labels(route=route, model=model)}}} {count}")
+        return "\n".join(lines) + "\n"
+
+
+cortex_metrics = CortexMetrics()
+
+
+def estimate_tokens(text) -> int:
+    """Rough token count of a text, about four characters per token"""
+    return round(len(text) / 4) if text else 0
+
+
+class RequestTimer:
+    """
+    Phase timing of one Cortex request.
+
+    `phase(name)` times a step such as api-key validation or connection
+    checkout; `mark(name)` records a milestone (upstream connect, first
+    byte, first/last token) as seconds since the request started, once.
+    `finish()` hands everything to `cortex_metrics`.
+    """
+
+    def __init__(self, route: str, model: str = "", metrics: CortexMetrics = cortex_metrics):
+        self.route = route
+        self.model = model or ""
+        self.metrics = metrics
+        self.started = time.monotonic()
+        self.phases = {}
+        self.marks = {}
+        self.output_chars = 0
+        self.stream_bytes = 0
+        self.upstream_status = None
+        self.usage = {}
+        self._finished = False
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.monotonic() - started
+
+    def mark(self, name: str):
+        if name not in self.marks:
+            self.marks[name] = time.monotonic() - self.started
+
+    def touch(self, name: str):
+        """Like `mark`, but keeps the latest time, e.g. for the last token"""
+        self.marks[name] = time.monotonic() - self.started
+
+    def add_output(self, text):
+        if text:
+            self.output_chars += len(text)
+
+    def set_usage(self, usage):
+        """Keep the token counts of an upstream `usage` object, when it has any"""
+        if usage:
+            self.usage.update({key: value for key, value in usage.items() if isinstance(value, (int, float))})
+
+    def accounting(self, prompt_text: str = "") -> dict:
+        """
+        Token counts, latency and size of the request for its audit row; without
+        upstream usage the tokens are estimated from the prompt and output size.
+        """
+        if self.usage.get("completion_tokens") is not None:
+            prompt_tokens = int(self.usage.get("prompt_tokens", 0))
+            completion_tokens = int(self.usage["completion_tokens"])
+            token_source = "upstream"
+        else:
+            prompt_tokens = estimate_tokens(prompt_text)
+            completion_tokens = round(self.output_chars / 4)
+            token_source = "estimate"
+        duration = self.marks.get("total", time.monotonic() - self.started)
+        ttft = self.marks.get("first_token")
+        return {
+            "route": self.route,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": int(self.usage.get("total_tokens", prompt_tokens + completion_tokens)),
+            "token_source": token_source,
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "duration_ms": round(duration * 1000, 1),
+            "stream_bytes": self.stream_bytes,
+            "upstream_status": self.upstream_status,
+        }
+
+    def server_timing(self) -> str:
+        """Server-Timing header value of the phases finished so far, in milliseconds"""
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in {**self.phases, **self.marks}.items()
+        )
+
+    def finish(self, status: str = "ok"):
+        if self._finished:
+            return
+        self._finished = True
+        self.mark("total")
+        for name, seconds in {**self.phases, **self.marks}.items():
+            self.metrics.observe_phase(self.route, self.model, name, seconds)
+        chars_per_second = None
+        if "first_token" in self.marks and "last_token" in self.marks:
+            streaming = self.marks["last_token"] - self.marks["first_token"]
+            if streaming > 0:
+                chars_per_second = self.output_chars / streaming
+        self.metrics.observe_request(self.route, self.model, status, self.output_chars, chars_per_second)
+
+
+async def timed_events(source, timer: RequestTimer):
+    """
+    Pass the events of a stream generator through, marking first and last
+    token and counting output characters and bytes; the timer is finished
+    with the stream's outcome.
+    """
+    status = "cancelled"
+    try:
+        async for item in source:
+            if isinstance(item, tuple):
+                kind, payload = item
+                if kind in ("text", "sql"):
+                    timer.mark("first_token")
+                    timer.touch("last_token")
+                    timer.add_output(payload)
+                    timer.stream_bytes += len(payload.encode("utf-8")) if payload else 0
+                elif kind == "error":
+                    status = "error"
+            else:
+                timer.mark("first_token")
+                timer.touch("last_token")
+                timer.stream_bytes += len(item)
+            yield item
+        if status != "error":
+            status = "ok"
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        timer.finish(status)
@@ -1,11 +1,12 @@
 import os
 import asyncio
-import httpx
 from fastmcp import FastMCP
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict
+from contextlib import asynccontextmanager
+from cortex_http import cortex_http
 
 # --- Pydantic Models for Input Validation ---
 class ProcessStatus(BaseModel):
@@ -57,18 +58,23 @@ TOKEN_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
 MCID_URL = os.getenv("MCID_URL", "XXXX")
 MEDICAL_URL = os.getenv("MEDICAL_URL", "XXXX")
 
+# One pooled client per Milliman upstream, kept alive across tool calls
+cortex_http.register("milliman_token", timeout=30.0, verify=True)
+cortex_http.register("milliman_mcid", timeout=30.0, verify=False)
+cortex_http.register("milliman_medical", timeout=60.0, verify=True)
+
 # --- FastMCP setup ---
 mcp = FastMCP(name="Milliman Dashboard Tools")
 
 # --- Helper function (used instead of calling get_token_tool directly) ---
 async def _fetch_token() -> Optional[str]:
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(TOKEN_URL, data=TOKEN_PAYLOAD, headers=TOKEN_HEADERS)
-            if response.status_code == 200:
-                return response.json().get("access_token")
-        except Exception as e:
-            print(f"Token fetch error: {e}")
+    client = cortex_http.get("milliman_token")
+    try:
+        response = await client.post(TOKEN_URL, data=TOKEN_PAYLOAD, headers=TOKEN_HEADERS)
+        if response.status_code == 200:
+            return response.json().get("access_token")
+    except Exception as e:
+        print(f"Token fetch error: {e}")
     return None
 
 # --- Tools ---
@@ -82,19 +88,19 @@ async def get_token_tool() -> dict:
 
 @mcp.tool(name="mcid_search", description="Perform MCID search with validated input")
 async def mcid_search_tool(request_body: MCIDRequestBody) -> dict:
-    async with httpx.AsyncClient(verify=False) as client:
-        try:
-            response = await client.post(
-                MCID_URL,
-                headers={"Content-Type": "application/json", "Apiuser": "MillimanUser"},
-                json=request_body.model_dump()
-            )
-            return {
-                'status_code': response.status_code,
-                'body': response.json() if response.content else {}
-            }
-        except Exception as e:
-            return {'status_code': 500, 'error': str(e)}
+    client = cortex_http.get("milliman_mcid")
+    try:
+        response = await client.post(
+            MCID_URL,
+            headers={"Content-Type": "application/json", "Apiuser": "MillimanUser"},
+            json=request_body.model_dump()
+        )
+        return {
+            'status_code': response.status_code,
+            'body': response.json() if response.content else {}
+        }
+    except Exception as e:
+        return {'status_code': 500, 'error': str(e)}
 
 @mcp.tool(name="submit_medical", description="Submit medical eligibility with validated input")
 async def submit_medical_tool(request_body: MedicalRequestBody) -> dict:
@@ -102,28 +108,34 @@ async def submit_medical_tool(request_body: MedicalRequestBody) -> dict:
     if not token:
         return {'status_code': 401, 'error': 'Failed to get access token'}
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                MEDICAL_URL,
-                headers={
-                    "Authorization": f"Bearer {token}",
-                    "Content-Type": "application/json"
-                },
-                json=request_body.model_dump()
-            )
-            return {
-                'status_code': response.status_code,
-                'body': response.json() if response.content else {}
-            }
-        except Exception as e:
-            return {'status_code': 500, 'error': str(e)}
+    client = cortex_http.get("milliman_medical")
+    try:
+        response = await client.post(
+            MEDICAL_URL,
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json"
+            },
+            json=request_body.model_dump()
+        )
+        return {
+            'status_code': response.status_code,
+            'body': response.json() if response.content else {}
+        }
+    except Exception as e:
+        return {'status_code': 500, 'error': str(e)}
 
 # --- FastAPI setup ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await cortex_http.aclose()
+
 app = FastAPI(
     title="Milliman Dashboard",
     description="FastMCP + FastAPI combined",
     version="0.0.1",
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
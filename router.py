@@ -15,8 +15,10 @@ from fastapi import (
     Depends,
     Query,
     Body,
+    Request,
 )
-from fastapi.responses import StreamingResponse,JSONResponse
+from fastapi.responses import StreamingResponse,JSONResponse,Response
+from fastapi.encoders import jsonable_encoder
 from pydantic import (
     BaseModel,
     Field,
@@ -59,8 +61,18 @@ from dependencies import (
     ValidApiKey,
     SnowFlakeConnector,
     log_response,
+    audit_writer,
+    audit_sf_pool,
+    requeue_audit_dead_letters,
+    audit_accounting_columns,
+    audit_columns_ready,
+    audit_rollup,
+    add_audit_accounting_columns,
+    AUDIT_ACCOUNTING,
+    feedback_status,
     update_log_response,
-    get_cortex_search_details,
+    get_cortex_search_catalog,
+    search_catalog_key,
     get_cortex_analyst_details,
     get_load_vector_data
 )
@@ -72,47 +84,155 @@ from pydantic import BaseModel
 from typing import List, Dict, Any
 from mcp import ClientSession
 from mcp.client.sse import sse_client
+import asyncio
 import httpx
+import os
 import json
 import uuid
 import re
 from functools import partial
 from upload_your_data import read_file_extract
+from contextlib import asynccontextmanager
+from sf_executor import sf_executor
+from sf_token import sf_token_manager
+from sf_catalog import semantic_model_catalog, search_service_catalog
+from sse import SSEParser, aiter_cortex_events
+from cortex_http import cortex_http
+from streaming import cancel_on_disconnect, coalesce_stream, format_stream, sse_frame, stream_stats
+from metrics import RequestTimer, cortex_metrics, timed_events
+from sql_results import (
+    RESULT_MEDIA_TYPES,
+    SQL_MAX_PAGE_SIZE,
+    SQL_PAGE_SIZE,
+    arrow_stream_chunks,
+    execute_paged,
+    fetch_result_page,
+    first_chunk_or_raise,
+    iter_arrow_stream,
+    iter_ndjson_batches,
+    iter_parquet,
+    ndjson_chunks,
+    negotiate_result_format,
+    normalize_frame,
+    parquet_chunks,
+    result_records,
+    stream_batches,
+    stream_ndjson,
+    table_records,
+)
+from sql_cache import SQL_CACHE_ENABLED, cacheable_sql, normalize_sql, result_cache_key, sql_cache
+from sql_pipeline import PipelinedSql
+from sql_jobs import (
+    FINAL_JOB_STATUSES,
+    SQL_JOB_MAX_WAIT,
+    SQL_JOB_POLL_SECONDS,
+    cancel_and_wait,
+    query_status,
+    sql_jobs,
+    submit_query,
+)
+
+
+@asynccontextmanager
+async def router_lifespan(app):
+    """Start the background Snowflake token and search catalog refresh and the audit writer; flush and close shared clients and pools on shutdown"""
+    sf_token_manager.start()
+    search_service_catalog.start()
+    audit_writer.start()
+    if AUDIT_ACCOUNTING:
+        try:
+            await sf_executor.run(
+                get_config().pltfrm_aplctn_cd,
+                add_audit_accounting_columns,
+                {AUDIT_STREAM_STATUS_COLUMN: "VARCHAR"},
+            )
+        except Exception as e:
+            logger.warning(f"Audit accounting columns not available, audit rows are written without them: {e}")
+    yield
+    await audit_writer.stop()
+    audit_sf_pool.close()
+    await search_service_catalog.stop()
+    await sf_token_manager.stop()
+    await cortex_http.aclose()
+    sf_executor.shutdown()
+
 route = APIRouter(
-    prefix="/api/cortex"
+    prefix="/api/cortex",
+    lifespan=router_lifespan
 )
 from   snowflake.connector.errors import DatabaseError
 from datetime import datetime, date
 
 
+def execute_sql_records(sf_conn, exec_sql):
+    """
+    Execute an SQL query and return the rows as JSON-ready records; blocking, run it through sf_executor.
+    """
+    cs = sf_conn.cursor()
+    cs.execute(exec_sql)
+
+    # Fetch the results into a DataFrame
+    df = normalize_frame(cs.fetch_pandas_all())
+
+    cs.close()
+
+    # Convert DataFrame to JSON
+    return df.to_dict(orient="records")
+
+
+AUDIT_STREAM_STATUS_COLUMN = os.getenv("GENAI_AUDIT_STATUS_COLUMN", "strm_stts_cd")
+FEEDBACK_WAIT_SECONDS = float(os.getenv("GENAI_FEEDBACK_WAIT_SECONDS", "10"))
+
+
+def log_cancelled_response(audit_rec, query_id, response_text, fdbck_id, session_id, extra_columns=None):
+    """
+    Queue the partial audit row of a stream the client walked away from, flagged as cancelled.
+    Background tasks do not run once the client is gone, so the row is queued right away.
+    The status column is only set once startup added it to the audit table.
+    """
+    extra_columns = dict(extra_columns or {})
+    if audit_columns_ready():
+        extra_columns[AUDIT_STREAM_STATUS_COLUMN] = "CANCELLED"
+    log_response(audit_rec, query_id, response_text, fdbck_id, session_id, extra_columns)
+
+
 @route.post("/complete")
 async def llm_gateway(
         query: Annotated[CompleteQryModel,Body(embed=True)], 
+        request: Request,
         config: Annotated[GenAiEnvSettings,Depends(get_config)],
         logger: Annotated[Logger,Depends(get_logger)],
         background_tasks: BackgroundTasks,
-        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)]
+        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)],
+        passthrough: Annotated[bool,Query(description="Relay the upstream SSE events unchanged; the feedback id is sent in the X-Feedback-Id header")] = False,
+        events: Annotated[bool,Query(description="Send named SSE events (text, sql, suggestions, citations, meta, error, done) with JSON data instead of the plain text stream")] = False
 
 ):
+    timer = RequestTimer("complete", query.model)
     prompt = query.prompt.messages[-1].content
     messages_json = query.prompt.messages
     
     #The API key validation and generation has been pushed to backend; the api_validator will return True if API key is valid for the application.
     api_validator = ValidApiKey()
     try :
-        if api_validator(query.api_key,query.aplctn_cd,query.app_id):
+        with timer.phase("api_key"):
+            api_key_valid = await asyncio.to_thread(api_validator, query.api_key,query.aplctn_cd,query.app_id)
+        if api_key_valid:
             try: 
-                sf_conn = SnowFlakeConnector.get_conn(
-                    query.aplctn_cd,
-                    query.app_lvl_prefix,
-                    query.session_id,
-                )
+                with timer.phase("sf_conn"):
+                    sf_conn = await sf_executor.run(
+                        query.aplctn_cd,
+                        SnowFlakeConnector.get_conn,
+                        query.aplctn_cd,
+                        query.app_lvl_prefix,
+                        query.session_id,
+                    )
             except DatabaseError as e: 
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="User not authorized to resources"
                 )
-            clnt = httpx.AsyncClient(verify=False)
+            clnt = cortex_http.get("complete")
             
             request_body = {
                 "model": query.model,
@@ -125,7 +245,7 @@ async def llm_gateway(
             }
 
             headers = {
-                "Authorization": f'Snowflake Token="{sf_conn.rest.token}"',
+                "Authorization": await sf_token_manager.async_auth_header(sf_conn, query.aplctn_cd),
                 "Content-Type": "application/json",
                 "Accept": "application/json",
                 "method":"cortex",
@@ -136,13 +256,95 @@ async def llm_gateway(
             response_text = []
             query_id = [None]
             fdbck_id = [str(uuid.uuid4())]
-            
+
+            def add_audit_record(full_final_response, cancelled=False):
+                accounting = timer.accounting(request_body["messages"][0]["content"])
+                accounting["client_app"] = query.aplctn_cd
+                extra_columns = audit_accounting_columns(accounting)
+                #Model recreated the for the Audit record
+                audit_rec = GenAiCortexAudit(
+                    edl_load_dtm = get_load_datetime,
+                    edl_run_id = "0000",
+                    edl_scrty_lvl_cd = "NA",
+                    edl_lob_cd = "NA",
+                    srvc_type = "complete",
+                    aplctn_cd = config.pltfrm_aplctn_cd,
+                    user_id = "Complete_User",#query.user_id,
+                    mdl_id = query.model,
+                    cnvrstn_chat_lmt_txt = query.limit_convs,
+                    sesn_id = query.session_id,
+                    prmpt_txt = prompt,
+                    tkn_cnt = str(accounting["total_tokens"]),
+                    feedbk_actn_txt = "",
+                    feedbk_cmnt_txt = "",
+                    feedbk_updt_dtm = get_load_datetime,
+                )
+                if cancelled:
+                    log_cancelled_response(audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id,extra_columns)
+                    return
+                background_tasks.add_task(log_response,audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id,extra_columns)
+
+            def add_cancelled_audit_record():
+                add_audit_record("".join(response_text), cancelled=True)
+
+            async def collect_response_text(tap: asyncio.Queue):
+                """
+                Decode the relayed chunks for the audit record, off the streaming path.
+                """
+                parser = SSEParser()
+                while (chunk := await tap.get()) is not None:
+                    for event in parser.feed(chunk):
+                        try:
+                            chunk_dict = json.loads(event.data)
+                        except json.JSONDecodeError:
+                            continue
+                        timer.set_usage(chunk_dict.get('usage'))
+                        choices = chunk_dict.get('choices') or [{}]
+                        text = choices[0].get('delta', {}).get('text')
+                        if text is not None:
+                            response_text.append(text)
+                            timer.add_output(text)
+                            query_id[0] = chunk_dict.get('id', query_id[0])
+
+            async def passthrough_streamer():
+                """
+                Relay the upstream event stream byte for byte; a side task extracts the text for the audit.
+                """
+                tap = asyncio.Queue()
+                collector = asyncio.create_task(collect_response_text(tap))
+                try:
+                    async with clnt.stream('POST', url, headers=headers, json=request_body) as response:
+                        timer.mark("upstream_connect")
+                        timer.upstream_status = response.status_code
+                        if response.is_error:
+                            error_message = await response.aread()
+                            raise HTTPException(
+                                status_code=response.status_code,
+                                detail=error_message.decode("utf-8")
+                            )
+                        async for result_chunk in response.aiter_bytes():
+                            timer.mark("first_byte")
+                            tap.put_nowait(result_chunk)
+                            yield result_chunk
+                except httpx.RequestError as e:
+                    logger.error(f"Request error: {e}")
+                    yield sse_frame("error", {"detail": str(e)}).encode("utf-8")
+                except Exception as e:
+                    logger.error(f"Unexpected error: {e}")
+                    yield sse_frame("error", {"detail": str(e)}).encode("utf-8")
+                finally:
+                    tap.put_nowait(None)
+                    await collector
+                add_audit_record("".join(response_text))
+
             async def data_streamer():
                 """
                 Stream data from the service and yield responses with proper exception handling.
                 """
                 try:
                     async with clnt.stream('POST', url, headers=headers, json=request_body) as response:
+                        timer.mark("upstream_connect")
+                        timer.upstream_status = response.status_code
                         if response.is_client_error:
                             error_message = await response.aread()
                             raise HTTPException(
@@ -157,56 +359,49 @@ async def llm_gateway(
                             )
 
                         # Stream the response content
-                        async for result_chunk in response.aiter_bytes():
-                            for elem in result_chunk.split(b'\n\n'):
-                                if b'content' in elem:  # Check for data presence
-                                    try:
-                                        chunk_dict = json.loads(elem.replace(b'data: ', b''))
-                                        print(chunk_dict)
-                                        full_response = chunk_dict['choices'][0]['delta']['text']
-                                        full_response = full_response 
-                                        response_text.append(full_response)
-                                        yield full_response#result_chunk
-                                        query_id[0] =  chunk_dict['id']
-                                    except json.JSONDecodeError as e:
-                                        logger.error(f"Error decoding JSON: {e}")
-                                        yield json.dumps({"error": "Error decoding JSON", "detail": str(e)})
-                                        continue
-                        yield "end_of_stream"
+                        async for event in aiter_cortex_events(response, lambda: timer.mark("first_byte")):
+                            try:
+                                chunk_dict = json.loads(event.data)
+                            except json.JSONDecodeError as e:
+                                logger.error(f"Error decoding JSON: {e}")
+                                yield "error", {"error": "Error decoding JSON", "detail": str(e)}
+                                continue
+                            timer.set_usage(chunk_dict.get('usage'))
+                            choices = chunk_dict.get('choices') or [{}]
+                            full_response = choices[0].get('delta', {}).get('text')
+                            if full_response is None:  # Check for data presence
+                                continue
+                            response_text.append(full_response)
+                            yield "text", full_response#result_chunk
+                            query_id[0] =  chunk_dict['id']
+                        yield "done", None
                         responses = {
                     "prompt":prompt,
                     "query_id": query_id[0],
                     "fdbck_id": fdbck_id[0] }
                     full_final_response = "".join(response_text)
-                    yield json.dumps(responses)
+                    yield "meta", responses
 
                 except httpx.RequestError as e:
                     logger.error(f"Request error: {e}")
-                    yield json.dumps({"detail": str(e)})
+                    yield "error", {"detail": str(e)}
                 except Exception as e:
                     logger.error(f"Unexpected error: {e}")
-                    yield json.dumps({"detail": str(e)})
+                    yield "error", {"detail": str(e)}
             
-                #Model recreated the for the Audit record
-                audit_rec = GenAiCortexAudit(
-                    edl_load_dtm = get_load_datetime,
-                    edl_run_id = "0000",
-                    edl_scrty_lvl_cd = "NA",
-                    edl_lob_cd = "NA",
-                    srvc_type = "complete",
-                    aplctn_cd = config.pltfrm_aplctn_cd,
-                    user_id = "Complete_User",#query.user_id,
-                    mdl_id = query.model,
-                    cnvrstn_chat_lmt_txt = query.limit_convs,
-                    sesn_id = query.session_id,
-                    prmpt_txt = prompt.replace("'","\\'"),
-                    tkn_cnt = "0",
-                    feedbk_actn_txt = "",
-                    feedbk_cmnt_txt = "",
-                    feedbk_updt_dtm = get_load_datetime,
+                add_audit_record(full_final_response)
+
+            if passthrough:
+                return StreamingResponse(
+                    coalesce_stream(
+                        cancel_on_disconnect(timed_events(passthrough_streamer(), timer), request, "complete", add_cancelled_audit_record),
+                        "complete",
+                        timer.started,
+                    ),
+                    media_type='text/event-stream',
+                    headers={"X-Feedback-Id": fdbck_id[0], "Server-Timing": timer.server_timing()},
                 )
-                background_tasks.add_task(log_response,audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id)
-            return StreamingResponse(data_streamer(),media_type='text/event-stream')
+            return StreamingResponse(coalesce_stream(format_stream(cancel_on_disconnect(timed_events(data_streamer(), timer), request, "complete", add_cancelled_audit_record), events), "complete", timer.started), media_type='text/event-stream', headers={"Server-Timing": timer.server_timing()})
         else: 
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -226,98 +421,188 @@ async def llm_gateway(
     
 @route.post("/search_details/")
 async def get_search_details(
+        request: Request,
         search_input: Annotated[List,Depends(SearchModel)]):
-    try:
-        return get_cortex_search_details(search_input) 
-    except Exception as e: 
-        raise HTTPException(
-                status_code=status.HTTP_403_FORBIDDEN,
-                detail="User not authorized for search resources"
-            ) 
+    """
+    Cortex Search services of the schema, served from the search service catalog.
+    The response carries an ETag; send it back in If-None-Match to get a 304 while the list is unchanged.
+    """
+    cached = search_service_catalog.cached(search_catalog_key(search_input))
+    if cached is not None:
+        search_names, version = cached
+    else:
+        try:
+            search_names, version = await sf_executor.run(search_input.aplctn_cd, get_cortex_search_catalog, search_input)
+        except Exception as e: 
+            raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    detail="User not authorized for search resources"
+                ) 
+    etag = f'"{version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return JSONResponse(content=search_names, headers={"ETag": etag})
 
 @route.post("/analyst_details/")
 async def get_analyst_details(
         analyst_input: Annotated[List,Depends(AnalystModel)]):
     try:
-        return get_cortex_analyst_details(analyst_input)
-    except HTTPException as he: 
+        return await sf_executor.run(analyst_input.aplctn_cd, get_cortex_analyst_details, analyst_input)
+    except HTTPException as he:
         raise he
 
+@route.get("/connection_stats/")
+async def get_connection_stats():
+    """
+    Counters of the shared Snowflake connections, executor, tokens and catalogs,
+    of the pooled Cortex HTTP clients, the audit writer, the SQL jobs and the SQL result cache.
+    """
+    return {
+        "connections": SnowFlakeConnector.stats(),
+        "executor": sf_executor.stats(),
+        "tokens": sf_token_manager.stats(),
+        "semantic_catalog": semantic_model_catalog.stats(),
+        "search_catalog": search_service_catalog.stats(),
+        "http": cortex_http.stats(),
+        "streams": stream_stats.stats(),
+        "cortex": cortex_metrics.summary(),
+        "audit": audit_writer.stats(),
+        "audit_connection": audit_sf_pool.stats(),
+        "feedback": feedback_status.stats(),
+        "sql_jobs": sql_jobs.stats(),
+        "sql_cache": sql_cache.stats(),
+    }
+
+
+@route.get("/metrics")
+async def get_metrics():
+    """
+    Per route and model phase timings (time to first token, upstream connect,
+    ...) and output throughput of the Cortex routes, the audit writer queue
+    and the SQL result cache hits and saved warehouse time, in Prometheus text format.
+    """
+    return Response(cortex_metrics.render() + audit_writer.render() + sql_cache.render(), media_type="text/plain; version=0.0.4")
+
+
+@route.post("/semantic_catalog/refresh/")
+async def refresh_semantic_catalog(
+        analyst_input: Annotated[List,Depends(AnalystModel)]):
+    """
+    Re-list the stages of database_nm.schema_nm and replace the application's cached semantic model catalog.
+    """
+    api_validator = ValidApiKey()
+    if not await asyncio.to_thread(api_validator, analyst_input.api_key, analyst_input.aplctn_cd, analyst_input.app_id):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthenticated user"
+        )
+    try:
+        sf_conn = await sf_executor.run(
+            analyst_input.aplctn_cd,
+            SnowFlakeConnector.get_conn,
+            analyst_input.aplctn_cd,
+            analyst_input.app_lvl_prefix,
+            analyst_input.session_id
+        )
+    except DatabaseError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User not authorized to resources"
+        )
+    return await sf_executor.run(
+        analyst_input.aplctn_cd,
+        semantic_model_catalog.file_names,
+        sf_conn,
+        analyst_input.aplctn_cd,
+        analyst_input.app_lvl_prefix,
+        analyst_input.database_nm,
+        analyst_input.schema_nm,
+        True,
+    )
+
+
+@route.delete("/semantic_catalog/")
+async def invalidate_semantic_catalog(
+        aplctn_cd: str,
+        app_id: str,
+        api_key: str,
+        app_lvl_prefix: Optional[str] = "",
+        database_nm: Optional[str] = None,
+        schema_nm: Optional[str] = None):
+    """
+    Drop the application's cached semantic model catalogs so its next request lists the stages again;
+    without database_nm every schema cached for the application is dropped.
+    """
+    api_validator = ValidApiKey()
+    if not await asyncio.to_thread(api_validator, api_key, aplctn_cd, app_id):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthenticated user"
+        )
+    semantic_model_catalog.invalidate(aplctn_cd, app_lvl_prefix, database_nm, schema_nm)
+    return {"invalidated": True}
+
 
 @route.post("/txt2sql")
 async def llm_gateway(
         query: Annotated[Txt2SqlModel,Body(embed=True)], 
+        request: Request,
         config: Annotated[GenAiEnvSettings,Depends(get_config)],
         logger: Annotated[Logger,Depends(get_logger)],
         background_tasks: BackgroundTasks,
-        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)]
+        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)],
+        events: Annotated[bool,Query(description="Send named SSE events (text, sql, suggestions, citations, meta, error, done) with JSON data instead of the plain text stream")] = False,
+        execute: Annotated[bool,Query(description="Run the generated SQL while the stream goes on and send its rows on the same response, see /txt2sql/execute")] = False,
+        cache: Annotated[bool,Query(description="With execute, use the SQL result cache")] = True
 ):
+    timer = RequestTimer("txt2sql_execute" if execute else "txt2sql", query.model)
     prompt = query.prompt.messages[-1].content
     #semantic_model = [f"{query.database_nm}.{query.schema_nm}." + item for item in query.semantic_model]
     
     #The API key validation and generation has been pushed to backend; the api_validator will return True if API key is valid for the application.
     api_validator = ValidApiKey()
     try:
-        if api_validator(query.api_key,query.aplctn_cd,query.app_id):
+        with timer.phase("api_key"):
+            api_key_valid = await asyncio.to_thread(api_validator, query.api_key,query.aplctn_cd,query.app_id)
+        if api_key_valid:
             
             try: 
-                sf_conn = SnowFlakeConnector.get_conn(
-                    query.aplctn_cd,
-                    query.app_lvl_prefix,
-                    query.session_id
-                )
+                with timer.phase("sf_conn"):
+                    sf_conn = await sf_executor.run(
+                        query.aplctn_cd,
+                        SnowFlakeConnector.get_conn,
+                        query.aplctn_cd,
+                        query.app_lvl_prefix,
+                        query.session_id
+                    )
             except DatabaseError as e: 
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="User not authorized to resources"
                 )
             
-            cs = sf_conn.cursor()
-
-            stage_show = f"SHOW STAGES in SCHEMA {query.database_nm}.{query.schema_nm};"
-            # Get list of all stage names
-            df_stg_lst = cs.execute(stage_show).fetchall()
-            stage_names  = [sublist[1] for sublist in df_stg_lst]
-            print(stage_names)
-            semantic_models = []
-
-            for stage_name in stage_names:
-                list_query = f"LIST @{query.database_nm}.{query.schema_nm}.{stage_name};"
-                try:
-                    df_stg_files_lst = cs.execute(list_query).fetchall()
-                except Exception as e:
-                    print(f"Error listing files in stage {stage_name}: {e}")
-                    continue
-                # Extract .yaml files
-                for sublist in df_stg_files_lst:
-                    file_path = sublist[0]
-                    if file_path.endswith('.yaml') or file_path.endswith('.yaml.gz'):
-                        semantic_models.append(file_path)
-                print(semantic_models)
-
-            #query1 = {"semantic_model": ["test.yaml", "contract_star_rating_v2.yaml"]}
-            query1 = {"semantic_model": query.semantic_model}
-
-            # Construct full stage paths for the query models
-            semantic_model_paths = []
-            for model_name in query1["semantic_model"]:
-                # Find the matching path from semantic_models
-                matching_paths = [path for path in semantic_models if path.endswith("/" + model_name) or path.endswith("/" + model_name + '.gz')]          
-                if matching_paths:
-                    # Use the first matching path and construct the full stage path
-                    stage_path = f"@{query.database_nm}.{query.schema_nm}." + matching_paths[0]
-                    semantic_model_paths.append(stage_path)
-                else:
-                    print(f"Warning: No matching path found for {model_name}")
-                    raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"No matching path found for {model_name}"
-                    )
+            with timer.phase("stage_discovery"):
+                semantic_model_paths, missing = await sf_executor.run(
+                    query.aplctn_cd,
+                    semantic_model_catalog.resolve,
+                    sf_conn,
+                    query.aplctn_cd,
+                    query.app_lvl_prefix,
+                    query.database_nm,
+                    query.schema_nm,
+                    query.semantic_model,
+                )
+            if missing:
+                print(f"Warning: No matching path found for {missing[0]}")
+                raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"No matching path found for {missing[0]}"
+                )
             #semantic_model_old = ["@DOC_AI_DB.HEDIS_SCHEMA.HEDIS_STAGE_FULL/" + item for item in query.semantic_model] 
             #print(semantic_model_old)
             semantic_model = semantic_model_paths  
             print("mdl", semantic_model)
-            clnt = httpx.AsyncClient(verify=False,timeout=90.0)        
+            clnt = cortex_http.get("txt2sql")
             request_body = {
                 "messages": [
                     {
@@ -330,10 +615,10 @@ async def llm_gateway(
                         ]
                     }
                 ],
-                "semantic_model_file": semantic_model[0].split('.gz')[0] #f"@{query.database_nm}.{query.schema_nm}.{query.stage_nm}/{query.semantic_model[0]}",
+                "semantic_model_file": semantic_model[0] #f"@{query.database_nm}.{query.schema_nm}.{query.stage_nm}/{query.semantic_model[0]}",
             }
             headers = {
-                "Authorization": f'Snowflake Token="{sf_conn.rest.token}"',
+                "Authorization": await sf_token_manager.async_auth_header(sf_conn, query.aplctn_cd),
                 "Content-Type": "application/json",
                 "Accept": "application/json",
                 "method":"cortex",
@@ -341,14 +626,51 @@ async def llm_gateway(
             }
             url = getattr(config.TXT2SQL, "{}_host".format(config.env))
             get_sql = ""
+            sql_response = []
             query_id = [None]
             fdbck_id = [str(uuid.uuid4())]
+            pipeline = PipelinedSql(
+                sf_conn, query.aplctn_cd, query.app_id, query.app_lvl_prefix, query.session_id, use_cache=cache
+            ) if execute else None
+
+            def add_audit_record(full_final_response, cancelled=False):
+                accounting = timer.accounting(prompt)
+                accounting["client_app"] = query.aplctn_cd
+                extra_columns = audit_accounting_columns(accounting)
+                #Model recreated the for the Audit record
+                audit_rec = GenAiCortexAudit(
+                    edl_load_dtm = get_load_datetime,
+                    edl_run_id = "0000",
+                    edl_scrty_lvl_cd = "NA",
+                    edl_lob_cd = "NA",
+                    srvc_type = "Analyst",
+                    aplctn_cd = config.pltfrm_aplctn_cd,
+                    user_id = "Analyst_User",#query.user_id,
+                    mdl_id = query.model,
+                    cnvrstn_chat_lmt_txt = "0",#query.cnvrstn_chat_lmt_txt,
+                    sesn_id = query.session_id,
+                    prmpt_txt = prompt,
+                    tkn_cnt = str(accounting["total_tokens"]),
+                    feedbk_actn_txt = "",
+                    feedbk_cmnt_txt = "",
+                    feedbk_updt_dtm = get_load_datetime,
+                )
+                if cancelled:
+                    log_cancelled_response(audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id,extra_columns)
+                    return
+                background_tasks.add_task(log_response,audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id,extra_columns)
+
+            def add_cancelled_audit_record():
+                add_audit_record("".join(sql_response), cancelled=True)
+
             async def txt2sql_data_streamer():
                 try:
                     """
                     Stream data from the TXT2SQL service and yield responses.
                     """
                     async with clnt.stream('POST', url, headers=headers, json=request_body) as response:
+                        timer.mark("upstream_connect")
+                        timer.upstream_status = response.status_code
                         if response.is_client_error:
                             error_message = await response.aread()
                             raise HTTPException(
@@ -361,68 +683,59 @@ async def llm_gateway(
                                 status_code=response.status_code,
                                 detail=error_message.decode("utf-8")
                             )
-                        async for result_chunk in response.aiter_bytes():
-                            #print(result_chunk)
-                            for elem in result_chunk.split(b'\n\n'):
-                                if b'content' in elem:  # Check for data presence
-                                    try:
-                                        chunk_dict = json.loads(elem.replace(b'data: ', b''))
-                                        query_id[0]=chunk_dict['request_id']
-                                        items = chunk_dict.get("message", {}).get("content", [])
-                                        for item in items:
-                                            item_type = item.get("type")
-                                            if item_type == "text":
-                                                yield item.get("text", "")
-                                                yield "end_of_interpretation"
-                                            elif item_type == "sql":
-                                                get_sql = item.get("statement", "")
-                                                #print("sql is ", get_sql)
-                                                yield item.get("statement", "")
-                                            elif item_type == "suggestions":
-                                                yield json.dumps({"suggestions": item.get("suggestions", [])})
-                                    except json.JSONDecodeError as e:
-                                        logger.error(f"Error decoding JSON: {e}")
-                                        continue
-                        yield "end_of_stream"
-                        responses = {
-                        "prompt":prompt,
-                        "query_id": query_id[0],
-                        "fdbck_id": fdbck_id[0],
-                        "type": "sql" }
-                        full_final_response = "".join(get_sql)
-                        yield json.dumps(responses)
-                        #yield json.dumps({"type": "sql"})
-                        #yield json.dumps({"prompt":prompt,"type": "sql"})
+                        async for event in aiter_cortex_events(response, lambda: timer.mark("first_byte")):
+                            try:
+                                chunk_dict = json.loads(event.data)
+                            except json.JSONDecodeError as e:
+                                logger.error(f"Error decoding JSON: {e}")
+                                continue
+                            timer.set_usage(chunk_dict.get("usage"))
+                            items = chunk_dict.get("message", {}).get("content", [])
+                            if not items:  # Check for data presence
+                                continue
+                            query_id[0]=chunk_dict.get('request_id', query_id[0])
+                            for item in items:
+                                item_type = item.get("type")
+                                if item_type == "text":
+                                    yield "text", item.get("text", "")
+                                    yield "interpretation_end", "end_of_interpretation"
+                                elif item_type == "sql":
+                                    get_sql = item.get("statement", "")
+                                    sql_response.append(get_sql)
+                                    #print("sql is ", get_sql)
+                                    if pipeline is not None:
+                                        pipeline.start(get_sql)
+                                    yield "sql", item.get("statement", "")
+                                elif item_type == "suggestions":
+                                    yield "suggestions", item.get("suggestions", [])
+                    if pipeline is not None:
+                        async for event in pipeline.events():
+                            yield event
+                    yield "done", None
+                    responses = {
+                    "prompt":prompt,
+                    "query_id": query_id[0],
+                    "fdbck_id": fdbck_id[0],
+                    "type": "sql" }
+                    full_final_response = "".join(sql_response)
+                    yield "meta", responses
+                    #yield json.dumps({"type": "sql"})
+                    #yield json.dumps({"prompt":prompt,"type": "sql"})
 
                 except httpx.RequestError as e:
                     logger.error(f"Request error: {e}")
-                    yield json.dumps({"detail": str(e)})
+                    yield "error", {"detail": str(e)}
                 except Exception as e:
                     logger.error(f"Unexpected error: {e}")
-                    yield json.dumps({"detail": str(e)})
+                    yield "error", {"detail": str(e)}
+                finally:
+                    if pipeline is not None:
+                        await pipeline.aclose()
 
-                #Model recreated the for the Audit record
-                audit_rec = GenAiCortexAudit(
-                    edl_load_dtm = get_load_datetime,
-                    edl_run_id = "0000",
-                    edl_scrty_lvl_cd = "NA",
-                    edl_lob_cd = "NA",
-                    srvc_type = "Analyst",
-                    aplctn_cd = config.pltfrm_aplctn_cd,
-                    user_id = "Analyst_User",#query.user_id,
-                    mdl_id = query.model,
-                    cnvrstn_chat_lmt_txt = "0",#query.cnvrstn_chat_lmt_txt,
-                    sesn_id = query.session_id,
-                    prmpt_txt = prompt.replace("'","\\'"),
-                    tkn_cnt = "0",
-                    feedbk_actn_txt = "",
-                    feedbk_cmnt_txt = "",
-                    feedbk_updt_dtm = get_load_datetime,
-                )
-                background_tasks.add_task(log_response,audit_rec,query_id,str(full_final_response),fdbck_id,query.session_id)
+                add_audit_record(full_final_response)
 
             # Return a streaming response
-            return StreamingResponse(txt2sql_data_streamer(), media_type='text/event-stream')
+            return StreamingResponse(coalesce_stream(format_stream(cancel_on_disconnect(timed_events(txt2sql_data_streamer(), timer), request, timer.route, add_cancelled_audit_record), events), timer.route, timer.started), media_type='text/event-stream', headers={"Server-Timing": timer.server_timing()})
         else:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -439,74 +752,81 @@ async def llm_gateway(
             )
 
 
+txt2sql_gateway = llm_gateway
+
+
+@route.post("/txt2sql/execute")
+async def txt2sql_execute(
+        query: Annotated[Txt2SqlModel,Body(embed=True)],
+        request: Request,
+        config: Annotated[GenAiEnvSettings,Depends(get_config)],
+        logger: Annotated[Logger,Depends(get_logger)],
+        background_tasks: BackgroundTasks,
+        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)],
+        events: Annotated[bool,Query(description="Send named SSE events (text, sql, suggestions, citations, rows, sql_result, meta, error, done) with JSON data instead of the plain text stream")] = False,
+        cache: Annotated[bool,Query(description="Use the SQL result cache for the generated SQL")] = True
+):
+    """
+    /txt2sql and /txt2sql/run_sql_query in one request: the generated SQL is submitted to Snowflake as soon as
+    the sql item arrives, and its rows follow the interpretation on the same stream as `rows` events
+    ({"rows": [...]}, at most GENAI_TXT2SQL_MAX_ROWS) and one `sql_result` event with the query id, status and
+    row count. The query id is also an SQL job id for /txt2sql/jobs/{job_id}/results.
+    """
+    return await txt2sql_gateway(query, request, config, logger, background_tasks, get_load_datetime, events, execute=True, cache=cache)
+
+
 @route.post("/agent")
 async def llm_gateway(
         query: Annotated[AgentModel,Body(embed=True)], 
+        request: Request,
         config: Annotated[GenAiEnvSettings,Depends(get_config)],
         logger: Annotated[Logger,Depends(get_logger)],
         background_tasks: BackgroundTasks,
-        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)]
+        get_load_datetime: Annotated[datetime,Depends(get_load_timestamp)],
+        events: Annotated[bool,Query(description="Send named SSE events (text, sql, suggestions, citations, meta, error, done) with JSON data instead of the plain text stream")] = False
 
 ):
+    timer = RequestTimer("agent", query.model)
     prompt = query.prompt.messages[-1].content
     search_service = [f"{query.database_nm}.{query.schema_nm}." + item for item in query.search_service]
 
     api_validator = ValidApiKey()
     try:
-        if api_validator(query.api_key,query.aplctn_cd,query.app_id):   
+        with timer.phase("api_key"):
+            api_key_valid = await asyncio.to_thread(api_validator, query.api_key,query.aplctn_cd,query.app_id)
+        if api_key_valid:
             try: 
-                sf_conn = SnowFlakeConnector.get_conn(
-                    query.aplctn_cd,
-                    query.app_lvl_prefix,
-                    query.session_id
-                )
+                with timer.phase("sf_conn"):
+                    sf_conn = await sf_executor.run(
+                        query.aplctn_cd,
+                        SnowFlakeConnector.get_conn,
+                        query.aplctn_cd,
+                        query.app_lvl_prefix,
+                        query.session_id
+                    )
             except DatabaseError as e: 
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail="User not authorized to resources"
                 )
-            cs = sf_conn.cursor()
-
-            stage_show = f"SHOW STAGES in SCHEMA {query.database_nm}.{query.schema_nm};"
-            # Get list of all stage names
-            df_stg_lst = cs.execute(stage_show).fetchall()
-            stage_names  = [sublist[1] for sublist in df_stg_lst]
-            print(stage_names)
-            semantic_models = []
-
-            for stage_name in stage_names:
-                list_query = f"LIST @{query.database_nm}.{query.schema_nm}.{stage_name};"
-                try:
-                    df_stg_files_lst = cs.execute(list_query).fetchall()
-                except Exception as e:
-                    print(f"Error listing files in stage {stage_name}: {e}")
-                    continue
-                # Extract .yaml files
-                for sublist in df_stg_files_lst:
-                    file_path = sublist[0]
-                    if file_path.endswith('.yaml'):
-                        semantic_models.append(file_path)
-                print(semantic_models)
-
-            #query1 = {"semantic_model": ["test.yaml", "contract_star_rating_v2.yaml"]}
-            query1 = {"semantic_model": query.semantic_model}
-
-            # Construct full stage paths for the query models
-            semantic_model_paths = []
-            for model_name in query1["semantic_model"]:
-                # Find the matching path from semantic_models
-                matching_paths = [path for path in semantic_models if path.endswith("/" + model_name)]          
-                if matching_paths:
-                    # Use the first matching path and construct the full stage path
-                    stage_path = f"@{query.database_nm}.{query.schema_nm}." + matching_paths[0]
-                    semantic_model_paths.append(stage_path)
-                else:
-                    print(f"Warning: No matching path found for {model_name}")
+            with timer.phase("stage_discovery"):
+                semantic_model_paths, missing = await sf_executor.run(
+                    query.aplctn_cd,
+                    semantic_model_catalog.resolve,
+                    sf_conn,
+                    query.aplctn_cd,
+                    query.app_lvl_prefix,
+                    query.database_nm,
+                    query.schema_nm,
+                    query.semantic_model,
+                )
+            for model_name in missing:
+                print(f"Warning: No matching path found for {model_name}")
             #semantic_model_old = ["@DOC_AI_DB.HEDIS_SCHEMA.HEDIS_STAGE_FULL/" + item for item in query.semantic_model] 
             #print(semantic_model_old)
             semantic_model = semantic_model_paths  
             print(semantic_model)
-            clnt = httpx.AsyncClient(verify=False,timeout=150.0)
+            clnt = cortex_http.get("agent")
             request_body = {
                 "model": query.model,
                 "messages": [
@@ -555,7 +875,7 @@ async def llm_gateway(
                     "max_results": query.search_limit
                 }
             headers = {
-                "Authorization": f'Snowflake Token="{sf_conn.rest.token}"',
+                "Authorization": await sf_token_manager.async_auth_header(sf_conn, query.aplctn_cd),
                 "Content-Type": "application/json",
                 "Accept": "application/json"
             }
@@ -565,10 +885,42 @@ async def llm_gateway(
             fdbck_id = [str(uuid.uuid4())]
             full_response_text = []
             full_sql_response = []        
-            import re
+
+            def add_audit_record(final_response, cancelled=False):
+                accounting = timer.accounting(prompt)
+                accounting["client_app"] = query.aplctn_cd
+                extra_columns = audit_accounting_columns(accounting)
+                #Model recreated the for the Audit record
+                audit_rec = GenAiCortexAudit(
+                    edl_load_dtm = get_load_datetime,
+                    edl_run_id = "0000",
+                    edl_scrty_lvl_cd = "NA",
+                    edl_lob_cd = "NA",
+                    srvc_type = "Agent",
+                    aplctn_cd = config.pltfrm_aplctn_cd,
+                    user_id = "Agent_user",#query.user_id,
+                    mdl_id = query.model,
+                    cnvrstn_chat_lmt_txt = "0",#query.cnvrstn_chat_lmt_txt,
+                    sesn_id = query.session_id,
+                    prmpt_txt = prompt,
+                    tkn_cnt = str(accounting["total_tokens"]),
+                    feedbk_actn_txt = "",
+                    feedbk_cmnt_txt = "",
+                    feedbk_updt_dtm = get_load_datetime,
+                )
+                if cancelled:
+                    log_cancelled_response(audit_rec,query_id,str(final_response),fdbck_id,query.session_id,extra_columns)
+                    return
+                background_tasks.add_task(log_response,audit_rec,query_id,str(final_response),fdbck_id,query.session_id,extra_columns)
+
+            def add_cancelled_audit_record():
+                add_audit_record("".join(full_sql_response) or "".join(full_response_text), cancelled=True)
+
             async def agent_data_streamer():
                 citations = []
                 async with clnt.stream('POST', url, headers=headers, json=request_body) as response:
+                    timer.mark("upstream_connect")
+                    timer.upstream_status = response.status_code
                     if response.is_client_error:
                         error_message = await response.aread()
                         raise HTTPException(
@@ -581,84 +933,58 @@ async def llm_gateway(
                             status_code=response.status_code,
                             detail=error_message.decode("utf-8")
                         )
-                    async for result_chunk in response.aiter_bytes():
-                        #print(result_chunk)
-                        for elem in result_chunk.split(b'\n\n'):
-                            print("ele",elem)
-                            if b'data:' not in elem:
-                                continue
-                            try:
-                                match = re.search(rb'data: ({.*})', elem)
-                                if not match:
-                                    continue
-                                #print(match.group(1))
-                                chunk_dict = json.loads(match.group(1))
-                                #print(chunk_dict)
-                                query_id[0]=chunk_dict.get("id", {})
-                                delta = chunk_dict.get('delta', {})
-                                content_list = delta.get('content', [])
-                                for content_item in content_list:
-                                    content_type = content_item.get("type")
-                                    if content_type == "text":
-                                        text_part = content_item.get("text", "")
-                                        full_response_text.append(text_part)
-                                        response = text_part.replace("【†", "[").replace("†】", "]").replace("】", "]").replace("【", "[")
-                                        yield response
-                                    elif content_type == "tool_results":
-                                        tool_results = content_item.get("tool_results", {})
-                                        content_list_inner = tool_results.get("content", [])
-                                        for result in content_list_inner:
-                                            if result.get("type") == "json":
-                                                json_obj = result.get("json", {})
-                                                citations = json_obj.get('searchResults', [])
-                                                #print("sea",citations)
-                                                extracted_text = json_obj.get("text", "")
-                                                if extracted_text:
-                                                    full_response_text.append(extracted_text)
-                                                    yield extracted_text
-                                                    yield "end_of_interpretation \n  "
-                                                extracted_sql = json_obj.get("sql", "")
-                                                if extracted_sql:
-                                                    full_sql_response.append(extracted_sql)
-                                                    yield extracted_sql
-                                    elif content_type == "tool_use":
-                                        continue  # Optional: capture or log tool_use
-                            except json.JSONDecodeError:
-                                continue
-                    yield "end_of_stream"
+                    async for event in aiter_cortex_events(response, lambda: timer.mark("first_byte")):
+                        try:
+                            chunk_dict = json.loads(event.data)
+                            timer.set_usage(chunk_dict.get("usage"))
+                            #print(chunk_dict)
+                            query_id[0]=chunk_dict.get("id", {})
+                            delta = chunk_dict.get('delta', {})
+                            content_list = delta.get('content', [])
+                            for content_item in content_list:
+                                content_type = content_item.get("type")
+                                if content_type == "text":
+                                    text_part = content_item.get("text", "")
+                                    full_response_text.append(text_part)
+                                    response = text_part.replace("【†", "[").replace("†】", "]").replace("】", "]").replace("【", "[")
+                                    yield "text", response
+                                elif content_type == "tool_results":
+                                    tool_results = content_item.get("tool_results", {})
+                                    content_list_inner = tool_results.get("content", [])
+                                    for result in content_list_inner:
+                                        if result.get("type") == "json":
+                                            json_obj = result.get("json", {})
+                                            citations = json_obj.get('searchResults', [])
+                                            #print("sea",citations)
+                                            extracted_text = json_obj.get("text", "")
+                                            if extracted_text:
+                                                full_response_text.append(extracted_text)
+                                                yield "text", extracted_text
+                                                yield "interpretation_end", "end_of_interpretation \n  "
+                                            extracted_sql = json_obj.get("sql", "")
+                                            if extracted_sql:
+                                                full_sql_response.append(extracted_sql)
+                                                yield "sql", extracted_sql
+                                elif content_type == "tool_use":
+                                    continue  # Optional: capture or log tool_use
+                        except json.JSONDecodeError:
+                            continue
+                    yield "done", None
                     if citations:
-                        yield json.dumps({"citations": citations})
+                        yield "citations", citations
                     if full_response_text and full_sql_response: 
                         final_response = extracted_sql
-                        yield json.dumps({"prompt":prompt,"query_id": query_id[0],
-                            "fdbck_id": fdbck_id[0],"type": "sql"})
+                        yield "meta", {"prompt":prompt,"query_id": query_id[0],
+                            "fdbck_id": fdbck_id[0],"type": "sql"}
                         #yield json.dumps({"type": "sql"})
                     elif full_response_text:  # Check if there's any text to yield
                         final_response = "".join(full_response_text)
-                        yield json.dumps({"prompt":prompt,"query_id": query_id[0],
-                            "fdbck_id": fdbck_id[0],"type": "text"})
+                        yield "meta", {"prompt":prompt,"query_id": query_id[0],
+                            "fdbck_id": fdbck_id[0],"type": "text"}
         
-                #Model recreated the for the Audit record
-                audit_rec = GenAiCortexAudit(
-                    edl_load_dtm = get_load_datetime,
-                    edl_run_id = "0000",
-                    edl_scrty_lvl_cd = "NA",
-                    edl_lob_cd = "NA",
-                    srvc_type = "Agent",
-                    aplctn_cd = config.pltfrm_aplctn_cd,
-                    user_id = "Agent_user",#query.user_id,
-                    mdl_id = query.model,
-                    cnvrstn_chat_lmt_txt = "0",#query.cnvrstn_chat_lmt_txt,
-                    sesn_id = query.session_id,
-                    prmpt_txt = prompt.replace("'","\\'"),
-                    tkn_cnt = "0",
-                    feedbk_actn_txt = "",
-                    feedbk_cmnt_txt = "",
-                    feedbk_updt_dtm = get_load_datetime,
-                )
-                background_tasks.add_task(log_response,audit_rec,query_id,str(final_response),fdbck_id,query.session_id)
+                add_audit_record(final_response)
 
-            return StreamingResponse(agent_data_streamer(), media_type='text/event-stream')
+            return StreamingResponse(coalesce_stream(format_stream(cancel_on_disconnect(timed_events(agent_data_streamer(), timer), request, "agent", add_cancelled_audit_record), events), "agent", timer.started), media_type='text/event-stream', headers={"Server-Timing": timer.server_timing()})
         else:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -678,18 +1004,32 @@ async def llm_gateway(
 @route.post("/txt2sql/run_sql_query")
 async def run_sql_query(
     query: Annotated[SqlExecModel, Body(embed=True)],
+    request: Request,
     config: Annotated[GenAiEnvSettings, Depends(get_config)],
     logger: Annotated[Logger, Depends(get_logger)],
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    stream: Annotated[bool,Query(description="Stream the rows as NDJSON, one result batch at a time, instead of one JSON array")] = False,
+    result_format: Annotated[Optional[str],Query(alias="format", description="json, ndjson, arrow (Arrow IPC stream) or parquet; overrides the Accept header")] = None,
+    cache: Annotated[bool,Query(description="Use the SQL result cache; false (or Cache-Control: no-store) always executes and stores nothing")] = True
 ):
     """
-    Execute an SQL query in Snowflake and return the results as JSON.
+    Execute an SQL query in Snowflake and return the results as JSON, or as NDJSON streamed batch by batch.
+    Arrow IPC stream and Parquet are returned for an Accept header of
+    application/vnd.apache.arrow.stream or application/vnd.apache.parquet, built from the connector's Arrow batches.
+    Results of read-only, deterministic SQL are cached per application, prefix and role; X-Result-Cache tells
+    hit, miss or bypass, and Cache-Control: no-cache executes again and refreshes the cached result.
     """
+    try:
+        result_format = negotiate_result_format(request.headers.get("accept"), result_format or ("ndjson" if stream else None))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=str(e))
     api_validator = ValidApiKey()
-    if api_validator(query.api_key, query.aplctn_cd, query.app_id):
+    if await asyncio.to_thread(api_validator, query.api_key, query.aplctn_cd, query.app_id):
         try:
             # Establish Snowflake connection
-            sf_conn = SnowFlakeConnector.get_conn(
+            sf_conn = await sf_executor.run(
+                query.aplctn_cd,
+                SnowFlakeConnector.get_conn,
                 query.aplctn_cd,
                 query.app_lvl_prefix,
                 query.session_id
@@ -700,26 +1040,43 @@ async def run_sql_query(
                 detail="User not authorized to resources"
             )
 
-        try:
-            # Execute the SQL query
-            cs = sf_conn.cursor()
-            cs.execute(query.exec_sql)
-
-            # Fetch the results into a DataFrame
-            df = cs.fetch_pandas_all()
-            df = df.fillna(0)  # Replace NaN values with 0
-
-            # Convert date and datetime objects to strings
-            for column in df.select_dtypes(include=["datetime", "datetimetz"]).columns:
-                df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')  # Format datetime
-            for column in df.select_dtypes(include=["object"]).columns:
-                df[column] = df[column].apply(lambda x: x.isoformat() if isinstance(x, (datetime, date)) else x)
+        cache_control = (request.headers.get("cache-control") or "").lower()
+        tables = None
+        outcome = {"cache": "bypass"}
+        if SQL_CACHE_ENABLED and cache and "no-store" not in cache_control:
+            normalized_sql = normalize_sql(query.exec_sql)
+            if cacheable_sql(normalized_sql):
+                cache_key = result_cache_key(query.aplctn_cd, query.app_lvl_prefix, getattr(sf_conn, "role", None), normalized_sql)
+                tables = sql_cache.tables(cache_key, sf_conn, query.exec_sql, lookup="no-cache" not in cache_control, outcome=outcome)
+        if tables is None:
+            sql_cache.bypass()
 
-            cs.close()
-
-            # Convert DataFrame to JSON
-            result_json = df.to_dict(orient="records")
-            return JSONResponse(content=result_json)
+        try:
+            run_blocking = partial(sf_executor.run, query.aplctn_cd)
+            if result_format == "ndjson":
+                chunks = ndjson_chunks(tables) if tables is not None else iter_ndjson_batches(sf_conn, query.exec_sql)
+                rows = stream_ndjson(chunks, run_blocking)
+            elif result_format == "arrow":
+                chunks = arrow_stream_chunks(tables) if tables is not None else iter_arrow_stream(sf_conn, query.exec_sql)
+                rows = stream_batches(chunks, run_blocking)
+            elif result_format == "parquet":
+                chunks = parquet_chunks(tables) if tables is not None else iter_parquet(sf_conn, query.exec_sql)
+                rows = stream_batches(chunks, run_blocking)
+            if result_format != "json":
+                rows = await first_chunk_or_raise(rows)
+                headers = {"X-Result-Cache": outcome["cache"]}
+                if result_format == "parquet":
+                    headers["Content-Disposition"] = 'attachment; filename="result.parquet"'
+                return StreamingResponse(
+                    rows,
+                    media_type=RESULT_MEDIA_TYPES[result_format],
+                    headers=headers,
+                )
+            if tables is not None:
+                result_json = await sf_executor.run(query.aplctn_cd, table_records, tables)
+            else:
+                result_json = await sf_executor.run(query.aplctn_cd, execute_sql_records, sf_conn, query.exec_sql)
+            return JSONResponse(content=result_json, headers={"X-Result-Cache": outcome["cache"]})
 
         except Exception as e:
             logger.error(f"Error executing SQL query: {e}")
@@ -733,25 +1090,339 @@ async def run_sql_query(
             detail="Unauthenticated user"
         )
 
+async def sql_exec_connection(query: SqlExecModel):
+    """Validate the API key of an SQL request and return its session connection"""
+    api_validator = ValidApiKey()
+    if not await asyncio.to_thread(api_validator, query.api_key, query.aplctn_cd, query.app_id):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthenticated user"
+        )
+    try:
+        return await sf_executor.run(
+            query.aplctn_cd,
+            SnowFlakeConnector.get_conn,
+            query.aplctn_cd,
+            query.app_lvl_prefix,
+            query.session_id
+        )
+    except DatabaseError as e:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="User not authorized to resources"
+        )
+
+
+@route.post("/txt2sql/run_sql_query/paged")
+async def run_sql_query_paged(
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    logger: Annotated[Logger, Depends(get_logger)],
+    page_size: Annotated[int,Query(ge=1, le=SQL_MAX_PAGE_SIZE)] = SQL_PAGE_SIZE
+):
+    """
+    Execute an SQL query and return its Snowflake query id, columns, row count and first page.
+    Further pages are read from the persisted result with /txt2sql/run_sql_query/paged/{query_id}.
+    """
+    sf_conn = await sql_exec_connection(query)
+    try:
+        result = await sf_executor.run(query.aplctn_cd, execute_paged, sf_conn, query.exec_sql, page_size)
+    except Exception as e:
+        logger.error(f"Error executing SQL query: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while executing the SQL query."
+        )
+    return JSONResponse(content=jsonable_encoder(result))
+
+
+@route.post("/txt2sql/run_sql_query/paged/{query_id}")
+async def get_sql_query_page(
+    query_id: str,
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    logger: Annotated[Logger, Depends(get_logger)],
+    page: Annotated[int,Query(ge=0)] = 0,
+    page_size: Annotated[int,Query(ge=1, le=SQL_MAX_PAGE_SIZE)] = SQL_PAGE_SIZE
+):
+    """
+    One page of an earlier paged query, cut from its persisted result batches; `exec_sql` is not used.
+    """
+    sf_conn = await sql_exec_connection(query)
+    try:
+        result = await sf_executor.run(query.aplctn_cd, fetch_result_page, sf_conn, query_id, page, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error reading page {page} of {query_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Result of query {query_id} is not available: {str(e)}"
+        )
+    return JSONResponse(content=jsonable_encoder({"query_id": query_id, **result}))
+
+
+async def owned_sql_job(job_id: str, query: SqlExecModel) -> dict:
+    """
+    The job `job_id` of the requesting application, or 404. Call it only once
+    the API key is validated, so the 404 tells nothing to unauthenticated callers.
+    """
+    job = sql_jobs.get(job_id, query.aplctn_cd, query.app_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"SQL job {job_id} not found or expired"
+        )
+    return job
+
+
+async def refresh_sql_job(job: dict, sf_conn, aplctn_cd) -> dict:
+    """Poll Snowflake for a job that is not finished yet; one short call, the query keeps running in the warehouse"""
+    if job["status"] in FINAL_JOB_STATUSES:
+        return job
+    job_status, sf_status, error = await sf_executor.run(aplctn_cd, query_status, sf_conn, job["job_id"])
+    return sql_jobs.update(job["job_id"], job_status, sf_status, error) or job
+
+
+def sql_job_view(job: dict) -> dict:
+    return {key: job[key] for key in ("job_id", "status", "sf_status", "error", "submitted", "finished")}
+
+
+@route.post("/txt2sql/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_sql_job(
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    logger: Annotated[Logger, Depends(get_logger)]
+):
+    """
+    Submit an SQL query to run asynchronously in Snowflake and return its job id (the Snowflake query id) at once.
+    Poll /txt2sql/jobs/{job_id}, then stream the rows from /txt2sql/jobs/{job_id}/results.
+    """
+    sf_conn = await sql_exec_connection(query)
+    try:
+        job_id = await sf_executor.run(query.aplctn_cd, submit_query, sf_conn, query.exec_sql)
+    except Exception as e:
+        logger.error(f"Error submitting SQL query: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="An error occurred while submitting the SQL query."
+        )
+    job = sql_jobs.add(job_id, query.aplctn_cd, query.app_id, query.session_id)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=sql_job_view(job))
+
+
+@route.post("/txt2sql/jobs/{job_id}")
+async def get_sql_job(
+    job_id: str,
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    logger: Annotated[Logger, Depends(get_logger)],
+    wait: Annotated[float,Query(ge=0, le=SQL_JOB_MAX_WAIT, description="Seconds to wait for the job to finish")] = 0
+):
+    """
+    Status of an SQL job: running, succeeded, failed or cancelled, with the Snowflake status and error.
+    With `wait` the request polls until the job finishes or the time is up; no worker is held in between.
+    """
+    sf_conn = await sql_exec_connection(query)
+    job = await owned_sql_job(job_id, query)
+    deadline = asyncio.get_running_loop().time() + wait
+    try:
+        job = await refresh_sql_job(job, sf_conn, query.aplctn_cd)
+        while job["status"] not in FINAL_JOB_STATUSES and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(min(SQL_JOB_POLL_SECONDS, max(deadline - asyncio.get_running_loop().time(), 0)))
+            job = await refresh_sql_job(job, sf_conn, query.aplctn_cd)
+    except Exception as e:
+        logger.error(f"Error reading the status of SQL job {job_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Status of SQL job {job_id} is not available: {str(e)}"
+        )
+    return JSONResponse(content=sql_job_view(job))
+
+
+@route.post("/txt2sql/jobs/{job_id}/results")
+async def get_sql_job_results(
+    job_id: str,
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    request: Request,
+    logger: Annotated[Logger, Depends(get_logger)],
+    result_format: Annotated[Optional[str],Query(alias="format", description="ndjson (default), json, arrow or parquet; overrides the Accept header")] = None
+):
+    """
+    Rows of a finished SQL job, streamed batch by batch from the persisted result; 409 while it is not succeeded.
+    """
+    try:
+        result_format = negotiate_result_format(request.headers.get("accept"), result_format, default="ndjson")
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_406_NOT_ACCEPTABLE, detail=str(e))
+    sf_conn = await sql_exec_connection(query)
+    job = await owned_sql_job(job_id, query)
+    try:
+        job = await refresh_sql_job(job, sf_conn, query.aplctn_cd)
+    except Exception as e:
+        logger.error(f"Error reading the status of SQL job {job_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Status of SQL job {job_id} is not available: {str(e)}"
+        )
+    if job["status"] != "succeeded":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=sql_job_view(job)
+        )
+    try:
+        run_blocking = partial(sf_executor.run, query.aplctn_cd)
+        if result_format == "json":
+            result_json = await sf_executor.run(query.aplctn_cd, result_records, sf_conn, None, job_id)
+            return JSONResponse(content=jsonable_encoder(result_json))
+        if result_format == "ndjson":
+            rows = stream_ndjson(iter_ndjson_batches(sf_conn, None, job_id), run_blocking)
+        elif result_format == "arrow":
+            rows = stream_batches(iter_arrow_stream(sf_conn, None, job_id), run_blocking)
+        else:
+            rows = stream_batches(iter_parquet(sf_conn, None, job_id), run_blocking)
+        headers = {"Content-Disposition": f'attachment; filename="{job_id}.parquet"'} if result_format == "parquet" else None
+        return StreamingResponse(
+            await first_chunk_or_raise(rows),
+            media_type=RESULT_MEDIA_TYPES[result_format],
+            headers=headers,
+        )
+    except Exception as e:
+        logger.error(f"Error reading the result of SQL job {job_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Result of SQL job {job_id} is not available: {str(e)}"
+        )
+
+
+@route.post("/txt2sql/jobs/{job_id}/cancel")
+async def cancel_sql_job(
+    job_id: str,
+    query: Annotated[SqlExecModel, Body(embed=True)],
+    logger: Annotated[Logger, Depends(get_logger)]
+):
+    """
+    Cancel a running SQL job in Snowflake and return the status Snowflake reports
+    afterwards; a finished job is returned unchanged.
+    """
+    sf_conn = await sql_exec_connection(query)
+    job = await owned_sql_job(job_id, query)
+    if job["status"] in FINAL_JOB_STATUSES:
+        return JSONResponse(content=sql_job_view(job))
+    try:
+        message, job_status, sf_status, error = await sf_executor.run(query.aplctn_cd, cancel_and_wait, sf_conn, job_id)
+    except Exception as e:
+        logger.error(f"Error cancelling SQL job {job_id}: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while cancelling SQL job {job_id}: {str(e)}"
+        )
+    logger.info(f"Cancel of SQL job {job_id}: {message}; now {job_status} ({sf_status})")
+    job = sql_jobs.update(job_id, job_status, sf_status, error) or job
+    return JSONResponse(content=sql_job_view(job))
+
+
 @route.post("/update_feedback/")
 async def update_feedback(
     fdbck_id: str,
     session_id: Optional[str],
     feedbk_actn_txt: Optional[str] = None,
-    feedbk_cmnt_txt: Optional[str] = None
+    feedbk_cmnt_txt: Optional[str] = None,
+    wait: Annotated[bool,Query(description="Merge the pending feedback now and wait for the outcome of this id")] = False
 ):
     """
-    Update feedback in the audit table and return a success message once the update is complete.
+    Spool the feedback for the audit table and return once it is stored locally; the audit writer
+    merges pending feedback once per flush. With `wait` the outcome for this id is returned.
     """
     try:
-        # Call the update_log_response function directly
-        result = update_log_response(fdbck_id, feedbk_actn_txt, feedbk_cmnt_txt, session_id)
-        return {"status": "success", "message": result}
+        result = update_log_response(
+            fdbck_id,
+            feedbk_actn_txt,
+            feedbk_cmnt_txt,
+            session_id
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while updating feedback: {str(e)}"
         )
+    if wait:
+        audit_writer.wake()
+        feedback_state = await feedback_status.wait(fdbck_id, FEEDBACK_WAIT_SECONDS)
+    else:
+        feedback_state = feedback_status.get(fdbck_id)["status"]
+    return {"status": "success", "message": result, "feedback_status": feedback_state}
+
+
+@route.get("/audit_rollup/")
+async def get_audit_rollup(
+    days: Annotated[int,Query(ge=1, le=90, description="Number of days to aggregate")] = 7
+):
+    """
+    p50/p95 latency and token usage per client application, model and route, from the audit table.
+    """
+    try:
+        rows = await sf_executor.run(get_config().pltfrm_aplctn_cd, audit_rollup, days)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while reading the audit rollup: {str(e)}"
+        )
+    return JSONResponse(content=jsonable_encoder({"days": days, "rollup": rows}))
+
+
+async def platform_api_key(aplctn_cd: str, app_id: str, api_key: str):
+    """Only the platform application itself may read or replay the audit dead letters, which hold every application's rows"""
+    api_validator = ValidApiKey()
+    if aplctn_cd != get_config().pltfrm_aplctn_cd or not await asyncio.to_thread(api_validator, api_key, aplctn_cd, app_id):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthenticated user"
+        )
+
+
+@route.get("/audit/dead_letters/")
+async def get_audit_dead_letters(
+    aplctn_cd: str,
+    app_id: str,
+    api_key: str,
+    kind: Optional[str] = None,
+    limit: Annotated[int,Query(ge=1, le=1000)] = 100
+):
+    """
+    Audit and feedback records moved out of the spool after repeated rejected loads, oldest first.
+    """
+    await platform_api_key(aplctn_cd, app_id, api_key)
+    dead_letters = await asyncio.to_thread(audit_writer.dead_letters, kind, limit)
+    return JSONResponse(content=jsonable_encoder({"dead_letters": dead_letters}))
+
+
+@route.post("/audit/dead_letters/requeue/")
+async def requeue_dead_letters(
+    aplctn_cd: str,
+    app_id: str,
+    api_key: str,
+    kind: Optional[str] = None,
+    ids: Annotated[Optional[List[int]],Query(description="Dead letter ids; all of `kind` when omitted")] = None
+):
+    """
+    Put dead audit and feedback records back in the spool, e.g. once the audit table was fixed.
+    """
+    await platform_api_key(aplctn_cd, app_id, api_key)
+    requeued = await asyncio.to_thread(requeue_audit_dead_letters, kind, ids)
+    return {"requeued": requeued}
+
+
+@route.get("/update_feedback/{fdbck_id}")
+async def get_feedback_status(fdbck_id: str):
+    """
+    Outcome of the feedback for `fdbck_id`: queued, retrying, applied, not_found, failed, or unknown once expired.
+    """
+    return {"fdbck_id": fdbck_id, **feedback_status.get(fdbck_id)}
+
+def run_file_extract(files, sf_conn, app_nm):
+    """
+    read_file_extract is a coroutine but runs its CREATE STAGE, PUT/COPY and search service
+    statements synchronously; run it on its own loop in a worker thread. Blocking.
+    """
+    return asyncio.run(read_file_extract(files, sf_conn, app_nm=app_nm))
+
 
 @route.post("/upload_file/")
 async def upload_file(
@@ -763,13 +1434,15 @@ async def upload_file(
     """Upload and process multiple CSV, PDF, DOCX, or TXT files."""
     query = json.loads(query)
     api_validator = ValidApiKey()
-    if api_validator(query['api_key'], query['aplctn_cd'], query['app_id']):
-        sf_conn = SnowFlakeConnector.get_conn(
+    if await asyncio.to_thread(api_validator, query['api_key'], query['aplctn_cd'], query['app_id']):
+        sf_conn = await sf_executor.run(
+            query['aplctn_cd'],
+            SnowFlakeConnector.get_conn,
             query['aplctn_cd'],
             query['app_lvl_prefix'],
             query['session_id'],
         )
-        res = await read_file_extract(files,sf_conn,app_nm=query['app_nm'])
+        res = await sf_executor.run(query['aplctn_cd'], run_file_extract, files, sf_conn, query['app_nm'])
         return res
     else: 
         raise HTTPException(
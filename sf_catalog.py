@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sf_executor import sf_executor
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_MODEL_SUFFIXES = ('.yaml', '.yaml.gz')
+# Filter applied by Snowflake so LIST only returns semantic model files
+SEMANTIC_MODEL_PATTERN = ".*[.]yaml([.]gz)?"
+
+
+class _CatalogEntry:
+    __slots__ = ("paths", "index", "loaded_at", "stage_timings", "load_seconds", "stage_errors")
+
+    def __init__(self, paths, stage_timings=None, load_seconds=0.0, stage_errors=None):
+        self.paths = paths
+        self.stage_timings = stage_timings or {}
+        self.load_seconds = load_seconds
+        self.stage_errors = stage_errors or {}
+        self.index = {}
+        for path in paths:
+            file_name = path.split('/')[-1]
+            self.index.setdefault(file_name, path)
+            if file_name.endswith('.gz'):
+                self.index.setdefault(file_name[:-len('.gz')], path)
+        self.loaded_at = time.monotonic()
+
+
+class SemanticModelCatalog:
+    """
+    Cache of the semantic model files staged in a (database, schema), per
+    application and prefix, since each lists the stages with its own role.
+
+    The stages are listed once per `ttl` seconds instead of on every
+    /txt2sql and /agent request, and model names are resolved through a
+    dict index from file name (with or without `.gz`) to stage path.
+    All methods that may list stages block; call them through sf_executor.
+    Stages are listed on one shared pool of `fanout` threads. A load in which
+    some stage could not be listed is only kept for `error_ttl` seconds, so
+    a transient error does not hide that stage's models for the full TTL.
+    """
+
+    def __init__(self, ttl: float = 300, fanout: int = 8, error_ttl: float = 15):
+        self.ttl = ttl
+        self.fanout = fanout
+        self.error_ttl = error_ttl
+        self._pool = ThreadPoolExecutor(max_workers=fanout, thread_name_prefix="stage-list")
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _list_stage(self, sf_conn, database_nm, schema_nm, stage_name):
+        started = time.monotonic()
+        cs = sf_conn.cursor()
+        list_query = f"LIST @{database_nm}.{schema_nm}.{stage_name} PATTERN='{SEMANTIC_MODEL_PATTERN}';"
+        error = None
+        try:
+            df_stg_files_lst = cs.execute(list_query).fetchall()
+        except Exception as e:
+            logger.error(f"Error listing files in stage {stage_name}: {e}")
+            df_stg_files_lst = []
+            error = str(e)
+        finally:
+            cs.close()
+        # Extract .yaml files
+        semantic_models = [
+            sublist[0] for sublist in df_stg_files_lst
+            if sublist[0].endswith(SEMANTIC_MODEL_SUFFIXES)
+        ]
+        return semantic_models, time.monotonic() - started, error
+
+    def _list_semantic_models(self, sf_conn, database_nm, schema_nm) -> _CatalogEntry:
+        started = time.monotonic()
+        cs = sf_conn.cursor()
+        stage_show = f"SHOW STAGES in SCHEMA {database_nm}.{schema_nm};"
+        # Get list of all stage names
+        try:
+            df_stg_lst = cs.execute(stage_show).fetchall()
+        finally:
+            cs.close()
+        stage_names = [sublist[1] for sublist in df_stg_lst]
+
+        semantic_models = []
+        stage_timings = {}
+        stage_errors = {}
+        # One cursor per stage on the shared connection, at most `fanout` in flight across all loads
+        results = self._pool.map(
+            lambda stage_name: self._list_stage(sf_conn, database_nm, schema_nm, stage_name),
+            stage_names,
+        )
+        for stage_name, (stage_models, seconds, error) in zip(stage_names, results):
+            semantic_models.extend(stage_models)
+            stage_timings[stage_name] = round(seconds, 3)
+            if error is not None:
+                stage_errors[stage_name] = error
+        load_seconds = time.monotonic() - started
+        slowest = max(stage_timings, key=stage_timings.get, default=None)
+        logger.info(
+            f"Listed {len(stage_names)} stage(s) in {database_nm}.{schema_nm} in {load_seconds:.3f}s"
+            + (f", slowest {slowest} {stage_timings[slowest]}s" if slowest else "")
+        )
+        return _CatalogEntry(semantic_models, stage_timings, load_seconds, stage_errors)
+
+    def _fresh(self, entry) -> bool:
+        ttl = self.error_ttl if entry.stage_errors else self.ttl
+        return time.monotonic() - entry.loaded_at < ttl
+
+    def get(self, sf_conn, aplctn_cd, app_lvl_prefix, database_nm, schema_nm, refresh: bool = False) -> _CatalogEntry:
+        key = (aplctn_cd, app_lvl_prefix or "", database_nm.upper(), schema_nm.upper())
+        entry = self._entries.get(key)
+        if not refresh and entry is not None and self._fresh(entry):
+            self.hits += 1
+            return entry
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            # Another request may have reloaded the entry while we waited
+            entry = self._entries.get(key)
+            if not refresh and entry is not None and self._fresh(entry):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = self._list_semantic_models(sf_conn, database_nm, schema_nm)
+            self._entries[key] = entry
+            logger.info(f"Semantic model catalog loaded for {aplctn_cd} {database_nm}.{schema_nm}: {len(entry.paths)} model(s)")
+            return entry
+
+    def resolve(self, sf_conn, aplctn_cd, app_lvl_prefix, database_nm, schema_nm, model_names):
+        """
+        Map model file names to `@db.schema.stage/file` paths usable as semantic_model_file.
+        Returns the resolved paths and the names that were not found.
+        """
+        entry = self.get(sf_conn, aplctn_cd, app_lvl_prefix, database_nm, schema_nm)
+        semantic_model_paths = []
+        missing = []
+        for model_name in model_names:
+            path = entry.index.get(model_name)
+            if path is None:
+                missing.append(model_name)
+                continue
+            if path.endswith('.gz'):
+                path = path[:-len('.gz')]
+            semantic_model_paths.append(f"@{database_nm}.{schema_nm}." + path)
+        return semantic_model_paths, missing
+
+    def file_names(self, sf_conn, aplctn_cd, app_lvl_prefix, database_nm, schema_nm, refresh: bool = False):
+        entry = self.get(sf_conn, aplctn_cd, app_lvl_prefix, database_nm, schema_nm, refresh)
+        return [path.split('/')[-1] for path in entry.paths]
+
+    def invalidate(self, aplctn_cd, app_lvl_prefix, database_nm: str = None, schema_nm: str = None):
+        """Drop the application's cached entries; all of its schemas when no database is given"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[:2] != (aplctn_cd, app_lvl_prefix or ""):
+                    continue
+                if database_nm is None or (key[2] == database_nm.upper() and (schema_nm is None or key[3] == schema_nm.upper())):
+                    del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "schemas": {
+                f"{aplctn_cd}/{app_lvl_prefix}/{database_nm}.{schema_nm}": {
+                    "models": len(entry.paths),
+                    "load_seconds": round(entry.load_seconds, 3),
+                    "stage_seconds": entry.stage_timings,
+                    "stage_errors": entry.stage_errors,
+                }
+                for (aplctn_cd, app_lvl_prefix, database_nm, schema_nm), entry in self._entries.items()
+            },
+        }
+
+
+def show_search_services(sf_conn, database_nm, schema_nm):
+    """Names of the Cortex Search services in database_nm.schema_nm"""
+    cs = sf_conn.cursor()
+    try:
+        df_lst = cs.execute(f"SHOW CORTEX SEARCH SERVICES in SCHEMA {database_nm}.{schema_nm};").fetchall()
+    finally:
+        cs.close()
+    return [sublist[1] for sublist in df_lst]
+
+
+class _SearchEntry:
+    __slots__ = ("loader", "names", "version", "loaded_at", "failures", "retry_at")
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.names = None
+        self.version = None
+        self.loaded_at = 0.0
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class SearchServiceCatalog:
+    """
+    In-memory list of Cortex Search services per caller key, usually
+    (application, prefix, database, schema).
+
+    The first read of a key runs its `loader` inline; after that reads are
+    served from memory and a background task re-runs every loader each
+    `refresh_interval` seconds. Each list carries a `version` derived from its
+    contents, usable as an ETag, that only changes when the list changes.
+    Only keys whose first load succeeded are kept. A failed refresh keeps the
+    last list and backs that key off exponentially, up to `idle_ttl`.
+    Entries unread for `idle_ttl` seconds stop being refreshed and are dropped.
+    """
+
+    def __init__(self, refresh_interval: float = 300, idle_ttl: float = 3600):
+        self.refresh_interval = refresh_interval
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._read_at = {}
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    @staticmethod
+    def _version(names) -> str:
+        return hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()[:16]
+
+    def _load(self, entry: _SearchEntry):
+        names = entry.loader()
+        version = self._version(names)
+        if version != entry.version:
+            entry.names = names
+            entry.version = version
+        entry.loaded_at = time.monotonic()
+
+    def cached(self, key):
+        """`(names, version)` for `key` if it is already loaded, otherwise None; never blocks"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._read_at[key] = time.monotonic()
+        self.hits += 1
+        return entry.names, entry.version
+
+    def get(self, key, loader):
+        """
+        Return `(names, version)` for `key`, running `loader()` only when nothing is cached yet.
+        Blocking on a miss; call it through sf_executor. A failed load is raised and not cached.
+        """
+        cached = self.cached(key)
+        if cached is not None:
+            return cached
+        self.misses += 1
+        entry = _SearchEntry(loader)
+        self._load(entry)
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            self._read_at[key] = time.monotonic()
+        return entry.names, entry.version
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._read_at.clear()
+            else:
+                self._entries.pop(key, None)
+                self._read_at.pop(key, None)
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = time.monotonic()
+            with self._lock:
+                for key in [key for key in self._entries if now - self._read_at.get(key, 0) > self.idle_ttl]:
+                    del self._entries[key]
+                    self._read_at.pop(key, None)
+                entries = [entry for entry in self._entries.values() if entry.retry_at <= now]
+            for entry in entries:
+                try:
+                    await sf_executor.run("search_catalog", self._load, entry)
+                    entry.failures = 0
+                    entry.retry_at = 0.0
+                    self.refreshes += 1
+                except Exception as e:
+                    entry.failures += 1
+                    backoff = min(self.refresh_interval * 2 ** entry.failures, self.idle_ttl)
+                    entry.retry_at = time.monotonic() + backoff
+                    self.refresh_failures += 1
+                    logger.warning(f"Cortex search service refresh failed ({entry.failures} in a row), next try in {backoff:.0f}s: {e}")
+
+    def start(self):
+        """Start the background refresh on the running event loop; safe to call more than once"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+
+semantic_model_catalog = SemanticModelCatalog(
+    ttl=float(os.getenv("GENAI_SEMANTIC_CATALOG_TTL", "300")),
+    fanout=int(os.getenv("GENAI_SEMANTIC_CATALOG_FANOUT", "8")),
+    error_ttl=float(os.getenv("GENAI_SEMANTIC_CATALOG_ERROR_TTL", "15")),
+)
+
+search_service_catalog = SearchServiceCatalog(
+    refresh_interval=float(os.getenv("GENAI_SEARCH_CATALOG_REFRESH", "300")),
+    idle_ttl=float(os.getenv("GENAI_SEARCH_CATALOG_IDLE_TTL", "3600")),
+)
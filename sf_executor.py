@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+class SnowflakeExecutor:
+    """
+    Dedicated thread pool for blocking Snowflake calls made from async code.
+
+    Every call is tagged with an application code; at most `per_app_limit`
+    calls of one application run at the same time so a single noisy app
+    cannot take every worker. Queue depth, running calls and wait time are
+    tracked per application and returned by `stats()`.
+    """
+
+    def __init__(self, max_workers: int = 16, per_app_limit: int = 8):
+        self.max_workers = max_workers
+        self.per_app_limit = per_app_limit
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="snowflake")
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._apps = {}
+
+    def _app_stats(self, aplctn_cd) -> dict:
+        return self._apps.setdefault(aplctn_cd, {
+            "queued": 0,
+            "running": 0,
+            "completed": 0,
+            "failed": 0,
+            "max_queue_depth": 0,
+            "wait_seconds_total": 0.0,
+        })
+
+    def _semaphore(self, aplctn_cd) -> asyncio.Semaphore:
+        if aplctn_cd not in self._semaphores:
+            self._semaphores[aplctn_cd] = asyncio.Semaphore(self.per_app_limit)
+        return self._semaphores[aplctn_cd]
+
+    def _call(self, aplctn_cd, enqueued_at, func):
+        with self._lock:
+            app = self._app_stats(aplctn_cd)
+            app["queued"] -= 1
+            app["running"] += 1
+            app["wait_seconds_total"] += time.monotonic() - enqueued_at
+        try:
+            result = func()
+        except Exception:
+            with self._lock:
+                app["failed"] += 1
+            raise
+        else:
+            with self._lock:
+                app["completed"] += 1
+            return result
+        finally:
+            with self._lock:
+                app["running"] -= 1
+
+    async def run(self, aplctn_cd, func, *args, **kwargs):
+        """Run `func(*args, **kwargs)` on the Snowflake pool and await its result"""
+        enqueued_at = time.monotonic()
+        with self._lock:
+            app = self._app_stats(aplctn_cd)
+            app["queued"] += 1
+            app["max_queue_depth"] = max(app["max_queue_depth"], app["queued"])
+        started = False
+        try:
+            async with self._semaphore(aplctn_cd):
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(
+                    self._pool,
+                    self._call,
+                    aplctn_cd,
+                    enqueued_at,
+                    partial(func, *args, **kwargs),
+                )
+                started = True
+                return await future
+        finally:
+            if not started:
+                with self._lock:
+                    app["queued"] -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "per_app_limit": self.per_app_limit,
+                "queue_depth": sum(app["queued"] for app in self._apps.values()),
+                "running": sum(app["running"] for app in self._apps.values()),
+                "apps": {aplctn_cd: dict(app) for aplctn_cd, app in self._apps.items()},
+            }
+
+    def shutdown(self, wait: bool = True):
+        logger.info("Shutting down Snowflake executor")
+        self._pool.shutdown(wait=wait, cancel_futures=True)
+
+
+sf_executor = SnowflakeExecutor(
+    max_workers=int(os.getenv("GENAI_SF_EXECUTOR_WORKERS", "16")),
+    per_app_limit=int(os.getenv("GENAI_SF_EXECUTOR_PER_APP", "8")),
+)
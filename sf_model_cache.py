@@ -0,0 +1,165 @@
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import yaml
+
+from sf_catalog import SEMANTIC_MODEL_PATTERN, SEMANTIC_MODEL_SUFFIXES
+
+logger = logging.getLogger(__name__)
+
+
+def build_model_index(model: dict) -> dict:
+    """Tables of a semantic model and which table every dimension and measure belongs to"""
+    index = {"tables": [], "dimensions": {}, "measures": {}}
+    for table in (model or {}).get("tables") or []:
+        table_name = table.get("name")
+        index["tables"].append(table_name)
+        for key in ("dimensions", "time_dimensions"):
+            for dimension in table.get(key) or []:
+                index["dimensions"][dimension.get("name")] = table_name
+        for key in ("measures", "facts"):
+            for measure in table.get(key) or []:
+                index["measures"][measure.get("name")] = table_name
+    return index
+
+
+class SemanticModelFileCache:
+    """
+    Parsed semantic model YAML files of a stage, cached on local disk.
+
+    `LIST @stage` returns the md5 and last-modified time of every file; a
+    model is only fetched with GET and parsed when that pair has not been
+    seen before. Parsed models and their index are kept as JSON under
+    `cache_dir` so a restart does not download them again. Concurrent loads
+    of the same file wait for one download.
+    All methods block; call them through sf_executor.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = Path(cache_dir)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._memory = {}
+        self.hits = 0
+        self.downloads = 0
+
+    def _cache_file(self, database_nm, schema_nm, file_path, md5, last_modified) -> Path:
+        stage_dir = self.cache_dir / f"{database_nm}.{schema_nm}".upper()
+        version = f"{md5}.{last_modified}".replace(" ", "_").replace(":", "-").replace(",", "")
+        return stage_dir / f"{file_path.replace('/', '__')}@{version}.json"
+
+    def _download(self, sf_conn, database_nm, schema_nm, file_path) -> dict:
+        stage_name, relative_path = file_path.split("/", 1)
+        tmp_dir = tempfile.mkdtemp(prefix="semantic_model_")
+        try:
+            cs = sf_conn.cursor()
+            try:
+                cs.execute(
+                    f"GET @{database_nm}.{schema_nm}.{stage_name}/{relative_path} "
+                    f"'file://{Path(tmp_dir).as_posix()}/';"
+                )
+            finally:
+                cs.close()
+            local_file = Path(tmp_dir) / relative_path.split("/")[-1]
+            if local_file.name.endswith(".gz"):
+                with gzip.open(local_file, "rt", encoding="utf-8") as f:
+                    return yaml.safe_load(f)
+            with open(local_file, encoding="utf-8") as f:
+                return yaml.safe_load(f)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load_model(self, sf_conn, database_nm, schema_nm, file_path, md5, last_modified) -> dict:
+        key = (database_nm.upper(), schema_nm.upper(), file_path)
+        cached = self._memory.get(key)
+        if cached is not None and cached["md5"] == md5 and cached["last_modified"] == last_modified:
+            self.hits += 1
+            return cached
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            return self._load_model_locked(key, sf_conn, database_nm, schema_nm, file_path, md5, last_modified)
+
+    def _load_model_locked(self, key, sf_conn, database_nm, schema_nm, file_path, md5, last_modified) -> dict:
+        # Another request may have loaded this version while we waited
+        cached = self._memory.get(key)
+        if cached is not None and cached["md5"] == md5 and cached["last_modified"] == last_modified:
+            self.hits += 1
+            return cached
+        cache_file = self._cache_file(database_nm, schema_nm, file_path, md5, last_modified)
+        if cache_file.exists():
+            with open(cache_file, encoding="utf-8") as f:
+                cached = json.load(f)
+            self.hits += 1
+        else:
+            model = self._download(sf_conn, database_nm, schema_nm, file_path)
+            self.downloads += 1
+            cached = {
+                "file": file_path.split("/")[-1],
+                "md5": md5,
+                "last_modified": last_modified,
+                "model": model,
+                "index": build_model_index(model),
+            }
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Older versions of the same file are no longer reachable
+            for stale in cache_file.parent.glob(f"{file_path.replace('/', '__')}@*.json"):
+                stale.unlink(missing_ok=True)
+            # A temporary file of its own, so another process sharing cache_dir cannot clobber it
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=cache_file.parent, suffix=".tmp", delete=False
+            ) as f:
+                json.dump(cached, f, default=str)
+            try:
+                os.replace(f.name, cache_file)
+            except OSError:
+                os.unlink(f.name)
+                raise
+            logger.info(f"Cached semantic model {file_path} ({md5})")
+        with self._lock:
+            self._memory[key] = cached
+        return cached
+
+    def stage_models(self, sf_conn, database_nm, schema_nm, stage_name) -> dict:
+        """Parsed semantic models of a stage keyed by file name, each with its md5, last_modified and index"""
+        cs = sf_conn.cursor()
+        try:
+            rows = cs.execute(
+                f"LIST @{database_nm}.{schema_nm}.{stage_name} PATTERN='{SEMANTIC_MODEL_PATTERN}';"
+            ).fetchall()
+        finally:
+            cs.close()
+        models = {}
+        # LIST columns: name, size, md5, last_modified
+        for file_path, _, md5, last_modified in rows:
+            if not file_path.endswith(SEMANTIC_MODEL_SUFFIXES):
+                continue
+            try:
+                models[file_path.split("/")[-1]] = self._load_model(
+                    sf_conn, database_nm, schema_nm, file_path, md5, last_modified
+                )
+            except Exception as e:
+                logger.error(f"Error loading semantic model {file_path}: {e}")
+        return models
+
+    def stats(self) -> dict:
+        return {
+            "cache_dir": str(self.cache_dir),
+            "models_in_memory": len(self._memory),
+            "hits": self.hits,
+            "downloads": self.downloads,
+        }
+
+
+semantic_model_files = SemanticModelFileCache(
+    cache_dir=os.getenv(
+        "GENAI_SEMANTIC_MODEL_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "semantic_model_cache"),
+    ),
+)
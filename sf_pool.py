@@ -0,0 +1,160 @@
+import logging
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """Raised when no Snowflake connection could be checked out in time."""
+
+
+class SnowflakeConnectionPool:
+    """
+    Bounded pool of Snowflake connections shared by the MCP tools.
+
+    Connections are created lazily up to `size` through the `connect` factory,
+    checked for health on checkout and handed back to the pool on release.
+    Callers wait at most `timeout` seconds for a free connection.
+    """
+
+    def __init__(self, connect, size: int = 4, timeout: float = 30.0, health_check_interval: float = 60.0):
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = False
+        self._checked_at = {}
+        self.checkouts = 0
+        self.discarded = 0
+
+    def warm(self, count: int = None):
+        """Open connections up front until `count` are open, so the first tool calls skip the login handshake"""
+        count = self.size if count is None else min(count, self.size)
+        while True:
+            with self._lock:
+                if self._opened >= count:
+                    return
+                self._opened += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+            self._checked_at[id(conn)] = time.monotonic()
+            self._idle.put(conn)
+            logger.info(f"Snowflake pool warmed to {self._opened} connection(s)")
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.is_closed():
+            return False
+        last_checked = self._checked_at.get(id(conn), 0)
+        if time.monotonic() - last_checked < self.health_check_interval:
+            return True
+        try:
+            healthy = conn.is_valid()
+        except Exception:
+            healthy = False
+        if healthy:
+            self._checked_at[id(conn)] = time.monotonic()
+        return healthy
+
+    def _discard(self, conn):
+        self._checked_at.pop(id(conn), None)
+        with self._lock:
+            self._opened -= 1
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Error closing Snowflake connection: {e}")
+
+    def acquire(self):
+        """Check out a healthy connection, opening a new one while under the size limit"""
+        if self._closed:
+            raise PoolTimeout("Snowflake connection pool is closed")
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is not None:
+                if self._is_healthy(conn):
+                    self.checkouts += 1
+                    return conn
+                self._discard(conn)
+                continue
+
+            with self._lock:
+                can_open = self._opened < self.size
+                if can_open:
+                    self._opened += 1
+            if can_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+                self._checked_at[id(conn)] = time.monotonic()
+                self.checkouts += 1
+                return conn
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise PoolTimeout(f"No Snowflake connection available within {self.timeout}s")
+            try:
+                conn = self._idle.get(timeout=remaining)
+            except queue.Empty:
+                raise PoolTimeout(f"No Snowflake connection available within {self.timeout}s")
+            if self._is_healthy(conn):
+                self.checkouts += 1
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        if self._closed or conn.is_closed():
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def call(self, func, *args, **kwargs):
+        """Run `func(conn, *args, **kwargs)` on a checked out connection"""
+        with self.connection() as conn:
+            return func(conn, *args, **kwargs)
+
+    def close(self):
+        """Close every idle connection; connections still checked out are closed on release"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+        logger.info("Snowflake pool closed")
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "opened": self._opened,
+            "idle": self._idle.qsize(),
+            "in_use": self._opened - self._idle.qsize(),
+            "checkouts": self.checkouts,
+            "discarded": self.discarded,
+        }
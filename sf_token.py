@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from sf_executor import sf_executor
+
+logger = logging.getLogger(__name__)
+
+
+class _TokenEntry:
+    __slots__ = ("conn", "token", "issued_at")
+
+    def __init__(self, conn, issued_at: float):
+        self.conn = conn
+        self.token = conn.rest.token
+        self.issued_at = issued_at
+
+
+class SnowflakeTokenManager:
+    """
+    Hands out Snowflake REST session tokens for Cortex calls.
+
+    The token of every connection seen is remembered together with its age.
+    A background task renews tokens `refresh_margin` seconds before they reach
+    `token_ttl`, so request handlers read a current token from memory instead
+    of finding out about an expired session from a failed Cortex call.
+    Connections registered with `track()` right after login have a known age;
+    any other connection is assumed to be due and is renewed at the next check.
+    A token the connector renewed on its own is picked up from `conn.rest.token`.
+    Renewal is a network call and never happens on the request path; a
+    handler that finds an expired token renews it through `sf_executor`.
+    """
+
+    def __init__(self, token_ttl: float = 3600, refresh_margin: float = 600, check_interval: float = 60):
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._task = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def track(self, conn):
+        """Register a connection that has just logged in, so its token age is known"""
+        with self._lock:
+            self._entries[id(conn)] = _TokenEntry(conn, time.monotonic())
+
+    def _entry(self, conn) -> _TokenEntry:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(id(conn))
+            if entry is None or entry.conn is not conn:
+                # Unknown login time: treat the token as due for renewal
+                entry = _TokenEntry(conn, now - self.token_ttl + self.refresh_margin)
+                self._entries[id(conn)] = entry
+            elif conn.rest.token != entry.token:
+                # The connector renewed the session itself
+                entry.token = conn.rest.token
+                entry.issued_at = now
+            return entry
+
+    def get_token(self, conn) -> str:
+        """Current REST token of `conn`, from memory; never renews"""
+        return self._entry(conn).token
+
+    def auth_header(self, conn) -> str:
+        return f'Snowflake Token="{self.get_token(conn)}"'
+
+    async def async_auth_header(self, conn, aplctn_cd) -> str:
+        """`auth_header`, renewing an expired token on the Snowflake executor first"""
+        entry = self._entry(conn)
+        if time.monotonic() - entry.issued_at >= self.token_ttl:
+            await sf_executor.run(aplctn_cd, self._renew, entry)
+        return f'Snowflake Token="{entry.token}"'
+
+    def _renew(self, entry: _TokenEntry):
+        rest = entry.conn.rest
+        # The connector renews the session token with its master token
+        rest._renew_session()
+        with self._lock:
+            entry.token = rest.token
+            entry.issued_at = time.monotonic()
+            self.refreshes += 1
+
+    def _due(self) -> list:
+        now = time.monotonic()
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.conn.is_closed()]:
+                del self._entries[key]
+            return [
+                entry for entry in self._entries.values()
+                if now - entry.issued_at >= self.token_ttl - self.refresh_margin
+            ]
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for entry in self._due():
+                try:
+                    await sf_executor.run("token_refresh", self._renew, entry)
+                except Exception as e:
+                    self.refresh_failures += 1
+                    logger.warning(f"Snowflake token refresh failed: {e}")
+
+    def start(self):
+        """Start the background refresh on the running event loop; safe to call more than once"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            ages = [now - entry.issued_at for entry in self._entries.values()]
+        return {
+            "tokens": len(ages),
+            "oldest_token_age_seconds": max(ages, default=0),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
+
+
+sf_token_manager = SnowflakeTokenManager(
+    token_ttl=float(os.getenv("GENAI_SF_TOKEN_TTL", "3600")),
+    refresh_margin=float(os.getenv("GENAI_SF_TOKEN_REFRESH_MARGIN", "600")),
+    check_interval=float(os.getenv("GENAI_SF_TOKEN_CHECK_INTERVAL", "60")),
+)
@@ -0,0 +1,357 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+
+from sql_results import iter_result_tables
+
+logger = logging.getLogger(__name__)
+
+SQL_CACHE_ENABLED = os.getenv("GENAI_SQL_CACHE", "true").lower() in ("1", "true", "yes")
+SQL_CACHE_TTL = float(os.getenv("GENAI_SQL_CACHE_TTL", "900"))
+SQL_CACHE_MEMORY_BYTES = int(os.getenv("GENAI_SQL_CACHE_MEMORY_BYTES", str(256 * 1024 * 1024)))
+# Results evicted from memory move to Arrow files here; 0 bytes turns the disk tier off
+SQL_CACHE_DISK_BYTES = int(os.getenv("GENAI_SQL_CACHE_DISK_BYTES", str(2 * 1024 * 1024 * 1024)))
+SQL_CACHE_DIR = os.getenv("GENAI_SQL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "genai_sql_cache"))
+# Larger results are streamed without being cached
+SQL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("GENAI_SQL_CACHE_MAX_ENTRY_BYTES", str(64 * 1024 * 1024)))
+
+_SQL_TOKENS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\s+)", re.DOTALL)
+_NONDETERMINISTIC = re.compile(
+    r"\b(CURRENT_(DATE|TIME|TIMESTAMP|USER|ROLE|SESSION)|LOCALTIME|LOCALTIMESTAMP|SYSDATE|GETDATE|SYSTIMESTAMP"
+    r"|RANDOM|UNIFORM|NORMAL|RANDSTR|UUID_STRING|SEQ[1248]|SAMPLE|TABLESAMPLE)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(exec_sql: str) -> str:
+    """
+    SQL text with comments dropped and whitespace collapsed outside quoted
+    literals and identifiers, without a trailing semicolon, so formatting
+    differences of the generated SQL map to one cache entry.
+    """
+    parts = []
+    for token in _SQL_TOKENS.split(exec_sql or ""):
+        if not token:
+            continue
+        if token[0] in "'\"":
+            parts.append(token)
+        elif token.isspace() or token.startswith("--") or token.startswith("/*"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(token)
+    return re.sub(r"\s*;\s*$", "", "".join(parts).strip())
+
+
+def cacheable_sql(normalized_sql: str) -> bool:
+    """Only read-only queries whose result does not depend on the clock, the session or chance"""
+    return bool(re.match(r"(SELECT|WITH)\b", normalized_sql, re.IGNORECASE)) and not _NONDETERMINISTIC.search(
+        _SQL_TOKENS.sub(" ", normalized_sql)
+    )
+
+
+def result_cache_key(aplctn_cd, app_lvl_prefix, role, normalized_sql) -> str:
+    """Results are only shared by requests of the same application, prefix and Snowflake role"""
+    return hashlib.sha256(json.dumps([aplctn_cd, app_lvl_prefix, role, normalized_sql]).encode("utf-8")).hexdigest()
+
+
+class SqlResultCache:
+    """
+    Arrow results of generated SQL, by `result_cache_key`.
+
+    The memory tier is an LRU of at most `memory_bytes`; results it evicts
+    move to Arrow IPC files in `directory` (at most `disk_bytes`, oldest
+    removed first) and back to memory on their next hit. Every entry expires
+    `ttl` seconds after it was fetched from Snowflake. Results larger than
+    `max_entry_bytes` are not cached. Each hit counts the warehouse time the
+    original execution took as saved.
+    """
+
+    def __init__(self, directory: str, ttl: float = 900, memory_bytes: int = 256 * 1024 * 1024,
+                 disk_bytes: int = 2 * 1024 * 1024 * 1024, max_entry_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._disk = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = 0
+        self._stats = {
+            "hits_memory": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "stored": 0,
+            "too_large": 0,
+            "evicted_memory": 0,
+            "evicted_disk": 0,
+            "saved_seconds": 0.0,
+            "miss_seconds": 0.0,
+        }
+        if self.disk_bytes > 0:
+            self._load_disk()
+
+    def _path(self, key) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def _load_disk(self):
+        """Index the result files left by a previous run; expired ones are removed"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            names = sorted(os.listdir(self.directory), key=lambda name: os.path.getmtime(os.path.join(self.directory, name)))
+        except OSError as e:
+            logger.warning(f"SQL result cache directory {self.directory} is not usable, disk tier off: {e}")
+            self.disk_bytes = 0
+            return
+        now = time.time()
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".arrow"):
+                continue
+            try:
+                with pa.memory_map(path) as source:
+                    metadata = pa.ipc.open_file(source).schema.metadata or {}
+                entry = {
+                    "created": float(metadata[b"created"]),
+                    "seconds": float(metadata[b"seconds"]),
+                    "bytes": os.path.getsize(path),
+                }
+            except Exception as e:
+                logger.warning(f"Removing unreadable SQL cache file {path}: {e}")
+                self._remove_file(path)
+                continue
+            if now - entry["created"] >= self.ttl:
+                self._remove_file(path)
+                continue
+            self._disk[name[:-len(".arrow")]] = entry
+            self._disk_used += entry["bytes"]
+        for stale in self._evict_disk(now):
+            self._remove_file(stale)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self, now):
+        """Drop the oldest files over the size bound or past the TTL; returns the paths to remove"""
+        removed = []
+        for key in list(self._disk):
+            entry = self._disk[key]
+            if self._disk_used <= self.disk_bytes and now - entry["created"] < self.ttl:
+                continue
+            del self._disk[key]
+            self._disk_used -= entry["bytes"]
+            self._stats["evicted_disk"] += 1
+            removed.append(self._path(key))
+        return removed
+
+    def _spill(self, key, entry):
+        """Write a result evicted from memory to the disk tier, unless it is there already"""
+        with self._lock:
+            if key in self._disk:
+                return
+        path = self._path(key)
+        schema = entry["tables"][0].schema.with_metadata({
+            "created": str(entry["created"]),
+            "seconds": str(entry["seconds"]),
+        })
+        try:
+            with open(path + ".tmp", "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+                for table in entry["tables"]:
+                    writer.write_table(table.replace_schema_metadata(schema.metadata))
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.warning(f"Could not write SQL cache file {path}: {e}")
+            self._remove_file(path + ".tmp")
+            return
+        with self._lock:
+            previous = self._disk.pop(key, None)
+            if previous:
+                self._disk_used -= previous["bytes"]
+            self._disk[key] = {"created": entry["created"], "seconds": entry["seconds"], "bytes": os.path.getsize(path)}
+            self._disk_used += self._disk[key]["bytes"]
+            removed = self._evict_disk(time.time())
+        for stale in removed:
+            self._remove_file(stale)
+
+    def get(self, key):
+        """Cached Arrow tables of `key`, or None. Blocking when the result is on disk."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry["created"] < self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["hits_memory"] += 1
+                self._stats["saved_seconds"] += entry["seconds"]
+                return entry["tables"]
+            if entry is not None:
+                del self._memory[key]
+                self._memory_used -= entry["bytes"]
+            on_disk = self._disk.get(key)
+            if on_disk is None or now - on_disk["created"] >= self.ttl:
+                self._stats["misses"] += 1
+                return None
+        try:
+            with pa.memory_map(self._path(key)) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except Exception as e:
+            logger.warning(f"Could not read SQL cache file of {key}: {e}")
+            with self._lock:
+                if self._disk.pop(key, None):
+                    self._disk_used -= on_disk["bytes"]
+                self._stats["misses"] += 1
+            return None
+        tables = [table.replace_schema_metadata(None)]
+        with self._lock:
+            self._stats["hits_disk"] += 1
+            self._stats["saved_seconds"] += on_disk["seconds"]
+        self.put(key, tables, on_disk["seconds"], on_disk["created"])
+        return tables
+
+    def put(self, key, tables: list, seconds: float, created: float = None):
+        """Cache the Arrow tables of a result that took `seconds` in the warehouse"""
+        size = sum(table.nbytes for table in tables)
+        if not tables or size > self.max_entry_bytes or size > self.memory_bytes:
+            with self._lock:
+                self._stats["too_large"] += 1
+            return
+        entry = {"tables": tables, "bytes": size, "seconds": seconds, "created": created or time.time()}
+        spill = []
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous:
+                self._memory_used -= previous["bytes"]
+            self._memory[key] = entry
+            self._memory_used += size
+            if created is None:
+                self._stats["stored"] += 1
+            while self._memory_used > self.memory_bytes:
+                old_key, old_entry = self._memory.popitem(last=False)
+                self._memory_used -= old_entry["bytes"]
+                self._stats["evicted_memory"] += 1
+                spill.append((old_key, old_entry))
+        for old_key, old_entry in spill:
+            if self.disk_bytes > 0 and time.time() - old_entry["created"] < self.ttl:
+                self._spill(old_key, old_entry)
+
+    def tables(self, key, sf_conn, exec_sql, lookup: bool = True, outcome: dict = None):
+        """
+        Arrow tables of `exec_sql`: from the cache when `lookup` and cached,
+        otherwise from Snowflake, caching the result once it was read to the
+        end. `outcome["cache"]` is set to hit or miss before the first table. Blocking.
+        """
+        outcome = {} if outcome is None else outcome
+        cached = self.get(key) if lookup else None
+        if cached is not None:
+            outcome["cache"] = "hit"
+            yield from cached
+            return
+        if not lookup:
+            with self._lock:
+                self._stats["bypassed"] += 1
+        outcome["cache"] = "miss"
+        yield from self.fill(key, iter_result_tables(sf_conn, exec_sql))
+
+    def fill(self, key, source, seconds: float = 0.0):
+        """
+        Relay the Arrow tables of `source` and cache them under `key` once
+        read to the end; `seconds` is warehouse time already spent on the
+        query, e.g. waiting for an asynchronous one. Blocking.
+        """
+        collected, size = [], 0
+        try:
+            while True:
+                # Only the time spent in Snowflake counts, not the time the client takes to read
+                started = time.monotonic()
+                table = next(source, None)
+                seconds += time.monotonic() - started
+                if table is None:
+                    break
+                if collected is not None:
+                    size += table.nbytes
+                    if size <= self.max_entry_bytes:
+                        collected.append(table)
+                    else:
+                        collected = None
+                yield table
+        finally:
+            source.close()
+        with self._lock:
+            self._stats["miss_seconds"] += seconds
+        if collected is None:
+            with self._lock:
+                self._stats["too_large"] += 1
+        else:
+            self.put(key, collected, seconds)
+
+    def bypass(self):
+        """Count a request that skipped the cache altogether"""
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits_memory"] + self._stats["hits_disk"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_ratio=(self._stats["hits_memory"] + self._stats["hits_disk"]) / lookups if lookups else 0.0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_used,
+                disk_entries=len(self._disk),
+                disk_bytes=self._disk_used,
+                ttl=self.ttl,
+            )
+
+    def render(self) -> str:
+        """Hit/miss counts, saved warehouse time and tier sizes in the Prometheus text format"""
+        stats = self.stats()
+        lines = [
+            "# HELP sql_cache_requests_total SQL result cache lookups by outcome",
+            "# TYPE sql_cache_requests_total counter",
+            f'sql_cache_requests_total{{outcome="hit",tier="memory"}} {stats["hits_memory"]}',
+            f'sql_cache_requests_total{{outcome="hit",tier="disk"}} {stats["hits_disk"]}',
+            f'sql_cache_requests_total{{outcome="miss"}} {stats["misses"]}',
+            f'sql_cache_requests_total{{outcome="bypass"}} {stats["bypassed"]}',
+            "# HELP sql_cache_saved_seconds_total Warehouse time the cached results originally took, summed over hits",
+            "# TYPE sql_cache_saved_seconds_total counter",
+            f"sql_cache_saved_seconds_total {stats['saved_seconds']}",
+            "# HELP sql_cache_miss_seconds_total Time spent executing and reading results that were not cached",
+            "# TYPE sql_cache_miss_seconds_total counter",
+            f"sql_cache_miss_seconds_total {stats['miss_seconds']}",
+            "# HELP sql_cache_bytes Size of the cached results",
+            "# TYPE sql_cache_bytes gauge",
+            f'sql_cache_bytes{{tier="memory"}} {stats["memory_bytes"]}',
+            f'sql_cache_bytes{{tier="disk"}} {stats["disk_bytes"]}',
+            "# HELP sql_cache_entries Number of cached results",
+            "# TYPE sql_cache_entries gauge",
+            f'sql_cache_entries{{tier="memory"}} {stats["memory_entries"]}',
+            f'sql_cache_entries{{tier="disk"}} {stats["disk_entries"]}',
+            "# HELP sql_cache_evictions_total Results evicted by size or age",
+            "# TYPE sql_cache_evictions_total counter",
+            f'sql_cache_evictions_total{{tier="memory"}} {stats["evicted_memory"]}',
+            f'sql_cache_evictions_total{{tier="disk"}} {stats["evicted_disk"]}',
+        ]
+        return "\n".join(lines) + "\n"
+
+
+sql_cache = SqlResultCache(
+    SQL_CACHE_DIR,
+    ttl=SQL_CACHE_TTL,
+    memory_bytes=SQL_CACHE_MEMORY_BYTES,
+    disk_bytes=SQL_CACHE_DISK_BYTES,
+    max_entry_bytes=SQL_CACHE_MAX_ENTRY_BYTES,
+)
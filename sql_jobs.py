@@ -0,0 +1,160 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sql_results import QUERY_ID_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# How long a job stays in the table after its last update, and how many are kept
+SQL_JOB_TTL = float(os.getenv("GENAI_SQL_JOB_TTL", "3600"))
+SQL_MAX_JOBS = int(os.getenv("GENAI_SQL_MAX_JOBS", "10000"))
+# Longest a status request may wait for a job to finish, and the polling interval meanwhile
+SQL_JOB_MAX_WAIT = float(os.getenv("GENAI_SQL_JOB_MAX_WAIT", "30"))
+SQL_JOB_POLL_SECONDS = float(os.getenv("GENAI_SQL_JOB_POLL_SECONDS", "1"))
+# How long a cancel waits for Snowflake to report the query as stopped
+SQL_JOB_CANCEL_WAIT = float(os.getenv("GENAI_SQL_JOB_CANCEL_WAIT", "2"))
+
+FINAL_JOB_STATUSES = ("succeeded", "failed", "cancelled")
+_CANCELLED_QUERY_STATUSES = ("ABORTING", "ABORTED")
+
+
+def submit_query(sf_conn, exec_sql) -> str:
+    """Start `exec_sql` with execute_async and return its query id without waiting for it. Blocking."""
+    cs = sf_conn.cursor()
+    try:
+        cs.execute_async(exec_sql)
+        return cs.sfqid
+    finally:
+        cs.close()
+
+
+def query_status(sf_conn, query_id) -> tuple:
+    """
+    (job status, Snowflake status name, error message) of `query_id`:
+    running, succeeded, failed or cancelled. Blocking.
+    """
+    sf_status = sf_conn.get_query_status(query_id)
+    if sf_conn.is_still_running(sf_status):
+        return "running", sf_status.name, None
+    if not sf_conn.is_an_error(sf_status):
+        return "succeeded", sf_status.name, None
+    try:
+        sf_conn.get_query_status_throw_if_error(query_id)
+        error = None
+    except Exception as e:
+        error = str(e)
+    status = "cancelled" if sf_status.name in _CANCELLED_QUERY_STATUSES else "failed"
+    return status, sf_status.name, error
+
+
+def cancel_query(sf_conn, query_id):
+    """Ask Snowflake to cancel `query_id`. Blocking."""
+    if not QUERY_ID_PATTERN.match(query_id or ""):
+        raise ValueError(f"Not a Snowflake query id: {query_id}")
+    cs = sf_conn.cursor()
+    try:
+        cs.execute("SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+        return cs.fetchone()[0]
+    finally:
+        cs.close()
+
+
+def cancel_and_wait(sf_conn, query_id, wait: float = SQL_JOB_CANCEL_WAIT) -> tuple:
+    """
+    Cancel `query_id`, then poll it until Snowflake reports it finished or `wait` seconds passed.
+    (cancel message, job status, Snowflake status, error); a query that finished
+    before the cancel took effect keeps its own status. Blocking.
+    """
+    message = cancel_query(sf_conn, query_id)
+    deadline = time.monotonic() + wait
+    interval = 0.1
+    while True:
+        job_status, sf_status, error = query_status(sf_conn, query_id)
+        if job_status != "running" or time.monotonic() >= deadline:
+            return message, job_status, sf_status, error
+        time.sleep(interval)
+        interval = min(interval * 2, SQL_JOB_POLL_SECONDS)
+
+
+class SqlJobTable:
+    """
+    SQL queries submitted with execute_async, by Snowflake query id.
+
+    A job belongs to the application and app id that submitted it; `get()`
+    with any other owner does not find it. Statuses are cached once final,
+    so finished jobs are not polled again. At most `max_jobs` jobs are kept,
+    each for `ttl` seconds after its last update; the result itself stays in
+    Snowflake (RESULT_SCAN) for 24 hours.
+    """
+
+    def __init__(self, ttl: float = 3600, max_jobs: int = 10000):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._expired = 0
+
+    def _evict(self, now):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if len(self._jobs) <= self.max_jobs and now - job["updated"] < self.ttl:
+                break
+            self._jobs.popitem(last=False)
+            self._expired += 1
+            if job["status"] not in FINAL_JOB_STATUSES:
+                logger.warning(f"SQL job {job['job_id']} expired while {job['status']}")
+
+    def add(self, job_id, aplctn_cd, app_id, session_id) -> dict:
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "aplctn_cd": aplctn_cd,
+            "app_id": app_id,
+            "session_id": session_id,
+            "status": "running",
+            "sf_status": None,
+            "error": None,
+            "submitted": now,
+            "finished": None,
+            "updated": now,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._evict(now)
+            return dict(job)
+
+    def get(self, job_id, aplctn_cd, app_id) -> dict:
+        """The job, or None when it is unknown, expired or owned by another application"""
+        with self._lock:
+            self._evict(time.time())
+            job = self._jobs.get(job_id)
+            if job is None or (job["aplctn_cd"], job["app_id"]) != (aplctn_cd, app_id):
+                return None
+            return dict(job)
+
+    def update(self, job_id, status: str, sf_status: str = None, error: str = None) -> dict:
+        now = time.time()
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return None
+            if job["status"] not in FINAL_JOB_STATUSES:
+                job.update(status=status, sf_status=sf_status or job["sf_status"], error=error)
+                if status in FINAL_JOB_STATUSES:
+                    job["finished"] = now
+            job["updated"] = now
+            self._jobs[job_id] = job
+            return dict(job)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {"tracked": len(self._jobs), "expired": self._expired, "statuses": counts, "ttl": self.ttl}
+
+
+sql_jobs = SqlJobTable(ttl=SQL_JOB_TTL, max_jobs=SQL_MAX_JOBS)
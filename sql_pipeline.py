@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import time
+from functools import partial
+
+from sf_executor import sf_executor
+from sql_cache import SQL_CACHE_ENABLED, cacheable_sql, normalize_sql, result_cache_key, sql_cache
+from sql_jobs import SQL_JOB_POLL_SECONDS, cancel_and_wait, query_status, sql_jobs, submit_query
+from sql_results import iter_result_tables, stream_batches, table_records
+
+logger = logging.getLogger(__name__)
+
+# Rows sent on a fused txt2sql stream; the full result stays available as an SQL job
+TXT2SQL_MAX_ROWS = int(os.getenv("GENAI_TXT2SQL_MAX_ROWS", "10000"))
+# First status poll of the submitted query, doubled up to SQL_JOB_POLL_SECONDS
+PIPELINE_FIRST_POLL_SECONDS = 0.1
+
+
+def record_batches(tables, max_rows: int, truncated: dict):
+    """
+    JSON-ready records per Arrow table, at most `max_rows` in total;
+    `truncated["rows"]` is set when rows were left out. Blocking.
+    """
+    sent = 0
+    for table in tables:
+        if sent + table.num_rows > max_rows:
+            truncated["rows"] = True
+            table = table.slice(0, max_rows - sent)
+        if table.num_rows:
+            sent += table.num_rows
+            yield table_records([table])
+        if truncated:
+            break
+
+
+def _read_error(e) -> dict:
+    return {"error": str(e)}
+
+
+class PipelinedSql:
+    """
+    The SQL of a txt2sql stream, run while the rest of the stream is generated.
+
+    `start(exec_sql)` submits the statement with execute_async (or finds its
+    result in the SQL result cache) as soon as the `sql` item arrives and
+    returns at once; `events()` then waits for the query without holding an
+    executor thread and yields `rows` events of up to `max_rows` records,
+    followed by one `sql_result` event with the query id, status and row
+    count. The query is registered as an SQL job, so its full result can be
+    fetched from /txt2sql/jobs. `aclose()` cancels a query still running.
+    """
+
+    def __init__(self, sf_conn, aplctn_cd, app_id, app_lvl_prefix, session_id,
+                 use_cache: bool = True, max_rows: int = TXT2SQL_MAX_ROWS):
+        self.sf_conn = sf_conn
+        self.aplctn_cd = aplctn_cd
+        self.app_id = app_id
+        self.app_lvl_prefix = app_lvl_prefix
+        self.session_id = session_id
+        self.use_cache = use_cache
+        self.max_rows = max_rows
+        self.exec_sql = None
+        self.query_id = None
+        self.cache_key = None
+        self._cached = None
+        self._task = None
+        self._started = None
+        self._finished = False
+
+    def start(self, exec_sql: str):
+        """Submit `exec_sql`; only the first statement of a stream is executed"""
+        if self._task is not None or not exec_sql:
+            return
+        self.exec_sql = exec_sql
+        self._started = time.monotonic()
+        if SQL_CACHE_ENABLED and self.use_cache:
+            normalized_sql = normalize_sql(exec_sql)
+            if cacheable_sql(normalized_sql):
+                self.cache_key = result_cache_key(
+                    self.aplctn_cd, self.app_lvl_prefix, getattr(self.sf_conn, "role", None), normalized_sql
+                )
+        if self.cache_key is None:
+            sql_cache.bypass()
+        self._task = asyncio.create_task(self._submit())
+
+    async def _submit(self):
+        if self.cache_key is not None:
+            self._cached = await sf_executor.run(self.aplctn_cd, sql_cache.get, self.cache_key)
+            if self._cached is not None:
+                self._finished = True
+                return
+        self.query_id = await sf_executor.run(self.aplctn_cd, submit_query, self.sf_conn, self.exec_sql)
+        sql_jobs.add(self.query_id, self.aplctn_cd, self.app_id, self.session_id)
+
+    async def _wait(self) -> tuple:
+        """Poll the submitted query until it finishes; (status, error)"""
+        interval = PIPELINE_FIRST_POLL_SECONDS
+        while True:
+            job_status, sf_status, error = await sf_executor.run(self.aplctn_cd, query_status, self.sf_conn, self.query_id)
+            sql_jobs.update(self.query_id, job_status, sf_status, error)
+            if job_status != "running":
+                return job_status, error
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, SQL_JOB_POLL_SECONDS)
+
+    def _summary(self, status: str, **fields) -> dict:
+        return dict(
+            {
+                "query_id": self.query_id,
+                "status": status,
+                "cache": "hit" if self._cached is not None else ("miss" if self.cache_key else "bypass"),
+                "elapsed_ms": round((time.monotonic() - self._started) * 1000, 1),
+            },
+            **fields,
+        )
+
+    async def events(self):
+        """`rows` events of the result, then its `sql_result`; nothing when no SQL was submitted"""
+        if self._task is None:
+            return
+        try:
+            await self._task
+            if self._cached is not None:
+                tables = self._cached
+            else:
+                job_status, error = await self._wait()
+                self._finished = True
+                if job_status != "succeeded":
+                    yield "sql_result", self._summary(job_status, error=error)
+                    return
+                tables = iter_result_tables(self.sf_conn, None, self.query_id)
+                if self.cache_key is not None:
+                    tables = sql_cache.fill(self.cache_key, tables, time.monotonic() - self._started)
+            row_count = 0
+            truncated = {}
+            batches = record_batches(tables, self.max_rows, truncated)
+            async for records in stream_batches(batches, partial(sf_executor.run, self.aplctn_cd), error_chunk=_read_error):
+                if isinstance(records, dict):
+                    yield "sql_result", self._summary("failed", row_count=row_count, **records)
+                    return
+                row_count += len(records)
+                yield "rows", {"rows": records}
+        except Exception as e:
+            logger.error(f"Error executing the txt2sql statement: {e}")
+            yield "sql_result", self._summary("failed", error=str(e))
+            return
+        yield "sql_result", self._summary("succeeded", row_count=row_count, truncated=bool(truncated))
+
+    async def aclose(self):
+        """Cancel the query when the stream ends before its result was read"""
+        if self._task is None or self._finished:
+            return
+        try:
+            # Submission is short; wait for the query id rather than leave the query running
+            await self._task
+        except (asyncio.CancelledError, Exception):
+            pass
+        if self.query_id is None:
+            return
+        try:
+            _, job_status, sf_status, error = await sf_executor.run(self.aplctn_cd, cancel_and_wait, self.sf_conn, self.query_id)
+            sql_jobs.update(self.query_id, job_status, sf_status, error)
+        except Exception as e:
+            logger.error(f"Error cancelling the txt2sql statement {self.query_id}: {e}")
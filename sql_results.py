@@ -0,0 +1,395 @@
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from snowflake.connector.constants import FIELD_ID_TO_NAME
+
+logger = logging.getLogger(__name__)
+
+# Result batches buffered between the Snowflake thread and the response
+SQL_STREAM_BUFFER = int(os.getenv("GENAI_SQL_STREAM_BUFFER", "4"))
+# Parquet results are assembled in a temporary file that stays in memory up to this size
+SQL_PARQUET_SPOOL_BYTES = int(os.getenv("GENAI_SQL_PARQUET_SPOOL_BYTES", str(64 * 1024 * 1024)))
+PARQUET_CHUNK_BYTES = 1024 * 1024
+# Rows per page of a paginated result
+SQL_PAGE_SIZE = int(os.getenv("GENAI_SQL_PAGE_SIZE", "1000"))
+SQL_MAX_PAGE_SIZE = int(os.getenv("GENAI_SQL_MAX_PAGE_SIZE", "10000"))
+QUERY_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.IGNORECASE)
+
+RESULT_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+_MEDIA_TYPE_FORMATS = dict(
+    {media_type: result_format for result_format, media_type in RESULT_MEDIA_TYPES.items()},
+    **{"application/x-parquet": "parquet", "application/parquet": "parquet"},
+)
+
+
+def negotiate_result_format(accept: str = None, result_format: str = None, default: str = "json") -> str:
+    """
+    Result format for a request: an explicit `result_format` name wins, then
+    the most preferred media type of the Accept header we can produce, then `default`.
+    """
+    if result_format:
+        if result_format not in RESULT_MEDIA_TYPES:
+            raise ValueError(f"Unsupported result format {result_format}, use one of {', '.join(RESULT_MEDIA_TYPES)}")
+        return result_format
+    offers = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in _MEDIA_TYPE_FORMATS and quality > 0:
+            offers.append((-quality, position, _MEDIA_TYPE_FORMATS[media_type.lower()]))
+    return min(offers)[2] if offers else default
+
+
+def normalize_frame(df):
+    """
+    Make a result DataFrame JSON-ready the way the JSON responses always did:
+    NaN becomes 0, timestamps '%Y-%m-%d %H:%M:%S', dates in object columns ISO.
+    """
+    df = df.fillna(0)  # Replace NaN values with 0
+    for column in df.select_dtypes(include=["datetime", "datetimetz"]).columns:
+        df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')  # Format datetime
+    for column in df.select_dtypes(include=["object"]).columns:
+        df[column] = df[column].apply(lambda x: x.isoformat() if isinstance(x, (datetime, date)) else x)
+    return df
+
+
+def frame_to_ndjson(df) -> bytes:
+    """One JSON record per line, newline terminated"""
+    if df.empty:
+        return b""
+    lines = df.to_json(orient="records", lines=True, default_handler=str)
+    return (lines if lines.endswith("\n") else lines + "\n").encode("utf-8")
+
+
+def open_result(sf_conn, exec_sql=None, query_id=None):
+    """
+    Cursor over the result of `exec_sql`, executed now, or of the earlier
+    query `query_id` (e.g. one submitted with execute_async). Blocking.
+    """
+    cs = sf_conn.cursor()
+    try:
+        if query_id is not None:
+            cs.get_results_from_sfqid(query_id)
+        else:
+            cs.execute(exec_sql)
+    except Exception:
+        cs.close()
+        raise
+    return cs
+
+
+def iter_ndjson_batches(sf_conn, exec_sql, query_id=None):
+    """
+    Execute `exec_sql` (or read the result of `query_id`) and yield it as NDJSON,
+    one chunk per Arrow result batch, so only one batch is held in memory at a time. Blocking.
+    """
+    cs = open_result(sf_conn, exec_sql, query_id)
+    try:
+        for df in cs.fetch_pandas_batches():
+            yield frame_to_ndjson(normalize_frame(df))
+    finally:
+        cs.close()
+
+
+def result_records(sf_conn, exec_sql=None, query_id=None) -> list:
+    """All rows of `exec_sql` (or of the result of `query_id`) as JSON-ready records. Blocking."""
+    cs = open_result(sf_conn, exec_sql, query_id)
+    try:
+        return normalize_frame(cs.fetch_pandas_all()).to_dict(orient="records")
+    finally:
+        cs.close()
+
+
+def result_columns(description) -> list:
+    """Name and Snowflake type of the result columns of a cursor"""
+    return [
+        {"name": column[0], "type": FIELD_ID_TO_NAME.get(column[1], str(column[1])), "nullable": column[6]}
+        for column in (description or [])
+    ]
+
+
+def _page_rows(sf_conn, cs, page: int, page_size: int) -> list:
+    """
+    Rows `page * page_size` onward of the executed cursor, in the order of its
+    result batches. Batches before the page are skipped by their row count
+    without being downloaded. Blocking.
+    """
+    offset = page * page_size
+    tables = []
+    for batch in cs.get_result_batches() or []:
+        if offset >= batch.rowcount:
+            offset -= batch.rowcount
+            continue
+        table = batch.to_arrow(connection=sf_conn).slice(offset, page_size)
+        offset = 0
+        tables.append(table)
+        page_size -= table.num_rows
+        if page_size <= 0:
+            break
+    if not tables:
+        return []
+    schema = _widen_schema(tables[0].schema)
+    table = pa.concat_tables([table.cast(schema) for table in tables])
+    return normalize_frame(table.to_pandas()).to_dict(orient="records")
+
+
+def _page(page: int, page_size: int, rows: list) -> dict:
+    return {
+        "page": page,
+        "page_size": page_size,
+        "rows": rows,
+        "next_page": page + 1 if len(rows) == page_size else None,
+    }
+
+
+def fetch_result_page(sf_conn, query_id: str, page: int, page_size: int) -> dict:
+    """
+    One page of the persisted result of `query_id`. Pages are cut from its
+    result batches, so they keep the order of the query and never overlap,
+    and only the batches of the page are downloaded. Blocking.
+    """
+    if not QUERY_ID_PATTERN.match(query_id or ""):
+        raise ValueError(f"Not a Snowflake query id: {query_id}")
+    if page < 0 or not 0 < page_size <= SQL_MAX_PAGE_SIZE:
+        raise ValueError(f"page must be >= 0 and page_size between 1 and {SQL_MAX_PAGE_SIZE}")
+    cs = open_result(sf_conn, query_id=query_id)
+    try:
+        rows = _page_rows(sf_conn, cs, page, page_size)
+    finally:
+        cs.close()
+    return _page(page, page_size, rows)
+
+
+def execute_paged(sf_conn, exec_sql, page_size: int) -> dict:
+    """
+    Run `exec_sql` and return its query id, columns, row count and first page,
+    read from the same cursor; later pages come from `fetch_result_page`. Blocking.
+    """
+    cs = open_result(sf_conn, exec_sql)
+    try:
+        query_id = cs.sfqid
+        total_rows = cs.rowcount
+        columns = result_columns(cs.description)
+        first_page = _page(0, page_size, _page_rows(sf_conn, cs, 0, page_size))
+    finally:
+        cs.close()
+    if total_rows is not None and page_size >= total_rows:
+        first_page["next_page"] = None
+    return {"query_id": query_id, "columns": columns, "total_rows": total_rows, **first_page}
+
+
+def _widen_schema(schema):
+    """
+    Snowflake sizes the integer and float columns of every Arrow batch to its
+    own values; widen them so all batches of a result share one schema.
+    """
+    fields = []
+    for field in schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_floating(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def _arrow_batches(cs):
+    """Arrow tables of the executed cursor, cast to one schema; an empty result gives one empty table"""
+    schema = None
+    for table in cs.fetch_arrow_batches():
+        if schema is None:
+            schema = _widen_schema(table.schema)
+        yield table.cast(schema)
+    if schema is None:
+        names = [column[0] for column in (cs.description or [])]
+        yield pa.table({name: pa.array([], type=pa.string()) for name in names})
+
+
+def iter_result_tables(sf_conn, exec_sql, query_id=None):
+    """
+    Execute `exec_sql` (or read the result of `query_id`) and yield its Arrow
+    batches, cast to one schema. Blocking.
+    """
+    cs = open_result(sf_conn, exec_sql, query_id)
+    try:
+        yield from _arrow_batches(cs)
+    finally:
+        cs.close()
+
+
+def ndjson_chunks(tables):
+    """Arrow tables as NDJSON, with the JSON normalization, one chunk per table"""
+    for table in tables:
+        yield frame_to_ndjson(normalize_frame(table.to_pandas()))
+
+
+def arrow_stream_chunks(tables):
+    """Arrow tables in the Arrow IPC stream format, one chunk per table"""
+    sink = io.BytesIO()
+    writer = None
+    for table in tables:
+        if writer is None:
+            writer = pa.ipc.new_stream(sink, table.schema)
+        writer.write_table(table)
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def parquet_chunks(tables):
+    """
+    Arrow tables as one Parquet file, a row group per table. Parquet has its
+    footer at the end, so the file is built in a temporary file first (in
+    memory up to SQL_PARQUET_SPOOL_BYTES).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SQL_PARQUET_SPOOL_BYTES) as spool:
+        writer = None
+        for table in tables:
+            if writer is None:
+                writer = pq.ParquetWriter(spool, table.schema, compression="snappy")
+            writer.write_table(table)
+        writer.close()
+        spool.seek(0)
+        while chunk := spool.read(PARQUET_CHUNK_BYTES):
+            yield chunk
+
+
+def table_records(tables) -> list:
+    """Arrow tables as JSON-ready records"""
+    tables = list(tables)
+    return normalize_frame(pa.concat_tables(tables).to_pandas()).to_dict(orient="records")
+
+
+def iter_arrow_stream(sf_conn, exec_sql, query_id=None):
+    """
+    Execute `exec_sql` (or read the result of `query_id`) and yield it in the Arrow IPC
+    stream format straight from the connector's Arrow batches, one chunk per batch. Blocking.
+    """
+    yield from arrow_stream_chunks(iter_result_tables(sf_conn, exec_sql, query_id))
+
+
+def iter_parquet(sf_conn, exec_sql, query_id=None):
+    """
+    Execute `exec_sql` (or read the result of `query_id`) and yield it as a
+    Parquet file, one row group per Arrow batch. Blocking.
+    """
+    yield from parquet_chunks(iter_result_tables(sf_conn, exec_sql, query_id))
+
+
+def _ndjson_error(e) -> bytes:
+    return (json.dumps({"error": str(e)}) + "\n").encode("utf-8")
+
+
+def stream_ndjson(batches, run_blocking, buffer: int = SQL_STREAM_BUFFER):
+    """NDJSON form of `stream_batches`: a later error ends the stream with an `{"error": ...}` line"""
+    return stream_batches(batches, run_blocking, buffer, _ndjson_error)
+
+
+_END = object()
+
+
+async def stream_batches(batches, run_blocking, buffer: int = SQL_STREAM_BUFFER, error_chunk=None):
+    """
+    Relay the chunks of the blocking iterator `batches` to async code.
+
+    Each chunk is fetched by its own `run_blocking(func, *args)` call (e.g. on
+    the Snowflake executor), so no worker is held while chunks wait. At most
+    `buffer` chunks wait in between; once they do the fetch pauses, so a slow
+    client slows the fetch down instead of growing memory or pinning a thread.
+    An error before the first chunk is raised; a later one ends the stream,
+    after `error_chunk(e)` if given (binary formats are left truncated so the
+    client's reader fails). Closing the generator stops the fetch after the
+    current batch.
+    """
+    queue = asyncio.Queue(maxsize=buffer)
+    iterator = iter(batches)
+    stopped = False
+
+    async def produce():
+        try:
+            while not stopped:
+                chunk = await run_blocking(next, iterator, _END)
+                if stopped or chunk is _END:
+                    break
+                if chunk:
+                    await queue.put(("rows", chunk))
+        except Exception as e:
+            if not stopped:
+                await queue.put(("error", e))
+            return
+        finally:
+            # Only once the last fetch returned, a running generator cannot be closed
+            if hasattr(iterator, "close"):
+                await run_blocking(iterator.close)
+        if not stopped:
+            await queue.put(("end", None))
+
+    producer = asyncio.ensure_future(produce())
+    first = True
+    try:
+        while True:
+            kind, payload = await queue.get()
+            if kind == "end":
+                break
+            if kind == "error":
+                if first:
+                    raise payload
+                logger.error(f"Error streaming SQL results: {payload}")
+                if error_chunk is not None:
+                    yield error_chunk(payload)
+                break
+            first = False
+            yield payload
+    finally:
+        stopped = True
+        while not queue.empty():
+            queue.get_nowait()
+        try:
+            await producer
+        except Exception as e:
+            logger.error(f"Error closing SQL result stream: {e}")
+
+
+async def first_chunk_or_raise(stream):
+    """
+    Wait for the first chunk of `stream` so SQL errors can still become an
+    HTTP error status; returns a generator yielding the whole stream.
+    """
+    iterator = stream.__aiter__()
+    try:
+        head = await iterator.__anext__()
+    except StopAsyncIteration:
+        head = None
+
+    async def rest():
+        try:
+            if head is not None:
+                yield head
+            async for chunk in iterator:
+                yield chunk
+        finally:
+            await iterator.aclose()
+
+    return rest()
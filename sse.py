@@ -0,0 +1,167 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class SSEEvent:
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, data: str, event: str = "message", id: str = None, retry: int = None):
+        self.data = data
+        self.event = event
+        self.id = id
+        self.retry = retry
+
+    def __repr__(self):
+        return f"SSEEvent(event={self.event!r}, data={self.data!r})"
+
+
+class SSEParser:
+    """
+    Incremental server-sent events parser.
+
+    Feed it raw byte chunks as they arrive; it keeps the incomplete tail
+    between calls and returns only complete events, so an event split over
+    several network chunks is never dropped or decoded half way. Multi-line
+    `data:` fields are joined with newlines, comments are skipped. Complete
+    events are split off with one bytes.split per chunk and only field values
+    are copied out, so the common one-line `data:` event costs one decode.
+    """
+
+    def __init__(self):
+        self._buffer = b""
+        self._data = []
+        self._event = None
+        self._id = None
+        self._retry = None
+
+    def _dispatch(self, events: list):
+        if self._data:
+            events.append(SSEEvent(
+                self._data[0] if len(self._data) == 1 else "\n".join(self._data),
+                self._event or "message",
+                self._id,
+                self._retry,
+            ))
+        self._data = []
+        self._event = None
+        self._retry = None
+
+    def _process_line(self, buffer, start: int, end: int, events: list):
+        """Handle the line `buffer[start:end]`; only the field value is copied out"""
+        if start == end:
+            self._dispatch(events)
+            return
+        if buffer[start] == 0x3A:  # b":" starts a comment
+            return
+        colon = buffer.find(b":", start, end)
+        if colon < 0:
+            field, value_start = buffer[start:end], end
+        else:
+            field, value_start = buffer[start:colon], colon + 1
+            if value_start < end and buffer[value_start] == 0x20:
+                value_start += 1
+        if field == b"data":
+            self._data.append(buffer[value_start:end].decode("utf-8"))
+        elif field == b"event":
+            self._event = buffer[value_start:end].decode("utf-8")
+        elif field == b"id":
+            self._id = buffer[value_start:end].decode("utf-8")
+        elif field == b"retry" and buffer[value_start:end].isdigit():
+            self._retry = int(buffer[value_start:end])
+
+    def _process_block(self, block: bytes, events: list):
+        """Handle one complete event, the lines before a blank line"""
+        if block[:5] == b"data:" and b"\n" not in block:
+            # Cortex sends one `data:` line per event
+            value_start = 6 if block[5:6] == b" " else 5
+            self._data.append(block[value_start:].decode("utf-8"))
+        else:
+            for line in block.split(b"\n"):
+                self._process_line(line, 0, len(line), events)
+        self._dispatch(events)
+
+    def feed(self, chunk: bytes) -> list:
+        """Add a chunk and return the events it completed"""
+        events = []
+        buffer = self._buffer + chunk if self._buffer else chunk
+        if b"\r" in buffer:
+            # CRLF line ends: scan line by line, keeping only an incomplete last line
+            find = buffer.find
+            start = 0
+            while True:
+                end = find(b"\n", start)
+                if end < 0:
+                    break
+                line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+                self._process_line(buffer, start, line_end, events)
+                start = end + 1
+            self._buffer = bytes(buffer[start:])
+            return events
+        # Split the complete events in one pass and keep the incomplete last one for the next chunk
+        end = buffer.rfind(b"\n\n")
+        if end < 0:
+            self._buffer = bytes(buffer)
+            return events
+        for block in buffer[:end].split(b"\n\n"):
+            self._process_block(block, events)
+        self._buffer = bytes(buffer[end + 2:])
+        return events
+
+    def close(self) -> list:
+        """Flush a trailing event the upstream did not terminate with a blank line"""
+        events = []
+        if self._buffer:
+            for line in self._buffer.rstrip(b"\r\n").split(b"\n"):
+                line = line.rstrip(b"\r")
+                self._process_line(line, 0, len(line), events)
+            self._buffer = b""
+        self._dispatch(events)
+        return events
+
+
+async def aiter_sse(byte_iterator):
+    """Complete SSE events of an async byte stream, e.g. `response.aiter_bytes()`"""
+    parser = SSEParser()
+    async for chunk in byte_iterator:
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
+
+
+async def aiter_cortex_events(response, on_first_chunk=None):
+    """
+    Events of a Cortex HTTP response.
+
+    Cortex answers with an SSE stream, or with one plain JSON document when
+    streaming is not used; that document is returned as a single event so
+    callers can `json.loads(event.data)` either way. The `[DONE]` end marker
+    is not passed on. `on_first_chunk()` is called when the first bytes arrive.
+    """
+    byte_iterator = response.aiter_bytes()
+    head = b""
+    async for chunk in byte_iterator:
+        if not head and on_first_chunk is not None:
+            on_first_chunk()
+        head += chunk
+        if head.lstrip():
+            break
+    if head.lstrip()[:1] in (b"{", b"["):
+        body = bytearray(head)
+        async for chunk in byte_iterator:
+            body += chunk
+        yield SSEEvent(body.decode("utf-8"))
+        return
+
+    parser = SSEParser()
+    for event in parser.feed(head):
+        if event.data != "[DONE]":
+            yield event
+    async for chunk in byte_iterator:
+        for event in parser.feed(chunk):
+            if event.data != "[DONE]":
+                yield event
+    for event in parser.close():
+        if event.data != "[DONE]":
+            yield event
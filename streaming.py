@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STREAM_FLUSH_MS = float(os.getenv("GENAI_STREAM_FLUSH_MS", "50"))
+STREAM_FLUSH_BYTES = int(os.getenv("GENAI_STREAM_FLUSH_BYTES", "1024"))
+STREAM_DISCONNECT_POLL = float(os.getenv("GENAI_STREAM_DISCONNECT_POLL", "0.5"))
+
+
+class StreamMarker(str):
+    """A legacy stream item other than text, e.g. an SQL statement; it is never merged with its neighbours"""
+
+
+def is_stream_marker(item) -> bool:
+    """Markers, SQL, JSON trailers and typed events other than text are sent on their own, never merged with text"""
+    if isinstance(item, bytes):
+        return False
+    if isinstance(item, StreamMarker):
+        return True
+    return item.startswith(("end_of_", "{")) or (item.startswith("event: ") and not item.startswith("event: text\n"))
+
+
+# Event kinds produced by the Cortex stream generators
+STREAM_EVENTS = ("text", "sql", "suggestions", "citations", "rows", "sql_result", "meta", "error", "done")
+
+
+def legacy_frame(kind: str, payload):
+    """
+    Plain text form of a stream event: text and SQL as is, sentinel strings
+    for interpretation end and end of stream, everything else as JSON.
+    """
+    if kind in ("text", "sql"):
+        return payload
+    if kind == "interpretation_end":
+        return payload or "end_of_interpretation"
+    if kind == "done":
+        return "end_of_stream"
+    if kind in ("suggestions", "citations"):
+        return json.dumps({kind: payload})
+    return json.dumps(payload)
+
+
+def sse_frame(kind: str, payload) -> str:
+    """Named SSE event with a JSON data field"""
+    if kind in ("text", "sql"):
+        payload = {kind if kind == "text" else "statement": payload}
+    elif kind in ("suggestions", "citations"):
+        payload = {kind: payload}
+    elif payload is None:
+        payload = {}
+    return f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+
+async def format_stream(source, typed: bool = False):
+    """
+    Render the `(kind, payload)` events of a stream generator.
+
+    By default the legacy text protocol is produced. With `typed` every
+    event becomes a named SSE event (`text`, `sql`, `suggestions`,
+    `citations`, `rows`, `sql_result`, `meta`, `error`, `done`); interpretation end markers are
+    dropped and `done` is always sent last.
+    """
+    async for kind, payload in source:
+        if not typed:
+            frame = legacy_frame(kind, payload)
+            # Plain strings in legacy mode; tag everything but text so it is not coalesced with it
+            yield frame if kind == "text" else StreamMarker(frame)
+        elif kind not in ("done", "interpretation_end"):
+            yield sse_frame(kind, payload)
+    if typed:
+        yield sse_frame("done", None)
+
+
+class StreamStats:
+    """Per route time-to-first-token, chunk counts and client cancellations of the streamed responses"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def _route(self, route) -> dict:
+        return self._routes.setdefault(route, {
+            "streams": 0,
+            "ttft_seconds_total": 0.0,
+            "ttft_seconds_max": 0.0,
+            "ttft_seconds_last": 0.0,
+            "chunks_in": 0,
+            "chunks_out": 0,
+            "cancelled": 0,
+        })
+
+    def record_first_token(self, route, seconds: float):
+        with self._lock:
+            stats = self._route(route)
+            stats["streams"] += 1
+            stats["ttft_seconds_total"] += seconds
+            stats["ttft_seconds_max"] = max(stats["ttft_seconds_max"], seconds)
+            stats["ttft_seconds_last"] = seconds
+
+    def record_chunks(self, route, chunks_in: int, chunks_out: int):
+        with self._lock:
+            stats = self._route(route)
+            stats["chunks_in"] += chunks_in
+            stats["chunks_out"] += chunks_out
+
+    def record_cancelled(self, route):
+        with self._lock:
+            self._route(route)["cancelled"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            routes = {}
+            for route, stats in self._routes.items():
+                routes[route] = dict(
+                    stats,
+                    ttft_seconds_avg=stats["ttft_seconds_total"] / stats["streams"] if stats["streams"] else 0.0,
+                )
+            return {"flush_ms": STREAM_FLUSH_MS, "flush_bytes": STREAM_FLUSH_BYTES, "routes": routes}
+
+
+stream_stats = StreamStats()
+
+
+async def coalesce_stream(source, route: str, started_at: float = None,
+                          flush_ms: float = STREAM_FLUSH_MS, flush_bytes: int = STREAM_FLUSH_BYTES):
+    """
+    Merge the small text deltas of a streaming body into fewer, larger chunks.
+
+    The first delta is sent at once so time-to-first-token is not delayed;
+    after that text is buffered and flushed every `flush_ms` milliseconds or
+    once `flush_bytes` are pending, whichever comes first. Stream markers are
+    flushed on their own. `flush_ms <= 0` turns coalescing off. The time from
+    `started_at` (monotonic, defaults to now) to the first chunk is recorded
+    per route in `stream_stats`.
+    """
+    started_at = time.monotonic() if started_at is None else started_at
+    loop = asyncio.get_running_loop()
+    iterator = source.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    deadline = None
+    pending = None
+    first = True
+    chunks_in = 0
+    chunks_out = 0
+
+    def flush():
+        nonlocal buffer, buffered_bytes, deadline
+        chunk = (b"" if isinstance(buffer[0], bytes) else "").join(buffer)
+        buffer = []
+        buffered_bytes = 0
+        deadline = None
+        return chunk
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                chunks_out += 1
+                yield flush()
+                continue
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                break
+            chunks_in += 1
+            if first:
+                first = False
+                stream_stats.record_first_token(route, time.monotonic() - started_at)
+                chunks_out += 1
+                yield item
+                continue
+            if flush_ms <= 0 or is_stream_marker(item):
+                if buffer:
+                    chunks_out += 1
+                    yield flush()
+                chunks_out += 1
+                yield item
+                continue
+            buffer.append(item)
+            buffered_bytes += len(item)
+            if deadline is None:
+                deadline = loop.time() + flush_ms / 1000
+            if buffered_bytes >= flush_bytes:
+                chunks_out += 1
+                yield flush()
+        if buffer:
+            chunks_out += 1
+            yield flush()
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+        stream_stats.record_chunks(route, chunks_in, chunks_out)
+
+
+async def cancel_on_disconnect(source, request, route: str, on_cancel=None, poll_interval: float = STREAM_DISCONNECT_POLL):
+    """
+    Stop `source` as soon as the client of `request` goes away.
+
+    The request is polled every `poll_interval` seconds while the stream is
+    running. On a disconnect, or when the response task itself is cancelled,
+    the pending upstream read is cancelled and `source` is closed so its
+    upstream HTTP stream is released. `on_cancel()` is then called once and
+    the cancellation is counted for `route`.
+    """
+    iterator = source.__aiter__()
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(poll_interval)
+        disconnected.set()
+
+    watcher = asyncio.ensure_future(watch())
+    wait_disconnect = asyncio.ensure_future(disconnected.wait())
+    pending = None
+    finished = False
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({pending, wait_disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                logger.info(f"Client disconnected, cancelling {route} stream")
+                break
+            task, pending = pending, None
+            try:
+                item = task.result()
+            except StopAsyncIteration:
+                finished = True
+                break
+            except Exception:
+                finished = True
+                raise
+            yield item
+    finally:
+        watcher.cancel()
+        wait_disconnect.cancel()
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
+        if not finished:
+            stream_stats.record_cancelled(route)
+            if hasattr(iterator, "aclose"):
+                try:
+                    await iterator.aclose()
+                except Exception as e:
+                    logger.warning(f"Error closing cancelled {route} stream: {e}")
+            if on_cancel is not None:
+                try:
+                    on_cancel()
+                except Exception as e:
+                    logger.error(f"Error recording cancelled {route} stream: {e}")